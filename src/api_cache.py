@@ -0,0 +1,194 @@
+'''
+per-user TTL cache for Spotify API responses
+
+Streamlit reruns the whole script on every widget change, which would call
+the API again each time. CachedSpotify wraps a spotipy client and answers
+the endpoints listed in the cache's TTLs from a shared TTLCache:
+
+    cache = TTLCache(path='.api_cache')
+    sp = CachedSpotify(spotipy_client, cache, user_id)
+    sp.current_user_top_tracks(limit=50, time_range='short_term')  # api
+    sp.current_user_top_tracks(limit=50, time_range='short_term')  # cache
+
+Entries are keyed by (user id, endpoint, arguments), so users never see
+each other's data. The cache holds at most max_entries responses and
+evicts the least recently used. With a path, every entry is also written
+to its own json file there so a restarted process starts warm.
+'''
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+import perf
+
+
+DEFAULT_TTLS = {
+    'current_user': 60 * 60,
+    'current_user_top_artists': 6 * 60 * 60,
+    'current_user_top_tracks': 6 * 60 * 60,
+    'current_user_recently_played': 60,
+}
+
+API_CACHE_DIR = '.api_cache'
+
+
+def make_key(user_id: str, endpoint: str, args: tuple, kwargs: dict) -> str:
+    return json.dumps([user_id, endpoint, list(args), sorted(kwargs.items())], default=str)
+
+
+class TTLCache:
+    '''
+    thread-safe LRU cache whose entries expire after a per-endpoint TTL
+    '''
+
+    def __init__(
+        self,
+        ttls: Dict[str, float] | None = None,
+        max_entries: int = 512,
+        path: str | Path | None = None,
+    ):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.path = Path(path) if path is not None else None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._load()
+
+    def _file(self, key: str) -> Path:
+        return self.path / (hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def _load(self) -> None:
+        now = time.time()
+        entries = []
+
+        for file in self.path.glob('*.json'):
+            try:
+                with open(file) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            if entry['expires'] <= now:
+                file.unlink(missing_ok=True)
+            else:
+                entries.append(entry)
+
+        # oldest first, so the most recently written entries survive eviction
+        for entry in sorted(entries, key=lambda e: e['expires'])[-self.max_entries:]:
+            self._entries[entry['key']] = (entry['expires'], entry['value'])
+
+    def _persist(self, key: str, expires: float, value: Any) -> None:
+        file = self._file(key)
+        tmp_file = file.with_suffix('.tmp')
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'key': key, 'expires': expires, 'value': value}, f)
+            os.replace(tmp_file, file)
+        except (OSError, TypeError) as e:
+            print(f"Error persisting API cache entry: {e}")
+
+    def _drop(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self.path is not None:
+            self._file(key).unlink(missing_ok=True)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        '''
+        (True, value) for a live entry, (False, None) otherwise
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key: str, endpoint: str, value: Any) -> None:
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            return
+
+        expires = time.time() + ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+            if self.path is not None:
+                self._persist(key, expires, value)
+
+    def get_or_call(self, key: str, endpoint: str, call: Callable[[], Any]) -> Any:
+        hit, value = self.get(key)
+        if hit:
+            return value
+
+        value = call()
+        self.put(key, endpoint, value)
+        return value
+
+    def clear(self, user_id: str | None = None) -> None:
+        '''
+        drop every entry, or only the entries of one user
+        '''
+        with self._lock:
+            for key in list(self._entries):
+                if user_id is None or json.loads(key)[0] == user_id:
+                    self._drop(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+            }
+
+
+class CachedSpotify:
+    '''
+    spotipy client proxy that serves cacheable endpoints from a TTLCache
+    '''
+
+    def __init__(self, sp, cache: TTLCache, user_id: str):
+        self._sp = sp
+        self._cache = cache
+        self._user_id = user_id
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._sp, name)
+        if name not in self._cache.ttls or not callable(attr):
+            return attr
+
+        def cached(*args, **kwargs):
+            key = make_key(self._user_id, name, args, kwargs)
+            with perf.span(f'cache.{name}', 'api', cache_hit=True) as span:
+                def call():
+                    span.set(cache_hit=False)
+                    return attr(*args, **kwargs)
+
+                return self._cache.get_or_call(key, name, call)
+
+        return cached
@@ -1,9 +1,20 @@
+import hashlib
+import os
 import streamlit as st
 import pandas as pd
 from pathlib import Path
+import requests
 import spotipy
-from render import render_mini_wrapped_view
+from api_cache import API_CACHE_DIR, CachedSpotify, TTLCache
+from ingest import find_exports
+from render import render_history_view, render_mini_wrapped_view, render_perf_sidebar
+from resources import history_key, resource_stats, shared_history, shared_index, shared_metadata_cache
+from scheduler import BACKGROUND, INTERACTIVE, RequestScheduler, ScheduledSpotify
+from snapshot import SNAPSHOT_DIR, SnapshotStore, token_key
+from requests.adapters import HTTPAdapter
+from spotipy.cache_handler import MemoryCacheHandler
 from spotipy.oauth2 import SpotifyOAuth
+from urllib3.util.retry import Retry
 
 #from data import load_json, filter_period
 from stats import create_wrapped
@@ -11,16 +22,119 @@ from stats import create_wrapped
 
 SCOPES = "user-read-email user-top-read user-read-recently-played"
 
-def get_spotify_client() -> spotipy.Spotify | None:
+# exported streaming history shown below the dashboard when present
+HISTORY_DIR = Path(__file__).resolve().parent.parent / "data"
+
+# other Spotify API / accounts hosts, e.g. fake_api.py for offline testing:
+# SPOTIFY_API_URL=http://127.0.0.1:8765/v1/ SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:8765
+SPOTIFY_API_URL = os.environ.get("SPOTIFY_API_URL")
+SPOTIFY_ACCOUNTS_URL = os.environ.get("SPOTIFY_ACCOUNTS_URL")
+
+# enough pooled connections for every concurrent call in stats.API_POOL
+HTTP_POOL_SIZE = 16
+
+# process-wide budget for Spotify calls, see scheduler.py
+API_RATE_PER_S = 10
+API_BURST = 20
+API_CONCURRENCY = 8
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
     """
-    Handle Spotify OAuth and return an authenticated Spotipy client.
+    One pooled HTTP session shared by every Spotify client in the process,
+    so concurrent API calls reuse keep-alive connections.
+    """
+    # 429s are left to the scheduler, which backs off for every session at once
+    retry = Retry(
+        total=3,
+        status_forcelist=(500, 502, 503, 504),
+        backoff_factor=0.3,
+        allowed_methods=False,
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_scheduler() -> RequestScheduler:
+    """
+    Every Spotify call of every session is queued here.
+    """
+    return RequestScheduler(rate=API_RATE_PER_S, burst=API_BURST, max_concurrency=API_CONCURRENCY)
+
+
+@st.cache_resource
+def get_api_cache() -> TTLCache:
+    """
+    Process-wide Spotify response cache, persisted so restarts stay warm.
+    Entries are keyed per user.
+    """
+    return TTLCache(path=API_CACHE_DIR)
+
+
+@st.cache_resource
+def get_snapshot_store() -> SnapshotStore:
+    return SnapshotStore(SNAPSHOT_DIR)
+
+
+# snapshots younger than this are shown without starting a refresh
+SNAPSHOT_MAX_AGE_S = 60
+
+
+@st.fragment(run_every=1.0)
+def wait_for_refresh(snapshots: SnapshotStore, user_id: str):
+    """
+    Poll the background refresh and rerun the page once it has finished.
+    """
+    if snapshots.refreshing(user_id) is None:
+        st.rerun()
+    st.caption("Refreshing…")
+
+
+def make_client(access_token: str, priority: int = INTERACTIVE) -> ScheduledSpotify:
+    """
+    Spotipy client whose calls go through the shared scheduler. Calls are
+    coalesced per access token, so reruns of a session share requests.
     """
+    sp = spotipy.Spotify(auth=access_token, requests_session=get_http_session())
+    if SPOTIFY_API_URL:
+        sp.prefix = SPOTIFY_API_URL
+
+    owner = hashlib.sha256(access_token.encode()).hexdigest()[:16]
+    return ScheduledSpotify(sp, get_scheduler(), owner, priority)
+
 
+def make_oauth(client_id: str, client_secret: str, redirect_uri: str, **kwargs) -> SpotifyOAuth:
     sp_oauth = SpotifyOAuth(
+        client_id=client_id,
+        client_secret=client_secret,
+        redirect_uri=redirect_uri,
+        scope=SCOPES,
+        **kwargs,
+    )
+    if SPOTIFY_ACCOUNTS_URL:
+        sp_oauth.OAUTH_AUTHORIZE_URL = SPOTIFY_ACCOUNTS_URL.rstrip("/") + "/authorize"
+        sp_oauth.OAUTH_TOKEN_URL = SPOTIFY_ACCOUNTS_URL.rstrip("/") + "/api/token"
+    return sp_oauth
+
+
+def get_spotify_client() -> ScheduledSpotify | None:
+    """
+    Handle Spotify OAuth and return an authenticated Spotipy client.
+    """
+
+    sp_oauth = make_oauth(
         client_id=st.secrets["SPOTIFY_CLIENT_ID"],
         client_secret=st.secrets["SPOTIFY_CLIENT_SECRET"],
         redirect_uri=st.secrets["SPOTIFY_REDIRECT_URI"],
-        scope=SCOPES,
+        # a token per session, never a .cache file shared by all users
+        cache_handler=MemoryCacheHandler(),
     )
 
     if "spotify_token" in st.session_state:
@@ -28,7 +142,7 @@ def get_spotify_client() -> spotipy.Spotify | None:
         if sp_oauth.is_token_expired(token_info):
             token_info = sp_oauth.refresh_access_token(token_info["refresh_token"])
             st.session_state["spotify_token"] = token_info
-        return spotipy.Spotify(auth=token_info["access_token"])
+        return make_client(token_info["access_token"])
 
     params = st.query_params
     raw = params.get("code", None)
@@ -40,11 +154,14 @@ def get_spotify_client() -> spotipy.Spotify | None:
 
     if code and "spotify_token" not in st.session_state:
         try:
-            token_info = sp_oauth.get_access_token(code, as_dict=True)
+            # as_dict=True is deprecated, the full token (refresh token
+            # included) is read back from the memory cache
+            sp_oauth.get_access_token(code, as_dict=False, check_cache=False)
+            token_info = sp_oauth.get_cached_token()
             st.session_state["spotify_token"] = token_info
             st.query_params.clear()
 
-            return spotipy.Spotify(auth=token_info["access_token"])
+            return make_client(token_info["access_token"])
 
         except Exception as e:
             st.error(f"Error during Spotify authentication: {e}")
@@ -64,13 +181,87 @@ def main():
     if sp is None:
         st.stop()
 
-    user = sp.current_user()
+    cache = get_api_cache()
+    snapshots = get_snapshot_store()
+    header = st.container()
+    st.markdown("---")
+    dashboard = st.empty()
+
+    # a known token names its user without asking the API, so the last
+    # snapshot is drawn before any call
+    key = token_key(st.session_state["spotify_token"])
+    user_id = st.session_state.get("spotify_user_id") or snapshots.owner(key)
+    snapshot = snapshots.load(user_id) if user_id else None
+    if snapshot is not None:
+        with dashboard.container():
+            render_mini_wrapped_view(snapshot)
+
+    # the profile is needed to key the cache, fetch it once per session.
+    # it is cached per user, or per token while the user is not known yet
+    if "spotify_user" not in st.session_state:
+        st.session_state["spotify_user"] = CachedSpotify(sp, cache, user_id or f"token-{key}").current_user()
+    user = st.session_state["spotify_user"]
+    st.session_state["spotify_user_id"] = user["id"]
+    snapshots.set_owner(key, user["id"])
+
+    sp = CachedSpotify(sp, cache, user["id"])
+    # same user and token, but queued behind interactive calls
+    background_sp = CachedSpotify(
+        make_client(st.session_state["spotify_token"]["access_token"], priority=BACKGROUND),
+        cache,
+        user["id"],
+    )
+
     display_name = user.get("display_name", "Spotify user")
-    st.success(f"{display_name} logged in")
+    header.success(f"{display_name} logged in")
 
-    st.markdown("---")
+    # render the last snapshot right away, refresh it in the background
+    if snapshot is None:
+        snapshot = snapshots.load(user["id"])
+        if snapshot is None:
+            with st.spinner("Loading your Spotify data…"):
+                snapshot = snapshots.fetch(sp, user["id"])
+        with dashboard.container():
+            render_mini_wrapped_view(snapshot)
+    if snapshots.age(snapshot) > SNAPSHOT_MAX_AGE_S:
+        snapshots.refresh(background_sp, user["id"])
+
+    if snapshots.refreshing(user["id"]) is not None:
+        wait_for_refresh(snapshots, user["id"])
+
+    if find_exports(HISTORY_DIR):
+        st.markdown("---")
+        with st.expander("Streaming history export"):
+            # one shared copy per process, the session only holds a reference
+            history_cache_key = history_key(HISTORY_DIR)
+            st.session_state["history"] = shared_history(HISTORY_DIR)
+            st.session_state["history_index"] = shared_index(HISTORY_DIR)
+            render_history_view(
+                st.session_state["history"],
+                hash(history_cache_key),
+                st.session_state["history_index"],
+                sp=sp,
+                metadata=shared_metadata_cache(),
+            )
+
+    cache_stats = cache.stats()
+    st.sidebar.caption(
+        f"API cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+        f"{cache_stats['entries']} entries"
+    )
+    scheduler_stats = get_scheduler().stats()
+    st.sidebar.caption(
+        f"API scheduler: {scheduler_stats['queued']} queued, {scheduler_stats['in_flight']} in flight, "
+        f"{scheduler_stats['coalesced']} coalesced, {scheduler_stats['throttled']} throttled, "
+        f"{scheduler_stats['rate_limited']} rate limited"
+    )
+    history_stats = resource_stats()["histories"]
+    st.sidebar.caption(
+        f"Shared histories: {history_stats['alive']} loaded, "
+        f"{history_stats['hits']} reuses, {history_stats['loads']} loads"
+    )
 
-    render_mini_wrapped_view(sp)
+    render_perf_sidebar()
 
 
 
@@ -0,0 +1,364 @@
+'''
+timing helpers for the data pipeline
+
+usage:
+    python src/bench.py load data
+    python src/bench.py ingest data --workers 1 2 4 8
+    python src/bench.py memory data
+    python src/bench.py summary data --period '12 months'
+    python src/bench.py suite --scale 1m --save
+    python src/bench.py suite --scale 1m --threshold 0.25
+
+The suite runs the pipeline on a synthetic history (see synth.py) and
+records wall time and peak memory of every step in a json baseline, later
+runs are compared against it and exit with status 1 on a regression.
+'''
+import argparse
+import json
+import platform
+import shutil
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import stats
+from calendar_stats import calendar_summary
+from chunked import stream_summary
+from data import CACHE_DIR_NAME, PERIOD_MONTHS, filter_period, load_json
+from history import CompactHistory
+from ingest import concat_exports, find_exports, parse_exports
+from query import HistoryIndex
+from sessions import session_summary
+from sketches import HistorySketch
+from synth import SCALES, SyntheticSpotify, catalog_size, ensure_history
+
+
+BENCH_DATA_DIR = '.bench_data'
+BASELINE_PATH = 'bench_baseline.json'
+REGRESSION_THRESHOLD = 0.2
+# differences below these are noise, whatever the ratio
+MIN_DELTA = {'time_s': 0.002, 'peak_bytes': 256 * 1024}
+
+
+def time_load(directory_path: str | Path, repeat: int = 3) -> dict:
+    '''
+    time load_json without cache, with a cold cache and with a warm cache
+
+    the cache directory is cleared first so the cold run re-parses every file
+    '''
+    directory_path = Path(directory_path)
+    shutil.rmtree(directory_path / CACHE_DIR_NAME, ignore_errors=True)
+
+    start = time.perf_counter()
+    df = load_json(directory_path, use_cache=False)
+    uncached = time.perf_counter() - start
+
+    start = time.perf_counter()
+    load_json(directory_path)
+    cold = time.perf_counter() - start
+
+    warm_runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load_json(directory_path)
+        warm_runs.append(time.perf_counter() - start)
+
+    return {
+        'rows': len(df),
+        'uncached_s': uncached,
+        'cold_s': cold,
+        'warm_s': min(warm_runs),
+    }
+
+
+def time_ingest(directory_path: str | Path, workers: list[int]) -> dict:
+    '''
+    time parsing + concatenating every export with different process pool sizes
+    '''
+    paths = find_exports(directory_path)
+
+    timings = {}
+    for n in workers:
+        start = time.perf_counter()
+        df = concat_exports(parse_exports(paths, workers=n))
+        timings[n] = time.perf_counter() - start
+
+    return {'rows': len(df), 'files': len(paths), 'timings_s': timings}
+
+
+def history_memory(directory_path: str | Path) -> dict:
+    '''
+    resident bytes of the loaded history as object strings, as categoricals
+    and as a CompactHistory
+    '''
+    df = load_json(directory_path)
+    objects = df.astype({'artistName': object, 'trackName': object, 'msPlayed': 'int64'})
+    compact = CompactHistory.from_frame(df)
+
+    return {
+        'rows': len(df),
+        'object_bytes': int(objects.memory_usage(deep=True).sum()),
+        'categorical_bytes': int(df.memory_usage(deep=True).sum()),
+        'compact_bytes': compact.nbytes,
+    }
+
+
+def time_summary(directory_path: str | Path, period: str = 'all time', repeat: int = 5) -> dict:
+    '''
+    compute_summary once vs calling every stats.get_* function on its own
+    '''
+    df = load_json(directory_path)
+
+    def separate():
+        period_df = filter_period(df, period)
+        stats.get_top_5_artists(period_df)
+        stats.get_top_5_songs(period_df)
+        stats.get_top_5_songs_artist(period_df)
+        stats.get_listening_time(period_df)
+        stats.get_listening_time_per_day(period_df)
+
+    def combined():
+        stats.compute_summary(df, period)
+
+    timings = {}
+    for name, func in (('separate', separate), ('compute_summary', combined)):
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - start)
+        timings[name] = min(runs)
+
+    return {'rows': len(df), 'timings_s': timings}
+
+
+def measure(func: Callable[[], object], repeat: int = 3) -> dict:
+    '''
+    best wall time of `repeat` runs and the peak memory of one more run
+
+    memory is traced separately because tracemalloc slows the traced run
+    down. it sees python and numpy allocations, not the ones pyarrow makes
+    or the ones in worker processes
+    '''
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'time_s': min(runs), 'peak_bytes': peak}
+
+
+def suite_cases(directory_path: Path) -> Dict[str, Callable[[], object]]:
+    '''
+    name -> function for every benchmarked step, inputs are prepared here
+    so only the step itself is measured
+    '''
+    from render import build_artist_options, build_artist_tracks, build_recent, build_top_artists, build_top_tracks
+
+    df = load_json(directory_path)
+    last_year = int(df['endTime'].max().year) - 1
+
+    sp = SyntheticSpotify(n_artists=catalog_size(len(df)))
+    artists_df = stats.fetch_top_artists(sp)
+    tracks_df = stats.fetch_top_tracks(sp)
+    recent_df = stats.fetch_recent_streams(sp)
+    top5_artists = build_top_artists(artists_df, tracks_df)
+    options, use_ids = build_artist_options(top5_artists)
+    selected_name, selected_key = next(iter(options.items()))
+
+    def load_uncached():
+        shutil.rmtree(directory_path / CACHE_DIR_NAME, ignore_errors=True)
+        load_json(directory_path, use_cache=False)
+
+    cases = {
+        'load_json[uncached]': load_uncached,
+        'load_json[warm cache]': lambda: load_json(directory_path),
+    }
+
+    for period in (*PERIOD_MONTHS, last_year):
+        cases[f'filter_period[{period}]'] = lambda period=period: filter_period(df, period)
+
+    for name in (
+        'get_top_5_artists',
+        'get_top_5_songs',
+        'get_top_5_songs_artist',
+        'get_listening_time',
+        'get_listening_time_per_day',
+    ):
+        cases[f'stats.{name}'] = lambda func=getattr(stats, name): func(df)
+    cases['stats.compute_summary'] = lambda: stats.compute_summary(df)
+    cases['calendar_stats.calendar_summary'] = lambda: calendar_summary(df)
+    cases['chunked.stream_summary'] = lambda: stream_summary(directory_path)
+
+    history = CompactHistory.from_frame(df)
+    cases['query.HistoryIndex'] = lambda: HistoryIndex(history)
+    index = HistoryIndex(history)
+    top_artist = index.artists_by_time()[0]
+    for period in ('3 months', 'all time'):
+        cases[f'query.artist_top_tracks[{period}]'] = (
+            lambda period=period: index.artist_top_tracks(top_artist, period, k=20)
+        )
+    cases['sessions.session_summary'] = lambda: session_summary(history)
+    cases['sketches.HistorySketch'] = lambda: HistorySketch.from_history(history)
+
+    cases.update({
+        'render.build_top_artists': lambda: build_top_artists(artists_df, tracks_df),
+        'render.build_top_tracks': lambda: build_top_tracks(tracks_df),
+        'render.build_artist_options': lambda: build_artist_options(top5_artists),
+        'render.build_artist_tracks': lambda: build_artist_tracks(tracks_df, selected_key, selected_name, use_ids),
+        'render.build_recent': lambda: build_recent(recent_df),
+    })
+
+    return cases
+
+
+def run_suite(scale: str, data_dir: str | Path = BENCH_DATA_DIR, repeat: int = 5, seed: int = 0) -> dict:
+    '''
+    generate (once) the synthetic history for `scale` and measure every case
+    '''
+    directory_path = ensure_history(Path(data_dir) / scale, SCALES[scale], seed=seed)
+    # warm the cache the warm-cache case reads, the uncached case rebuilds it
+    rows = len(load_json(directory_path))
+
+    results = {}
+    for name, func in suite_cases(directory_path).items():
+        results[name] = measure(func, repeat)
+        print(f"{name:<40} {results[name]['time_s'] * 1000:10.2f} ms {results[name]['peak_bytes'] / 2**20:10.2f} MiB", flush=True)
+
+    return {
+        'scale': scale,
+        'rows': rows,
+        'seed': seed,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cases': results,
+    }
+
+
+def read_baseline(path: str | Path) -> dict:
+    '''
+    {scale: suite result}, empty if there is no baseline yet
+    '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_baseline(path: str | Path, result: dict) -> None:
+    baseline = read_baseline(path)
+    baseline[result['scale']] = result
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+
+
+def find_regressions(result: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    '''
+    one line per case and metric that got more than `threshold` worse
+    (and worse by more than MIN_DELTA)
+    '''
+    regressions = []
+    for name, new in result['cases'].items():
+        old = baseline.get('cases', {}).get(name)
+        if old is None:
+            continue
+        for metric in ('time_s', 'peak_bytes'):
+            if new[metric] - old[metric] < MIN_DELTA[metric]:
+                continue
+            if new[metric] > old[metric] * (1 + threshold):
+                regressions.append(f"{name} {metric}: {old[metric]:.6g} -> {new[metric]:.6g} (+{new[metric] / old[metric] - 1:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spotify analytics benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    load = sub.add_parser('load', help='cold vs warm load_json timings')
+    load.add_argument('directory', help='directory with the json exports')
+    load.add_argument('--repeat', type=int, default=3)
+
+    ingest = sub.add_parser('ingest', help='parallel ingestion timings')
+    ingest.add_argument('directory', help='directory with the json exports')
+    ingest.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+
+    memory = sub.add_parser('memory', help='memory per loaded history')
+    memory.add_argument('directory', help='directory with the json exports')
+
+    summary = sub.add_parser('summary', help='compute_summary vs separate stats calls')
+    summary.add_argument('directory', help='directory with the json exports')
+    summary.add_argument('--period', default='all time')
+    summary.add_argument('--repeat', type=int, default=5)
+
+    suite = sub.add_parser('suite', help='benchmark suite on synthetic data, compared to a baseline')
+    suite.add_argument('--scale', choices=SCALES, default='100k')
+    suite.add_argument('--data-dir', default=BENCH_DATA_DIR, help='where the synthetic histories are generated')
+    suite.add_argument('--baseline', default=BASELINE_PATH, help='json file with the baseline results')
+    suite.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='allowed slowdown, 0.2 = 20%%')
+    suite.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    suite.add_argument('--repeat', type=int, default=5)
+    suite.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.command == 'load':
+        result = time_load(args.directory, repeat=args.repeat)
+        print(f"rows:       {result['rows']}")
+        print(f"no cache:   {result['uncached_s'] * 1000:.1f} ms")
+        print(f"cold cache: {result['cold_s'] * 1000:.1f} ms")
+        print(f"warm cache: {result['warm_s'] * 1000:.1f} ms")
+        print(f"speedup:    {result['uncached_s'] / result['warm_s']:.1f}x")
+
+    elif args.command == 'ingest':
+        result = time_ingest(args.directory, args.workers)
+        print(f"rows: {result['rows']} in {result['files']} files")
+        single = result['timings_s'][args.workers[0]]
+        for n, seconds in result['timings_s'].items():
+            print(f"workers={n:<3} {seconds * 1000:8.1f} ms  ({single / seconds:.2f}x)")
+
+    elif args.command == 'memory':
+        result = history_memory(args.directory)
+        print(f"rows:         {result['rows']}")
+        # load_json returns the categorical frame, the object one is for reference
+        frame = result['categorical_bytes']
+        for label, key in (('object', 'object_bytes'), ('categorical', 'categorical_bytes'), ('compact', 'compact_bytes')):
+            print(f"{label + ':':<13} {result[key] / 2**20:8.2f} MiB  ({result[key] / frame:.2f}x load_json)")
+
+    elif args.command == 'summary':
+        result = time_summary(args.directory, period=args.period, repeat=args.repeat)
+        print(f"rows: {result['rows']}")
+        for name, seconds in result['timings_s'].items():
+            print(f"{name + ':':<17} {seconds * 1000:8.1f} ms")
+
+    elif args.command == 'suite':
+        result = run_suite(args.scale, data_dir=args.data_dir, repeat=args.repeat, seed=args.seed)
+        baseline = read_baseline(args.baseline).get(args.scale)
+
+        if args.save:
+            save_baseline(args.baseline, result)
+            print(f"saved baseline for {args.scale} to {args.baseline}")
+        elif baseline is None:
+            print(f"no baseline for {args.scale} in {args.baseline}, run with --save to create one")
+        else:
+            regressions = find_regressions(result, baseline, args.threshold)
+            if regressions:
+                print(f"{len(regressions)} regressions beyond {args.threshold:.0%}:")
+                for line in regressions:
+                    print(f"  {line}")
+                sys.exit(1)
+            print(f"no regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+'''
+calendar aggregations on integer day and hour indices
+
+Timestamps are turned into minutes since 1970-01-01 once and the plays
+are accumulated into a grid of ms played (and plays) per calendar day and
+hour of the day. That is the only pass over the plays, O(n) with no
+object columns:
+
+- plays sorted by time (CompactHistory, load_json frames) are split at
+  the hour boundaries with a binary search and summed with one cumsum
+- unsorted plays go through np.bincount on the hour index
+
+Everything else is derived from the grid (24 entries per calendar day, a
+few hundred thousand at most):
+
+    weekday_averages      average ms per weekday, over the days with plays
+    weekday_hour_heatmap  7 x 24 weekday-by-hour listening
+    monthly_totals        ms played per calendar month
+    streaks               longest and current run of days with plays
+
+Grids of separate chunks of plays add up with merge_grids.
+
+Times are the wall clock times of the export, weekdays are indexed like
+WEEKDAYS (Sunday first).
+'''
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from history import CompactHistory, MINUTES_PER_DAY
+
+
+WEEKDAYS = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+# 1970-01-01 was a Thursday
+EPOCH_WEEKDAY = 4
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def play_minutes(df: pd.DataFrame | CompactHistory) -> np.ndarray:
+    '''
+    minutes since 1970-01-01 of every play
+    '''
+    if isinstance(df, CompactHistory):
+        return df.minutes
+
+    end_time = df['endTime']
+    if end_time.dt.tz is not None:
+        end_time = end_time.dt.tz_localize(None)
+    return end_time.to_numpy().astype('datetime64[m]').view(np.int64)
+
+
+@dataclass(frozen=True)
+class CalendarGrid:
+    '''
+    ms played and plays per hour, one row per calendar day from the first
+    to the last day with plays
+    '''
+    first_day: int
+    hourly_ms: np.ndarray
+    hourly_plays: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.hourly_ms)
+
+    @property
+    def ms(self) -> np.ndarray:
+        '''
+        ms played per day
+        '''
+        return self.hourly_ms.sum(axis=1)
+
+    @property
+    def plays(self) -> np.ndarray:
+        return self.hourly_plays.sum(axis=1)
+
+    @property
+    def days(self) -> np.ndarray:
+        '''
+        days since 1970-01-01 of every row
+        '''
+        return np.arange(self.first_day, self.first_day + len(self))
+
+    @property
+    def dates(self) -> np.ndarray:
+        return self.days.astype('datetime64[D]')
+
+    @property
+    def weekdays(self) -> np.ndarray:
+        return (self.days + EPOCH_WEEKDAY) % 7
+
+    @property
+    def played(self) -> np.ndarray:
+        return self.plays > 0
+
+
+def calendar_grid(minutes: np.ndarray, ms_played: np.ndarray, is_sorted: bool = False) -> CalendarGrid:
+    '''
+    accumulate the plays into a CalendarGrid, pass is_sorted=True when
+    minutes is non-decreasing to use the binary search path
+    '''
+    if not len(minutes):
+        return CalendarGrid(0, np.zeros((0, 24), dtype=np.int64), np.zeros((0, 24), dtype=np.int64))
+
+    if is_sorted:
+        first_day = int(minutes[0]) // MINUTES_PER_DAY
+        n_days = int(minutes[-1]) // MINUTES_PER_DAY - first_day + 1
+
+        # index of the first play at or after every hour boundary
+        edges = (first_day * MINUTES_PER_DAY + np.arange(n_days * 24 + 1) * 60).astype(minutes.dtype)
+        bounds = np.searchsorted(minutes, edges)
+        cumulative = np.concatenate(([0], np.cumsum(ms_played, dtype=np.int64)))
+
+        hourly_ms = np.diff(cumulative[bounds])
+        hourly_plays = np.diff(bounds)
+    else:
+        first_day = int(minutes.min()) // MINUTES_PER_DAY
+        hours = (minutes.astype(np.int64) - first_day * MINUTES_PER_DAY) // 60
+        n_hours = (int(hours.max()) // 24 + 1) * 24
+
+        hourly_ms = np.bincount(hours, weights=ms_played, minlength=n_hours).astype(np.int64)
+        hourly_plays = np.bincount(hours, minlength=n_hours)
+
+    return CalendarGrid(first_day, hourly_ms.reshape(-1, 24), hourly_plays.reshape(-1, 24))
+
+
+def merge_grids(grids: list) -> CalendarGrid:
+    '''
+    CalendarGrid of the plays of all the grids together, e.g. of the chunks
+    of a history accumulated one at a time
+    '''
+    grids = [grid for grid in grids if len(grid)]
+    if not grids:
+        return calendar_grid(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    if len(grids) == 1:
+        return grids[0]
+
+    first_day = min(grid.first_day for grid in grids)
+    n_days = max(grid.first_day + len(grid) for grid in grids) - first_day
+
+    hourly_ms = np.zeros((n_days, 24), dtype=np.int64)
+    hourly_plays = np.zeros((n_days, 24), dtype=np.int64)
+    for grid in grids:
+        rows = slice(grid.first_day - first_day, grid.first_day - first_day + len(grid))
+        hourly_ms[rows] += grid.hourly_ms
+        hourly_plays[rows] += grid.hourly_plays
+
+    return CalendarGrid(first_day, hourly_ms, hourly_plays)
+
+
+def frame_grid(df: pd.DataFrame | CompactHistory) -> CalendarGrid:
+    '''
+    CalendarGrid of a load_json dataframe or a CompactHistory
+    '''
+    if isinstance(df, CompactHistory):
+        # rows of a CompactHistory are always sorted by time
+        return calendar_grid(df.minutes, df.ms_played, is_sorted=True)
+
+    return calendar_grid(
+        play_minutes(df),
+        df['msPlayed'].to_numpy(),
+        is_sorted=df['endTime'].is_monotonic_increasing,
+    )
+
+
+def weekday_averages(grid: CalendarGrid) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    average ms per weekday over the days with plays (nan for weekdays
+    without any) and the number of those days
+    '''
+    played = grid.played
+    weekdays = grid.weekdays[played]
+    totals = np.bincount(weekdays, weights=grid.ms[played], minlength=7)
+    days = np.bincount(weekdays, minlength=7)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / days, days
+
+
+def weekday_hour_heatmap(grid: CalendarGrid) -> np.ndarray:
+    '''
+    7 x 24 total ms played per weekday (Sunday first) and hour of the day
+    '''
+    weekdays = grid.weekdays
+    heatmap = np.zeros((7, 24), dtype=np.int64)
+    for weekday in range(7):
+        heatmap[weekday] = grid.hourly_ms[weekdays == weekday].sum(axis=0)
+    return heatmap
+
+
+def monthly_totals(grid: CalendarGrid) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    every month from the first to the last play (datetime64[M]) and the ms
+    played in it
+    '''
+    if not len(grid):
+        return np.zeros(0, dtype='datetime64[M]'), np.zeros(0, dtype=np.int64)
+
+    months = grid.dates.astype('datetime64[M]')
+    offsets = (months - months[0]).astype(np.int64)
+    totals = np.bincount(offsets, weights=grid.ms).astype(np.int64)
+    return months[0] + np.arange(len(totals)), totals
+
+
+def streaks(grid: CalendarGrid) -> dict:
+    '''
+    longest run of consecutive days with plays, and the run that ends on
+    the last day with plays
+    '''
+    played = grid.played.astype(np.int8)
+    if not played.any():
+        return {'longest_days': 0, 'longest_start': None, 'longest_end': None, 'current_days': 0}
+
+    # runs start where played goes 0 -> 1 and end where it goes 1 -> 0
+    edges = np.diff(np.concatenate(([0], played, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    lengths = ends - starts
+
+    longest = int(np.argmax(lengths))
+    dates = grid.dates
+    return {
+        'longest_days': int(lengths[longest]),
+        'longest_start': dates[starts[longest]],
+        'longest_end': dates[ends[longest] - 1],
+        'current_days': int(lengths[-1]),
+    }
+
+
+def calendar_summary(df: pd.DataFrame | CompactHistory) -> dict:
+    '''
+    display frames for a load_json dataframe or a CompactHistory
+
+        daily          date, msPlayed, plays for every calendar day
+        weekday_hours  weekday, msPlayed, Hours: average per day with plays
+        heatmap        weekdays x hours 0-23, average hours per calendar
+                       occurrence of the weekday
+        monthly        month, msPlayed, Hours
+        streaks        see streaks()
+    '''
+    grid = frame_grid(df)
+
+    averages, _ = weekday_averages(grid)
+    heatmap = weekday_hour_heatmap(grid)
+    calendar_days = np.bincount(grid.weekdays, minlength=7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        heatmap_hours = heatmap / calendar_days[:, None] / 1000 / 60 / 60
+
+    months, month_ms = monthly_totals(grid)
+
+    return {
+        'daily': pd.DataFrame({'date': grid.dates, 'msPlayed': grid.ms, 'plays': grid.plays}),
+        'weekday_hours': weekday_hours_frame(averages),
+        'heatmap': pd.DataFrame(heatmap_hours.round(3), index=WEEKDAYS, columns=range(24)),
+        'monthly': pd.DataFrame({
+            'month': months,
+            'msPlayed': month_ms,
+            'Hours': (month_ms / 1000 / 60 / 60).round(2),
+        }),
+        'streaks': streaks(grid),
+    }
+
+
+def weekday_hours_frame(averages: np.ndarray) -> pd.DataFrame:
+    '''
+    weekday, msPlayed, Hours rows for the weekdays that have an average
+    '''
+    present = np.flatnonzero(~np.isnan(averages))
+    weekday_avg = pd.DataFrame({
+        'weekday': pd.Categorical(np.asarray(WEEKDAYS)[present], categories=WEEKDAYS, ordered=True),
+        'msPlayed': averages[present],
+    })
+    weekday_avg['Hours'] = (weekday_avg['msPlayed'] / 1000 / 60 / 60).round(2)
+    return weekday_avg
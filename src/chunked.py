@@ -0,0 +1,338 @@
+'''
+out-of-core stats for histories that do not fit in memory
+
+load_json parses every export into one frame before anything is counted.
+Here the exports are streamed instead, a bounded chunk at a time, and only
+mergeable aggregates are kept:
+
+    iter_records    lists of the records of one export, decoded from a few
+                    MB of json text at a time
+    iter_chunks     export-schema frames of those lists, over every export
+    PartialSummary  ms per (artist, track), total ms and a CalendarGrid of
+                    some plays, partial states add up with merge()
+    stream_summary  compute_summary of a directory, one chunk in memory
+
+Peak memory is one chunk plus the merged state. memory_limit_mb bounds
+the chunk (decoded records, its frame and the read buffer), the state
+comes on top: about 300 bytes per distinct track and 400 per calendar day,
+so it grows with the catalog, not with the number of plays. Top lists are
+only picked at the end, from the exact per-track totals, so stream_summary
+returns the same values as compute_summary(load_json(directory), period).
+
+Relative periods ('1 month', ...) start from the latest play, which takes
+an extra pass over the files to find.
+
+usage:
+    python src/chunked.py data --period '12 months' --memory-limit-mb 64
+'''
+import argparse
+import json
+import re
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+import perf
+from calendar_stats import CalendarGrid, frame_grid, merge_grids
+from data import PERIOD_MONTHS, period_bounds
+from ingest import find_exports, frame_from_records
+from stats import SUMMARY_METRICS, summary_from_aggregates, track_aggregates
+
+
+DEFAULT_MEMORY_LIMIT_MB = 256
+READ_BLOCK_CHARS = 1 << 20
+# memory per byte of json in a chunk: the decoded dicts and strings take
+# about 11 bytes, the chunk frame, groupby temporaries and read buffer the rest
+MEMORY_PER_JSON_BYTE = 16
+MIN_CHUNK_BYTES = 64 * 1024
+
+# candidate record ends tried before decoding one record at a time
+MAX_BOUNDARY_TRIES = 4
+
+_decoder = json.JSONDecoder()
+_SEPARATORS = ', \t\r\n'
+_SEPARATOR = re.compile(r'[\s,]*')
+
+
+def chunk_bytes_for(memory_limit_mb: float) -> int:
+    '''
+    json text per chunk that keeps a chunk within memory_limit_mb
+    '''
+    return max(MIN_CHUNK_BYTES, int(memory_limit_mb * 2**20) // MEMORY_PER_JSON_BYTE)
+
+
+def _decode_complete(buffer: str, pos: int) -> Tuple[list, int]:
+    '''
+    the complete records in buffer from pos on, and where the last one ends
+
+    text up to a '}' only decodes as a list when that '}' closes a record,
+    a cut inside a string or record never does. the last '}' almost always
+    is one, so the whole run is decoded in one call. records with nested
+    values or many '}' in their names go through raw_decode one at a time
+    '''
+    end = buffer.rfind('}', pos)
+    for _ in range(MAX_BOUNDARY_TRIES):
+        if end < 0:
+            return [], pos
+        try:
+            return _loads(f"[{buffer[pos:end + 1].lstrip(_SEPARATORS)}]"), end + 1
+        except ValueError:
+            end = buffer.rfind('}', pos, end)
+
+    records = []
+    while True:
+        try:
+            record, end = _decoder.raw_decode(buffer, _SEPARATOR.match(buffer, pos).end())
+        except json.JSONDecodeError:
+            return records, pos
+        records.append(record)
+        pos = end
+
+
+def iter_records(path: str | Path, chunk_bytes: int) -> Iterator[list]:
+    '''
+    the records of a json array export in lists decoded from about
+    chunk_bytes of text each
+
+    the file is read at most READ_BLOCK_CHARS at a time, a record cut off
+    at the end of a block is decoded once the rest of it is read
+    '''
+    block_chars = min(READ_BLOCK_CHARS, chunk_bytes)
+
+    with open(path, encoding='utf-8') as f:
+        buffer = f.read(block_chars)
+        pos = _SEPARATOR.match(buffer).end()
+        if buffer[pos:pos + 1] != '[':
+            raise ValueError(f"{path} is not a streaming history export")
+        pos += 1
+
+        records: list = []
+        size = 0
+
+        while True:
+            decoded, end = _decode_complete(buffer, pos)
+            records.extend(decoded)
+            size += end - pos
+            pos = end
+
+            if size >= chunk_bytes:
+                yield records
+                records = []
+                size = 0
+
+            block = f.read(block_chars)
+            if not block:
+                break
+            buffer = buffer[pos:] + block
+            pos = 0
+
+        if buffer[pos:].strip(_SEPARATORS) != ']':
+            raise ValueError(f"{path} is not a streaming history export, unexpected end of the array")
+
+        if records:
+            yield records
+
+
+def iter_chunks(paths: Iterable[str | Path], chunk_bytes: int) -> Iterator[pd.DataFrame]:
+    '''
+    export-schema frames (see ingest.py) of every export in paths, at most
+    about chunk_bytes of json each
+    '''
+    for path in paths:
+        for records in iter_records(path, chunk_bytes):
+            yield frame_from_records(records)
+
+
+def _names(values: pd.Index) -> list:
+    # missing names become None, nan keys would never compare equal
+    values = values.astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def _name_order(key: Tuple[str | None, str | None]) -> tuple:
+    # same order as the sorted categories of a load_json frame, missing last
+    artist, track = key
+    return (artist is None, artist or '', track is None, track or '')
+
+
+class PartialSummary:
+    '''
+    aggregates of some of the plays that add up with the aggregates of the
+    others: ms per (artist, track), total ms and a CalendarGrid
+
+    rows without a track name keep a None track, they still count for
+    their artist like in stats._aggregate
+    '''
+
+    def __init__(self):
+        self.track_ms: Dict[Tuple[str | None, str | None], int] = {}
+        self.total_ms = 0
+        self.plays = 0
+        self.grid: CalendarGrid = merge_grids([])
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'PartialSummary':
+        partial = cls()
+        partial.add_frame(df)
+        return partial
+
+    def add_frame(self, df: pd.DataFrame) -> None:
+        '''
+        count the plays of an export-schema frame
+        '''
+        if df.empty:
+            return
+
+        by_track = df.groupby(['artistName', 'trackName'], observed=True, dropna=False, sort=False)['msPlayed'].sum()
+        keys = zip(_names(by_track.index.get_level_values(0)), _names(by_track.index.get_level_values(1)))
+
+        track_ms = self.track_ms
+        for key, ms in zip(keys, by_track.to_numpy().tolist()):
+            track_ms[key] = track_ms.get(key, 0) + ms
+
+        self.total_ms += int(df['msPlayed'].sum())
+        self.plays += len(df)
+        self.grid = merge_grids([self.grid, frame_grid(df)])
+
+    def merge(self, other: 'PartialSummary') -> 'PartialSummary':
+        '''
+        add the plays of other to this state, returns self
+        '''
+        track_ms = self.track_ms
+        for key, ms in other.track_ms.items():
+            track_ms[key] = track_ms.get(key, 0) + ms
+
+        self.total_ms += other.total_ms
+        self.plays += other.plays
+        self.grid = merge_grids([self.grid, other.grid])
+        return self
+
+    def nbytes(self) -> int:
+        '''
+        rough size of the state, the per-track dict dominates
+        '''
+        per_track = 3 * 64 + 100
+        return len(self.track_ms) * per_track + self.grid.hourly_ms.nbytes + self.grid.hourly_plays.nbytes
+
+    def aggregates(self) -> dict:
+        '''
+        the same artists, tracks, daily and total_ms aggregates as
+        stats._aggregate, ready for stats.summary_from_aggregates
+        '''
+        keys = sorted(self.track_ms, key=_name_order)
+        by_track = pd.DataFrame({
+            'artistName': pd.Categorical([artist for artist, _ in keys]),
+            'trackName': pd.Categorical([track for _, track in keys]),
+            'msPlayed': np.fromiter((self.track_ms[key] for key in keys), dtype=np.int64, count=len(keys)),
+        })
+
+        aggregates = track_aggregates(by_track)
+        aggregates['daily'] = self.grid
+        aggregates['total_ms'] = self.total_ms
+        return aggregates
+
+
+def latest_play(paths: Iterable[str | Path], chunk_bytes: int) -> pd.Timestamp | None:
+    '''
+    endTime of the latest play in the exports, None without any plays
+    '''
+    latest = None
+    for df in iter_chunks(paths, chunk_bytes):
+        if not df.empty:
+            chunk_latest = df['endTime'].max()
+            latest = chunk_latest if latest is None else max(latest, chunk_latest)
+    return latest
+
+
+def stream_partial(
+    paths: Iterable[str | Path],
+    start: pd.Timestamp | None = None,
+    end: pd.Timestamp | None = None,
+    chunk_bytes: int = chunk_bytes_for(DEFAULT_MEMORY_LIMIT_MB),
+) -> PartialSummary:
+    '''
+    PartialSummary of the plays with start <= endTime < end in the exports
+    '''
+    partial = PartialSummary()
+    for df in iter_chunks(paths, chunk_bytes):
+        if start is not None:
+            df = df[df['endTime'] >= start]
+        if end is not None:
+            df = df[df['endTime'] < end]
+        partial.add_frame(df)
+    return partial
+
+
+@perf.timed('stats')
+def stream_summary(
+    directory_path: str | Path,
+    period: str | int = 'all time',
+    n: int = 5,
+    metrics: Tuple[str, ...] = SUMMARY_METRICS,
+    memory_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB,
+) -> dict:
+    '''
+    stats.compute_summary of the exports in directory_path without loading
+    them, see the module docstring
+    '''
+    paths = find_exports(directory_path)
+    if not paths:
+        raise ValueError("No JSON files found")
+
+    chunk_bytes = chunk_bytes_for(memory_limit_mb)
+
+    start = end = None
+    if period in PERIOD_MONTHS:
+        max_time = latest_play(paths, chunk_bytes)
+        if max_time is not None:
+            start, end = period_bounds(max_time, period)
+    else:
+        start, end = period_bounds(None, period)
+
+    partial = stream_partial(paths, start, end, chunk_bytes)
+    perf.annotate(files=len(paths), plays=partial.plays, state_bytes=partial.nbytes())
+
+    return summary_from_aggregates(partial.aggregates(), n=n, metrics=metrics)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize streaming history exports one chunk at a time')
+    parser.add_argument('directory', help='directory with the json exports')
+    parser.add_argument('--period', default='all time')
+    parser.add_argument('-n', type=int, default=5, help='entries per top list')
+    parser.add_argument('--memory-limit-mb', type=float, default=DEFAULT_MEMORY_LIMIT_MB)
+    parser.add_argument('--trace-memory', action='store_true', help='report the peak of python allocations')
+    args = parser.parse_args()
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    summary = stream_summary(args.directory, args.period, n=args.n, memory_limit_mb=args.memory_limit_mb)
+    elapsed = time.perf_counter() - start
+
+    for name in ('top_artists', 'top_songs', 'top_songs_artist', 'weekday_hours'):
+        print(f"{name}:")
+        print(summary[name].to_string(index=False))
+        print()
+    print(f"listening time: {summary['listening_time'][1]}")
+    print(f"summarized in {elapsed:.2f} s, chunks of {chunk_bytes_for(args.memory_limit_mb) / 2**20:.1f} MB of json")
+
+    if args.trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"peak python allocations: {peak / 2**20:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
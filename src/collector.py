@@ -0,0 +1,187 @@
+'''
+recently-played collector that grows the local history store
+
+The recently-played endpoint only returns the last 50 plays, so live data
+is lost unless it is saved regularly. The collector pages through the
+endpoint with its cursors, appends the plays to a HistoryStore (the same
+one the json exports go into, see store.py) and remembers the newest
+played_at it has seen, so every refresh only asks for the plays after it.
+
+Plays are stored in the export format: endTime is played_at in UTC cut
+to the minute, so fetching the same play twice is deduplicated by the
+store. msPlayed is the track's duration, the api does not say how much of
+it was played; once an export with the same plays is ingested its exact
+rows replace the collected ones (see store.py).
+
+usage:
+    python src/collector.py data/.history_store --interval 300
+
+the CLI authenticates with spotipy's SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET
+and SPOTIPY_REDIRECT_URI environment variables
+'''
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from ingest import typed_frame
+from stats import recent_items_to_frame
+from store import HistoryStore
+
+
+STATE_NAME = 'collector.json'
+MAX_PAGES = 100
+
+
+def _played_at_ms(item: dict) -> int:
+    return int(pd.Timestamp(item['played_at']).timestamp() * 1000)
+
+
+class RecentlyPlayedCollector:
+    '''
+    fetch new recently-played items and merge them into a HistoryStore
+    '''
+
+    def __init__(self, sp, store: HistoryStore, state_path: str | Path | None = None, limit: int = 50):
+        self.sp = sp
+        self.store = store
+        self.state_path = Path(state_path) if state_path is not None else store.root / STATE_NAME
+        self.limit = limit
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def cursor(self) -> int | None:
+        '''
+        played_at (unix ms) of the newest play collected so far
+        '''
+        try:
+            with open(self.state_path) as f:
+                return json.load(f).get('after')
+        except (OSError, ValueError):
+            return None
+
+    def _save_cursor(self, after: int) -> None:
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'after': after}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _pages(self, after: int | None):
+        '''
+        yield pages of items, forwards from `after` or, on the first run,
+        backwards from now through everything the api still has
+        '''
+        before = None
+
+        for _ in range(MAX_PAGES):
+            if after is not None:
+                page = self.sp.current_user_recently_played(limit=self.limit, after=after)
+            else:
+                page = self.sp.current_user_recently_played(limit=self.limit, before=before)
+
+            items = page.get('items', []) if page else []
+            if not items:
+                return
+            yield items
+
+            cursors = page.get('cursors') or {}
+            if after is not None:
+                if len(items) < self.limit or not cursors.get('after'):
+                    return
+                after = int(cursors['after'])
+            else:
+                if not page.get('next') or not cursors.get('before'):
+                    return
+                before = int(cursors['before'])
+
+    def collect(self) -> int:
+        '''
+        fetch the plays since the last cursor into the store
+
+        returns the number of rows added
+        '''
+        after = self.cursor
+
+        items = []
+        for page in self._pages(after):
+            items.extend(page)
+
+        if not items:
+            return 0
+
+        recent = recent_items_to_frame(items)
+        rows = typed_frame(
+            # exports have whole minutes
+            recent['endTime'].dt.tz_convert('UTC').dt.tz_localize(None).dt.floor('min'),
+            recent['artistName'],
+            recent['trackName'],
+            recent['msPlayed'],
+        )
+        added = self.store.append(rows, collected=True)
+
+        newest = max(_played_at_ms(item) for item in items)
+        self._save_cursor(max(newest, after or 0))
+
+        return added
+
+    def run(self, interval: float) -> None:
+        '''
+        collect every `interval` seconds until stop() is called
+        '''
+        while not self._stop.is_set():
+            try:
+                added = self.collect()
+                if added:
+                    print(f"collected {added} new plays")
+            except Exception as e:
+                print(f"Error collecting recently played: {e}")
+            self._stop.wait(interval)
+
+    def start(self, interval: float = 300) -> threading.Thread:
+        '''
+        run the collector in a background daemon thread
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(interval,), name='recently-played-collector', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def main():
+    import spotipy
+    from spotipy.oauth2 import SpotifyOAuth
+
+    parser = argparse.ArgumentParser(description='Collect recently played tracks into a history store')
+    parser.add_argument('store', help='history store directory')
+    parser.add_argument('--interval', type=float, default=300, help='seconds between refreshes')
+    parser.add_argument('--once', action='store_true', help='collect once and exit')
+    args = parser.parse_args()
+
+    sp = spotipy.Spotify(auth_manager=SpotifyOAuth(scope='user-read-recently-played'))
+    collector = RecentlyPlayedCollector(sp, HistoryStore(args.store))
+
+    if args.once:
+        print(f"collected {collector.collect()} new plays")
+        return
+
+    try:
+        collector.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
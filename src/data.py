@@ -1,8 +1,19 @@
-from typing import List
+from typing import Dict, Tuple
+import numpy as np
 import pandas as pd
+import json
 import os
 from pathlib import Path
 
+import perf
+from history import CompactHistory
+from ingest import concat_exports, find_exports, parse_exports
+
+
+# parsed exports are cached next to the raw json, one parquet file per export
+CACHE_DIR_NAME = '.history_cache'
+MANIFEST_NAME = 'manifest.json'
+
 
 def count_json_files(directory_path: str | Path) -> int:
     count = 0
@@ -20,63 +31,226 @@ def count_json_files(directory_path: str | Path) -> int:
             
 
 
-def load_json(directory_path: str | Path) -> pd.DataFrame:
+def file_fingerprint(path: str | Path) -> Dict[str, int]:
     '''
-    Loads all json files in /data into dataframe
+    size and mtime of a file, used to tell if a cached parse is still valid
+    '''
+    stat = Path(path).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_manifest(cache_dir: Path) -> Dict[str, dict]:
+    try:
+        with open(cache_dir / MANIFEST_NAME) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(cache_dir: Path, manifest: Dict[str, dict]) -> None:
+    tmp_path = cache_dir / (MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, cache_dir / MANIFEST_NAME)
+
+
+def _read_cached(path: Path, cache_dir: Path, manifest: Dict[str, dict]) -> pd.DataFrame | None:
+    '''
+    return the cached parse of path if its fingerprint still matches, else None
+    '''
+    cache_path = cache_dir / f'{path.stem}.parquet'
+
+    if manifest.get(path.name) != file_fingerprint(path) or not cache_path.exists():
+        return None
+
+    try:
+        return pd.read_parquet(cache_path, memory_map=True)
+    except ImportError:
+        raise
+    except Exception as e:
+        print(f"Error reading cache for {path.name}, re-parsing: {e}")
+        return None
+
+
+def _write_cached(path: Path, df: pd.DataFrame, cache_dir: Path, manifest: Dict[str, dict]) -> None:
+    cache_path = cache_dir / f'{path.stem}.parquet'
+
+    tmp_path = cache_path.with_suffix('.parquet.tmp')
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+    manifest[path.name] = file_fingerprint(path)
+
+
+@perf.timed('data')
+def load_json(directory_path: str | Path, use_cache: bool = True, workers: int | None = None) -> pd.DataFrame:
+    '''
+    Loads all streaming history exports in /data into dataframe
 
     "endTime" : "2025-09-25 05:28",
     "artistName" : "Martin Garrix",
     "trackName" : "Scared to Be Lonely",
     "msPlayed" : 197508
 
-    Columns: artistName, trackName, msPlayed, endTime
+    Columns: artistName, trackName (category), msPlayed (int32), endTime
+
+    Both StreamingHistory_music_*.json and the extended
+    Streaming_History_Audio_*.json / endsong_*.json layouts are read, see
+    ingest.py. Files that need parsing are parsed in a process pool of
+    `workers` processes (default: one per core).
+
+    Parsed files are cached as parquet in <directory>/.history_cache, keyed by
+    file name, size and mtime, so only new or changed files get re-parsed.
+    Pass use_cache=False to always parse the raw json.
 
-    returns df of all songs streamed in json files
+    returns df of all songs streamed in json files, sorted by endTime
     '''
     directory_path = Path(directory_path)
 
-    json_count = count_json_files(directory_path)
+    paths = find_exports(directory_path)
+    if not paths:
+        raise ValueError("No JSON files found")
 
-    
-    dfs: List[pd.DataFrame] = []
+    dfs: Dict[Path, pd.DataFrame] = {}
 
-    for path in directory_path.glob('*.json'):
-        df = pd.read_json(path)
-        dfs.append(df)
-    
-    if not dfs:
-        raise ValueError("No JSON files found")
+    cache_dir = directory_path / CACHE_DIR_NAME
+    manifest: Dict[str, dict] = {}
+
+    if use_cache:
+        try:
+            cache_dir.mkdir(exist_ok=True)
+            manifest = _read_manifest(cache_dir)
+            for path in paths:
+                df = _read_cached(path, cache_dir, manifest)
+                if df is not None:
+                    dfs[path] = df
+        except (OSError, ImportError) as e:
+            print(f"Error using cache directory, loading without cache: {e}")
+            use_cache = False
+            dfs = {}
+
+    missing = [path for path in paths if path not in dfs]
+    perf.annotate(files=len(paths), cache_hits=len(dfs), cache_misses=len(missing))
+    for path, df in zip(missing, parse_exports(missing, workers=workers)):
+        dfs[path] = df
+
+    if use_cache:
+        try:
+            for path in missing:
+                _write_cached(path, dfs[path], cache_dir, manifest)
+
+            # forget files that were removed from the directory
+            names = {path.name for path in paths}
+            for name in list(manifest):
+                if name not in names:
+                    del manifest[name]
+                    (cache_dir / f'{Path(name).stem}.parquet').unlink(missing_ok=True)
+            _write_manifest(cache_dir, manifest)
+        except (OSError, ImportError) as e:
+            print(f"Error writing cache: {e}")
 
-    df = pd.concat(dfs, ignore_index=True)
-    df['endTime'] = pd.to_datetime(df['endTime'])
+    df = concat_exports([dfs[path] for path in paths])
+    df = df.sort_values('endTime', kind='stable', ignore_index=True)
 
 
     return df
 
 
-def filter_period(df: pd.DataFrame, period: str) -> pd.DataFrame:
+PERIOD_MONTHS = {
+    '1 month': 1,
+    '3 months': 3,
+    '12 months': 12,
+}
+
+
+def _sorted_by_time(df: pd.DataFrame) -> pd.DataFrame:
     '''
-    intervals of last 1 month, 3 months, 12 months, all time
+    df with a datetime endTime column sorted ascending, without touching the caller's frame
     '''
+    if not pd.api.types.is_datetime64_any_dtype(df['endTime']):
+        df = df.assign(endTime=pd.to_datetime(df['endTime']))
 
-    if df.empty:
-        raise ValueError("DataFrame is empty")
+    if not df['endTime'].is_monotonic_increasing:
+        df = df.sort_values('endTime', kind='stable')
 
-    if df['endTime'].dtype != 'datetime64[ns]':
-        df['endTime'] = pd.to_datetime(df['endTime'])
+    return df
 
-    # remove timestamp with normalize
-    max_date = df['endTime'].max().normalize()
-    
-    if period == '1 month':
-        start_date = max_date - pd.DateOffset(months = 1)
-    elif period == '3 months':
-        start_date = max_date - pd.DateOffset(months = 3)
-    elif period == '12 months':
-        start_date = max_date - pd.DateOffset(months = 12)
+
+def slice_time_range(
+    df: pd.DataFrame | CompactHistory,
+    start: str | pd.Timestamp | None = None,
+    end: str | pd.Timestamp | None = None,
+) -> pd.DataFrame | CompactHistory:
+    '''
+    rows with start <= endTime < end, either bound can be left open
+
+    the bounds are found with a binary search on the sorted times and the
+    result is a slice of df, not a filtered copy
+    '''
+    if isinstance(df, CompactHistory):
+        times = df.minutes
+        to_key = lambda ts: pd.Timestamp(ts).to_datetime64().astype('datetime64[m]').astype(np.int64)
     else:
+        df = _sorted_by_time(df)
+        times = df['endTime'].to_numpy()
+        to_key = lambda ts: pd.Timestamp(ts).to_datetime64()
+
+    lo = 0 if start is None else int(times.searchsorted(to_key(start), side='left'))
+    hi = len(times) if end is None else int(times.searchsorted(to_key(end), side='left'))
+
+    if isinstance(df, CompactHistory):
+        return df.slice(lo, hi)
+    return df.iloc[lo:hi]
+
+
+def _is_year(period: str | int) -> bool:
+    if isinstance(period, str):
+        return period.isdigit() and len(period) == 4
+    return isinstance(period, int)
+
+
+def period_bounds(max_time: pd.Timestamp, period: str | int) -> Tuple[pd.Timestamp | None, pd.Timestamp | None]:
+    '''
+    [start, end) for a period relative to the latest play
+
+    period is one of PERIOD_MONTHS, a calendar year (2024 or '2024'),
+    anything else means all time
+    '''
+    if period in PERIOD_MONTHS:
+        # remove timestamp with normalize
+        start = max_time.normalize() - pd.DateOffset(months=PERIOD_MONTHS[period])
+        return start, None
+
+    if _is_year(period):
+        start = pd.Timestamp(year=int(period), month=1, day=1)
+        return start, start + pd.DateOffset(years=1)
+
+    # all time interval
+    return None, None
+
+
+@perf.timed('data')
+def filter_period(df: pd.DataFrame | CompactHistory, period: str | int) -> pd.DataFrame | CompactHistory:
+    '''
+    intervals of last 1 month, 3 months, 12 months, a calendar year, all time
+
+    works on a load_json dataframe or a CompactHistory. rows are found with
+    a binary search on endTime and returned as a slice; frames that are not
+    sorted by endTime are sorted first (load_json already returns them sorted)
+    '''
+
+    if df.empty:
+        raise ValueError("DataFrame is empty")
+
+    if period not in PERIOD_MONTHS and not _is_year(period):
         # all time interval
         return df
 
-    return df[df['endTime'].dt.normalize() >= start_date]
+    if isinstance(df, CompactHistory):
+        max_time = pd.Timestamp(int(df.minutes[-1]), unit='m')
+    else:
+        df = _sorted_by_time(df)
+        max_time = df['endTime'].iat[-1]
+
+    start, end = period_bounds(max_time, period)
 
+    return slice_time_range(df, start, end)
@@ -0,0 +1,241 @@
+'''
+Spotify metadata for the artists and tracks in a play history
+
+The exports only have artistName / trackName. enrich() resolves every
+distinct (artist, track) pair to a Spotify track and adds ids, duration,
+popularity and the primary artist's genres:
+
+    artistName, trackName, trackId, artistId, durationMs, popularity,
+    artistPopularity, genres
+
+Each distinct entity is looked up at most once. Names are resolved with
+one search per pair that is not cached yet (the API has no batch
+name-to-id lookup). Tracks that already have a trackId, and all artists,
+are fetched 50 ids per request with sp.tracks / sp.artists. Everything,
+misses included, goes into a sqlite key-value cache as it arrives, so
+later (or interrupted) runs only look up new names.
+'''
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import pandas as pd
+
+
+BATCH_SIZE = 50
+# searches between two writes to the cache
+SEARCH_SAVE_EVERY = 50
+METADATA_CACHE_PATH = '.metadata_cache.sqlite'
+
+
+class MetadataCache:
+    '''
+    thread-safe persistent key-value store for json values
+    '''
+
+    def __init__(self, path: str | Path = METADATA_CACHE_PATH):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)')
+        self._db.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        '''
+        cached values of the keys that are present
+        '''
+        keys = list(keys)
+        found = {}
+
+        with self._lock:
+            # stay below sqlite's limit on query parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._db.execute(f'SELECT key, value FROM kv WHERE key IN ({placeholders})', chunk)
+                for key, value in rows:
+                    found[key] = json.loads(value)
+
+        return found
+
+    def set_many(self, items: Dict[str, Any]) -> None:
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in items.items()],
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM kv').fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _pair_key(artist_name: str, track_name: str) -> str:
+    return f'pair:{artist_name}\x1f{track_name}'
+
+
+def _track_record(track: dict) -> dict:
+    primary_artist = track['artists'][0] if track.get('artists') else {}
+    return {
+        'trackId': track['id'],
+        'artistId': primary_artist.get('id'),
+        'durationMs': track.get('duration_ms'),
+        'popularity': track.get('popularity'),
+    }
+
+
+def _artist_record(artist: dict) -> dict:
+    return {
+        'artistPopularity': artist.get('popularity'),
+        'genres': ', '.join(artist.get('genres', [])),
+    }
+
+
+def _batched(ids: List[str], size: int = BATCH_SIZE):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def fetch_tracks(sp, track_ids: Iterable[str], cache: MetadataCache) -> Dict[str, dict]:
+    '''
+    track records by id, fetching the uncached ones 50 per request
+    '''
+    track_ids = list(dict.fromkeys(i for i in track_ids if i))
+    keys = {f'track:{i}': i for i in track_ids}
+    cached = cache.get_many(keys)
+
+    missing = [i for key, i in keys.items() if key not in cached]
+    for batch in _batched(missing):
+        fetched = sp.tracks(batch).get('tracks', [])
+        new = {f'track:{i}': None for i in batch}
+        new.update({f'track:{t["id"]}': _track_record(t) for t in fetched if t})
+        cache.set_many(new)
+        cached.update(new)
+
+    return {i: cached[f'track:{i}'] for i in track_ids if cached.get(f'track:{i}')}
+
+
+def fetch_artists(sp, artist_ids: Iterable[str], cache: MetadataCache) -> Dict[str, dict]:
+    '''
+    artist records by id, fetching the uncached ones 50 per request
+    '''
+    artist_ids = list(dict.fromkeys(i for i in artist_ids if i))
+    keys = {f'artist:{i}': i for i in artist_ids}
+    cached = cache.get_many(keys)
+
+    missing = [i for key, i in keys.items() if key not in cached]
+    for batch in _batched(missing):
+        fetched = sp.artists(batch).get('artists', [])
+        new = {f'artist:{i}': None for i in batch}
+        new.update({f'artist:{a["id"]}': _artist_record(a) for a in fetched if a})
+        cache.set_many(new)
+        cached.update(new)
+
+    return {i: cached[f'artist:{i}'] for i in artist_ids if cached.get(f'artist:{i}')}
+
+
+def _search_term(value: str) -> str:
+    # a '"' would end the quoted field filter early, the search api has no
+    # escape for it and ignores punctuation when matching, so drop it
+    return value.replace('"', ' ')
+
+
+def resolve_tracks(sp, pairs: List[tuple], cache: MetadataCache) -> Dict[tuple, dict]:
+    '''
+    track records for (artistName, trackName) pairs, searching only for
+    pairs that were never looked up. pairs without a match map to nothing
+
+    results are saved every SEARCH_SAVE_EVERY searches, so an interrupted
+    run keeps what it found. a failed search is reported and not cached,
+    the pair is searched again on the next run
+    '''
+    keys = {_pair_key(artist, track): (artist, track) for artist, track in pairs}
+    cached = cache.get_many(keys)
+
+    new = {}
+    failed = 0
+    first_error = None
+    for key, (artist, track) in keys.items():
+        if key in cached:
+            continue
+
+        query = f'track:"{_search_term(track)}" artist:"{_search_term(artist)}"'
+        try:
+            items = sp.search(q=query, type='track', limit=1).get('tracks', {}).get('items', [])
+        except Exception as e:
+            failed += 1
+            first_error = first_error or e
+            continue
+        record = _track_record(items[0]) if items else None
+
+        new[key] = record
+        if record is not None:
+            new[f'track:{record["trackId"]}'] = record
+        if len(new) >= SEARCH_SAVE_EVERY:
+            cache.set_many(new)
+            cached.update(new)
+            new = {}
+
+    if new:
+        cache.set_many(new)
+        cached.update(new)
+    if failed:
+        print(f"Error searching {failed} of {len(keys)} tracks, they are retried on the next run: {first_error}")
+
+    return {pair: cached[key] for key, pair in keys.items() if cached.get(key)}
+
+
+def enrich(sp, df: pd.DataFrame, cache: MetadataCache) -> pd.DataFrame:
+    '''
+    one row per distinct (artistName, trackName) in df with its Spotify
+    metadata, columns are NA where nothing was found
+
+    join it back onto the plays with df.merge(..., on=['artistName', 'trackName'])
+    '''
+    pairs = (
+        df[['artistName', 'trackName']]
+        .dropna()
+        .drop_duplicates()
+        .astype(str)
+        .itertuples(index=False, name=None)
+    )
+    pairs = list(pairs)
+
+    # rows collected from the api already carry a track id, no search needed
+    tracks = {}
+    if 'trackId' in df.columns:
+        with_ids = df[['artistName', 'trackName', 'trackId']].dropna().drop_duplicates(['artistName', 'trackName']).astype(str)
+        by_id = fetch_tracks(sp, with_ids['trackId'], cache)
+        for artist_name, track_name, track_id in with_ids.itertuples(index=False, name=None):
+            if track_id in by_id:
+                tracks[(artist_name, track_name)] = by_id[track_id]
+
+    tracks.update(resolve_tracks(sp, [pair for pair in pairs if pair not in tracks], cache))
+    artists = fetch_artists(sp, (t['artistId'] for t in tracks.values()), cache)
+
+    rows = []
+    for artist_name, track_name in pairs:
+        track = tracks.get((artist_name, track_name), {})
+        artist = artists.get(track.get('artistId'), {})
+        rows.append({
+            'artistName': artist_name,
+            'trackName': track_name,
+            'trackId': track.get('trackId'),
+            'artistId': track.get('artistId'),
+            'durationMs': track.get('durationMs'),
+            'popularity': track.get('popularity'),
+            'artistPopularity': artist.get('artistPopularity'),
+            'genres': artist.get('genres'),
+        })
+
+    return pd.DataFrame(rows, columns=[
+        'artistName', 'trackName', 'trackId', 'artistId',
+        'durationMs', 'popularity', 'artistPopularity', 'genres',
+    ])
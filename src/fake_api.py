@@ -0,0 +1,267 @@
+'''
+local stand-in for the Spotify Web API and accounts service
+
+Serves the endpoints the app uses from a SyntheticSpotify catalog (see
+synth.py), so the live code paths can be benchmarked and stress-tested
+without an account or network:
+
+    GET  /v1/me
+    GET  /v1/me/top/artists, /v1/me/top/tracks
+    GET  /v1/me/player/recently-played
+    GET  /v1/artists?ids=..., /v1/tracks?ids=...
+    GET  /v1/search
+    GET  /authorize            redirects straight back with a code
+    POST /api/token            authorization_code and refresh_token grants
+
+Every response can be delayed (latency + random jitter) and a share of
+the api calls answered with 429 and a Retry-After header.
+
+Point a client at it with:
+
+    sp = spotipy.Spotify(auth=token)
+    sp.prefix = server.api_url
+
+    oauth = SpotifyOAuth(...)
+    oauth.OAUTH_TOKEN_URL = server.url + '/api/token'
+
+or run the app against it with SPOTIFY_API_URL / SPOTIFY_ACCOUNTS_URL
+(see app.py).
+
+usage:
+    python src/fake_api.py --port 8765 --latency-ms 80 --rate-429 0.02
+'''
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from synth import SyntheticSpotify
+
+
+TOKEN_EXPIRES_IN = 3600
+
+
+class FakeSpotifyServer:
+    '''
+    threaded http server in a background thread, use as a context manager
+    or call start() / stop()
+    '''
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        rate_429: float = 0,
+        retry_after: int = 1,
+        n_artists: int = 500,
+        n_markets: int = 0,
+        seed: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.catalog = SyntheticSpotify(n_artists=n_artists, seed=seed, n_markets=n_markets)
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.throttled = Counter()
+
+        self._httpd = ThreadingHTTPServer((host, port), _handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self) -> str:
+        # same form as spotipy's prefix
+        return self.url + '/v1/'
+
+    def start(self) -> 'FakeSpotifyServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-spotify', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'FakeSpotifyServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'requests': dict(self.requests), 'throttled': dict(self.throttled)}
+
+    def _delay(self) -> None:
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        if self.latency_ms or jitter:
+            time.sleep((self.latency_ms + jitter) / 1000)
+
+    def _should_throttle(self, route: str) -> bool:
+        with self._lock:
+            self.requests[route] += 1
+            if self.rate_429 and self._random.random() < self.rate_429:
+                self.throttled[route] += 1
+                return True
+        return False
+
+    def api(self, route: str, query: dict) -> tuple[int, dict]:
+        '''
+        status and json body of an api call
+        '''
+        catalog = self.catalog
+        limit = int(query.get('limit', 20))
+        offset = int(query.get('offset', 0))
+        time_range = query.get('time_range', 'medium_term')
+
+        if route == '/v1/me':
+            return 200, catalog.current_user()
+        if route == '/v1/me/top/artists':
+            return 200, catalog.current_user_top_artists(limit=limit, offset=offset, time_range=time_range)
+        if route == '/v1/me/top/tracks':
+            return 200, catalog.current_user_top_tracks(limit=limit, offset=offset, time_range=time_range)
+        if route == '/v1/me/player/recently-played':
+            return 200, catalog.current_user_recently_played(
+                limit=int(query.get('limit', 50)), after=query.get('after'), before=query.get('before'),
+            )
+        if route == '/v1/artists':
+            return 200, catalog.artists(query.get('ids', '').split(','))
+        if route == '/v1/tracks':
+            return 200, catalog.tracks(query.get('ids', '').split(','))
+        if route == '/v1/search':
+            return 200, catalog.search(query.get('q', ''), limit=limit, offset=offset)
+
+        return 404, {'error': {'status': 404, 'message': 'Service not found'}}
+
+    def token(self, form: dict) -> tuple[int, dict]:
+        grant_type = form.get('grant_type')
+        if grant_type not in ('authorization_code', 'refresh_token', 'client_credentials'):
+            return 400, {'error': 'unsupported_grant_type'}
+
+        return 200, {
+            'access_token': secrets.token_urlsafe(24),
+            'token_type': 'Bearer',
+            'expires_in': TOKEN_EXPIRES_IN,
+            'refresh_token': form.get('refresh_token') or secrets.token_urlsafe(24),
+            'scope': form.get('scope', 'user-read-email user-top-read user-read-recently-played'),
+        }
+
+
+def _handler(server: FakeSpotifyServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: dict, headers: dict | None = None) -> None:
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            # spotipy asks for "me/" with a trailing slash
+            path = url.path.rstrip('/')
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            server._delay()
+
+            if path == '/authorize':
+                target = query.get('redirect_uri', '/')
+                params = {'code': secrets.token_urlsafe(12)}
+                if 'state' in query:
+                    params['state'] = query['state']
+                self.send_response(302)
+                self.send_header('Location', f'{target}?{urlencode(params)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            if not self.headers.get('Authorization', '').startswith('Bearer '):
+                self._send(401, {'error': {'status': 401, 'message': 'No token provided'}})
+                return
+
+            if server._should_throttle(path):
+                self._send(
+                    429,
+                    {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                    {'Retry-After': str(server.retry_after)},
+                )
+                return
+
+            status, body = server.api(path, query)
+            self._send(status, body)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length', 0))
+            form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+            server._delay()
+
+            if url.path != '/api/token':
+                self._send(404, {'error': 'not found'})
+                return
+
+            with server._lock:
+                server.requests[url.path] += 1
+            status, body = server.token(form)
+            self._send(status, body)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake Spotify API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random extra delay, up to this much')
+    parser.add_argument('--rate-429', type=float, default=0, help='share of api calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--artists', type=int, default=500, help='catalog size')
+    parser.add_argument('--markets', type=int, default=0, help='available_markets per track, grows payloads')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeSpotifyServer(
+        host=args.host, port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429, retry_after=args.retry_after, n_artists=args.artists,
+        n_markets=args.markets, seed=args.seed,
+    )
+    print(f"fake Spotify API on {server.url}")
+    print(f"  SPOTIFY_API_URL={server.api_url} SPOTIFY_ACCOUNTS_URL={server.url}")
+
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+'''
+compact, dictionary-encoded play history
+
+Artist and track names are stored once in sorted dictionaries and every
+play only keeps codes, int16 while a dictionary has fewer than 32768
+entries and int32 beyond that:
+
+    artist_codes[i]   index into artist_names (-1 when missing)
+    track_codes[i]    index into the track table (-1 when missing)
+    ms_played[i]      int32
+    minutes[i]        minutes since 1970-01-01 (UTC), int32
+
+A track is an (artist, track name) pair, like the groupbys in stats.py,
+so the track table is two code arrays: track_artist and track_name.
+
+Rows are sorted by time, so periods are contiguous and slice() returns
+views instead of copies.
+
+A play takes 12 bytes with int16 codes (14 with more than 32767 tracks)
+against 16 in the categorical frame load_json returns, where pandas
+narrows the codes the same way but endTime takes 8 bytes. Besides that the
+hot paths use the plain int arrays, with a code per (artist, track)
+pair, directly. stats._aggregate and the sessions / sketches stages count with
+np.bincount on the codes, calendar_stats bins the sorted minutes with a
+binary search, and query.HistoryIndex builds its CSR indexes on them.
+'''
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def code_dtype(n: int) -> type:
+    '''
+    narrowest of int16 / int32 for codes 0..n-1 and -1
+    '''
+    return np.int16 if n <= np.iinfo(np.int16).max else np.int32
+
+
+def _codes_and_names(column: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    categorical = pd.Categorical(column)
+    if not categorical.categories.is_monotonic_increasing:
+        categorical = categorical.reorder_categories(categorical.categories.sort_values())
+    names = np.asarray(categorical.categories, dtype=object)
+    return categorical.codes.astype(code_dtype(len(names))), names
+
+
+@dataclass(frozen=True)
+class CompactHistory:
+    artist_names: np.ndarray
+    track_names: np.ndarray
+    track_artist: np.ndarray
+    track_name: np.ndarray
+    artist_codes: np.ndarray
+    track_codes: np.ndarray
+    ms_played: np.ndarray
+    minutes: np.ndarray
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'CompactHistory':
+        '''
+        encode a load_json style dataframe, sorting the rows by endTime
+        '''
+        df = df.sort_values('endTime', kind='stable')
+
+        artist_codes, artist_names = _codes_and_names(df['artistName'])
+        name_codes, track_names = _codes_and_names(df['trackName'])
+
+        # a track is an (artist, name) pair, factorize the combined code.
+        # plays without a track name have no track, plays without an artist
+        # get tracks of their own with track_artist -1
+        named = name_codes >= 0
+        pair_keys = artist_codes[named].astype(np.int64) * (len(track_names) + 1) + name_codes[named]
+        named_codes, pairs = pd.factorize(pair_keys, sort=True)
+        track_codes = np.full(len(df), -1, dtype=code_dtype(len(pairs)))
+        track_codes[named] = named_codes
+
+        minutes = df['endTime'].to_numpy().astype('datetime64[m]').astype(np.int64)
+
+        return cls(
+            artist_names=artist_names,
+            track_names=track_names,
+            track_artist=(pairs // (len(track_names) + 1)).astype(artist_codes.dtype),
+            track_name=(pairs % (len(track_names) + 1)).astype(name_codes.dtype),
+            artist_codes=artist_codes,
+            track_codes=track_codes,
+            ms_played=df['msPlayed'].to_numpy().astype(np.int32),
+            minutes=minutes.astype(np.int32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ms_played)
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        bytes held by the arrays, name dictionaries included
+        '''
+        total = 0
+        for array in (self.track_artist, self.track_name, self.artist_codes,
+                      self.track_codes, self.ms_played, self.minutes):
+            total += array.nbytes
+        for names in (self.artist_names, self.track_names):
+            total += names.nbytes + sum(len(name) + 49 for name in names)
+        return total
+
+    def slice(self, start: int, stop: int) -> 'CompactHistory':
+        '''
+        rows [start, stop) as views, the dictionaries are shared
+        '''
+        return CompactHistory(
+            artist_names=self.artist_names,
+            track_names=self.track_names,
+            track_artist=self.track_artist,
+            track_name=self.track_name,
+            artist_codes=self.artist_codes[start:stop],
+            track_codes=self.track_codes[start:stop],
+            ms_played=self.ms_played[start:stop],
+            minutes=self.minutes[start:stop],
+        )
+
+    def end_times(self) -> np.ndarray:
+        return (self.minutes.astype(np.int64) * 60).astype('datetime64[s]').astype('datetime64[ns]')
+
+    def to_pandas(self) -> pd.DataFrame:
+        '''
+        load_json style dataframe, names are categoricals built from the codes
+        '''
+        row_names = np.where(self.track_codes >= 0, self.track_name[self.track_codes], -1)
+
+        return pd.DataFrame({
+            'endTime': self.end_times(),
+            'artistName': pd.Categorical.from_codes(self.artist_codes, categories=self.artist_names),
+            'trackName': pd.Categorical.from_codes(row_names, categories=self.track_names),
+            'msPlayed': self.ms_played,
+        })
+
+    def artist_totals(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        ms played and number of plays per artist code
+        '''
+        valid = self.artist_codes >= 0
+        codes = self.artist_codes[valid]
+        n = len(self.artist_names)
+        totals = np.bincount(codes, weights=self.ms_played[valid], minlength=n).astype(np.int64)
+        counts = np.bincount(codes, minlength=n)
+        return totals, counts
+
+    def track_totals(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        ms played and number of plays per track code
+        '''
+        valid = self.track_codes >= 0
+        codes = self.track_codes[valid]
+        n = len(self.track_artist)
+        totals = np.bincount(codes, weights=self.ms_played[valid], minlength=n).astype(np.int64)
+        counts = np.bincount(codes, minlength=n)
+        return totals, counts
+
+    def daily_totals(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        days (since 1970-01-01) with plays and the ms played on each of them
+        '''
+        days = self.minutes // MINUTES_PER_DAY
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        totals = np.bincount(inverse, weights=self.ms_played, minlength=len(unique_days))
+        return unique_days, totals.astype(np.int64)
@@ -0,0 +1,166 @@
+'''
+schema-aware parsing of spotify streaming history exports
+
+Two export layouts are supported:
+
+account data (StreamingHistory_music_*.json)
+    "endTime" : "2025-09-25 05:28",
+    "artistName" : "Martin Garrix",
+    "trackName" : "Scared to Be Lonely",
+    "msPlayed" : 197508
+
+extended history (Streaming_History_Audio_*.json, endsong_*.json)
+    "ts" : "2025-09-25T05:28:13Z",
+    "master_metadata_album_artist_name" : "Martin Garrix",
+    "master_metadata_track_name" : "Scared to Be Lonely",
+    "ms_played" : 197508,
+    ...
+
+Both are parsed into the same columns: endTime (datetime64[ns]),
+artistName / trackName (category) and msPlayed (int32).
+'''
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+EXPORT_PATTERNS = (
+    'StreamingHistory_music_*.json',
+    'Streaming_History_Audio_*.json',
+    'endsong_*.json',
+)
+
+COLUMNS = ['endTime', 'artistName', 'trackName', 'msPlayed']
+CATEGORY_COLUMNS = ['artistName', 'trackName']
+
+
+def find_exports(directory_path: str | Path) -> List[Path]:
+    '''
+    all export files in directory_path matching a known layout
+    '''
+    directory_path = Path(directory_path)
+
+    paths = set()
+    for pattern in EXPORT_PATTERNS:
+        paths.update(directory_path.glob(pattern))
+
+    return sorted(paths)
+
+
+def empty_frame() -> pd.DataFrame:
+    '''
+    empty dataframe with the export schema
+    '''
+    return pd.DataFrame({
+        'endTime': pd.Series([], dtype='datetime64[ns]'),
+        'artistName': pd.Categorical([]),
+        'trackName': pd.Categorical([]),
+        'msPlayed': pd.Series([], dtype='int32'),
+    })
+
+
+def frame_from_records(records: list) -> pd.DataFrame:
+    '''
+    parse decoded export records (either layout) into the export schema
+    '''
+    if not records:
+        return empty_frame()
+
+    if 'endTime' in records[0]:
+        # account data export, endTime is "YYYY-MM-DD HH:MM" in UTC
+        end_time = np.array([r['endTime'] for r in records], dtype='datetime64[m]')
+        artists = [r.get('artistName') for r in records]
+        tracks = [r.get('trackName') for r in records]
+        ms_played = np.fromiter((r['msPlayed'] for r in records), dtype=np.int64, count=len(records))
+
+    elif 'ts' in records[0]:
+        # extended history, podcast episodes and videos have no track name
+        records = [r for r in records if r.get('master_metadata_track_name')]
+        end_time = pd.to_datetime([r['ts'] for r in records], format='ISO8601', utc=True).tz_localize(None)
+        artists = [r['master_metadata_album_artist_name'] or '' for r in records]
+        tracks = [r['master_metadata_track_name'] for r in records]
+        ms_played = np.fromiter((r['ms_played'] for r in records), dtype=np.int64, count=len(records))
+
+    else:
+        raise ValueError(f"Unrecognized export layout with keys: {sorted(records[0])}")
+
+    return typed_frame(end_time, artists, tracks, ms_played)
+
+
+def typed_frame(end_time, artists, tracks, ms_played) -> pd.DataFrame:
+    '''
+    dataframe with the export schema from plain column values, end_time in UTC
+    '''
+    return pd.DataFrame({
+        'endTime': pd.Series(end_time).astype('datetime64[ns]'),
+        'artistName': pd.Categorical(artists),
+        'trackName': pd.Categorical(tracks),
+        'msPlayed': np.asarray(ms_played).astype(np.int32),
+    })
+
+
+def parse_export(path: str | Path) -> pd.DataFrame:
+    '''
+    parse a single export file (either layout) into the export schema
+    '''
+    with open(path, 'rb') as f:
+        records = _loads(f.read())
+
+    if not isinstance(records, list):
+        raise ValueError(f"{path} is not a streaming history export")
+
+    return frame_from_records(records)
+
+
+def parse_exports(paths: Iterable[str | Path], workers: int | None = None) -> List[pd.DataFrame]:
+    '''
+    parse export files, in a process pool when there is more than one file
+
+    results are returned in the same order as paths
+    '''
+    paths = list(paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+
+    if workers <= 1:
+        return [parse_export(path) for path in paths]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(parse_export, paths))
+
+
+def concat_exports(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    '''
+    concatenate parsed exports, merging the categories of the name columns
+
+    plain pd.concat would fall back to object columns when the categories differ.
+    categories are kept sorted, so groupbys come out in alphabetical order
+    '''
+    dfs = [df for df in dfs if not df.empty]
+    if not dfs:
+        return empty_frame()
+
+    columns = {}
+    for column in COLUMNS:
+        if column in CATEGORY_COLUMNS:
+            columns[column] = union_categoricals(
+                [pd.Categorical(df[column]) for df in dfs],
+                sort_categories=True,
+            )
+        else:
+            columns[column] = np.concatenate([df[column].to_numpy() for df in dfs])
+
+    return pd.DataFrame(columns, columns=COLUMNS)
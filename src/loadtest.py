@@ -0,0 +1,189 @@
+'''
+load driver for the live path against the fake Spotify API
+
+Starts a FakeSpotifyServer (see fake_api.py) and simulates N concurrent
+users. Each user session goes through the same code the app runs:
+
+    oauth      token exchange and refresh (app.make_oauth)
+    me         sp.current_user() on a client from app.make_client
+    dashboard  stats.fetch_dashboard, top lists of every range + recent
+    render     the render.build_* frames of every range
+
+and the latency of every stage is reported as p50 / p90 / p99.
+
+usage:
+    python src/loadtest.py --users 20 --sessions 5 --latency-ms 80 --jitter-ms 40 --rate-429 0.01
+'''
+import argparse
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from spotipy.cache_handler import MemoryCacheHandler
+
+import app
+import stats
+from api_cache import CachedSpotify, TTLCache
+from fake_api import FakeSpotifyServer
+from render import build_artist_options, build_artist_tracks, build_recent, build_top_artists, build_top_tracks
+
+
+# st.cache_resource warns on every call from a thread outside a streamlit run
+logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').setLevel(logging.ERROR)
+
+STAGES = ('oauth', 'me', 'dashboard', 'render', 'session')
+REDIRECT_URI = 'http://127.0.0.1:8501/callback'
+
+
+class Timings:
+    '''
+    thread-safe latency samples per stage
+    '''
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def error(self, e: Exception) -> None:
+        with self._lock:
+            self.errors[type(e).__name__] += 1
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            result = {}
+            for stage in STAGES:
+                values = np.array(self.samples.get(stage, []))
+                if not len(values):
+                    continue
+                p50, p90, p99 = np.percentile(values, [50, 90, 99])
+                result[stage] = {'n': len(values), 'p50_s': p50, 'p90_s': p90, 'p99_s': p99, 'max_s': values.max()}
+            return result
+
+
+def render_frames(wrapped: dict, recent) -> None:
+    '''
+    the frames render_mini_wrapped_view builds, for every range
+    '''
+    for entry in wrapped.values():
+        artists_df, tracks_df = entry['artists'], entry['tracks']
+        top5_artists = build_top_artists(artists_df, tracks_df)
+        build_top_tracks(tracks_df)
+        if top5_artists.empty or tracks_df.empty:
+            continue
+        options, use_ids = build_artist_options(top5_artists)
+        for name, key in options.items():
+            build_artist_tracks(tracks_df, key, name, use_ids)
+    build_recent(recent)
+
+
+def user_session(timings: Timings, cache: TTLCache | None = None) -> None:
+    '''
+    one login and dashboard load, stage latencies go into timings
+    '''
+    session_start = time.perf_counter()
+
+    start = time.perf_counter()
+    oauth = app.make_oauth('load-test-client', 'load-test-secret', REDIRECT_URI, cache_handler=MemoryCacheHandler())
+    # the token lands in the memory cache, as_dict=True (the default) is deprecated
+    oauth.get_access_token('load-test-code', as_dict=False, check_cache=False)
+    token_info = oauth.get_cached_token()
+    token_info = oauth.refresh_access_token(token_info['refresh_token'])
+    timings.add('oauth', time.perf_counter() - start)
+
+    start = time.perf_counter()
+    sp = app.make_client(token_info['access_token'])
+    user = sp.current_user()
+    timings.add('me', time.perf_counter() - start)
+
+    if cache is not None:
+        sp = CachedSpotify(sp, cache, user['id'])
+
+    start = time.perf_counter()
+    wrapped, recent = stats.fetch_dashboard(sp)
+    timings.add('dashboard', time.perf_counter() - start)
+
+    start = time.perf_counter()
+    render_frames(wrapped, recent)
+    timings.add('render', time.perf_counter() - start)
+
+    timings.add('session', time.perf_counter() - session_start)
+
+
+def run_load(server: FakeSpotifyServer, users: int, sessions: int, api_cache: bool = False) -> dict:
+    '''
+    `users` concurrent users running `sessions` sessions each against server
+    '''
+    app.SPOTIFY_API_URL = server.api_url
+    app.SPOTIFY_ACCOUNTS_URL = server.url
+    cache = TTLCache() if api_cache else None
+    timings = Timings()
+
+    def user():
+        for _ in range(sessions):
+            try:
+                user_session(timings, cache)
+            except Exception as e:
+                timings.error(e)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users, thread_name_prefix='load-user') as pool:
+        for future in [pool.submit(user) for _ in range(users)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'users': users,
+        'sessions': users * sessions,
+        'elapsed_s': elapsed,
+        'stages': timings.summary(),
+        'errors': dict(timings.errors),
+        'server': server.stats(),
+        'scheduler': app.get_scheduler().stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the live path against a fake Spotify API')
+    parser.add_argument('--users', type=int, default=10, help='concurrent users')
+    parser.add_argument('--sessions', type=int, default=3, help='sessions per user')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=25)
+    parser.add_argument('--rate-429', type=float, default=0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--markets', type=int, default=0, help='available_markets per track, grows payloads')
+    parser.add_argument('--api-cache', action='store_true', help='wrap clients in CachedSpotify like the app')
+    args = parser.parse_args()
+
+    server = FakeSpotifyServer(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+        retry_after=args.retry_after, n_markets=args.markets,
+    )
+    with server:
+        result = run_load(server, args.users, args.sessions, api_cache=args.api_cache)
+
+    print(f"{result['sessions']} sessions by {result['users']} users in {result['elapsed_s']:.2f} s "
+          f"({result['sessions'] / result['elapsed_s']:.1f} sessions/s)")
+    print(f"{'stage':<10} {'n':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for stage, s in result['stages'].items():
+        print(f"{stage:<10} {s['n']:>5} {s['p50_s'] * 1000:9.1f} {s['p90_s'] * 1000:9.1f} "
+              f"{s['p99_s'] * 1000:9.1f} {s['max_s'] * 1000:9.1f}")
+
+    requests_total = sum(result['server']['requests'].values())
+    throttled = sum(result['server']['throttled'].values())
+    print(f"server: {requests_total} requests, {throttled} answered with 429")
+    print(f"scheduler: {result['scheduler']}")
+    if result['errors']:
+        print(f"errors: {result['errors']}")
+
+
+if __name__ == '__main__':
+    main()
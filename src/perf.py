@@ -0,0 +1,228 @@
+'''
+per-stage timing instrumentation
+
+Hooks around loading, filtering, stats, Spotify calls and render panels
+record one event per call into a ring buffer: name, category, start,
+duration, thread and whatever the hook adds (rows, bytes, cache hits).
+
+    @perf.timed('stats')
+    def get_top_5_artists(df): ...
+
+    with perf.span('spotify.current_user', 'api') as span:
+        span.set(cache_hit=False)
+
+    perf.annotate(cache_hits=3)     # adds to the innermost open span
+
+Recording is off by default (or on with PERF_TRACE=1) and can be switched
+with enable() / disable(). While it is off a hook costs one flag check, no
+event is created.
+
+Events export as json or in the Chrome trace event format, which loads
+in chrome://tracing and https://ui.perfetto.dev.
+'''
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List
+
+
+MAX_EVENTS = 5000
+
+_enabled = os.environ.get('PERF_TRACE', '') not in ('', '0')
+_events: deque = deque(maxlen=MAX_EVENTS)
+_local = threading.local()
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+class Span:
+    '''
+    one timed call, appended to the ring buffer when it ends
+    '''
+    __slots__ = ('name', 'category', 'fields', '_start')
+
+    def __init__(self, name: str, category: str, fields: dict):
+        self.name = name
+        self.category = category
+        self.fields = fields
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def __enter__(self) -> 'Span':
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        end = time.perf_counter_ns()
+        _local.stack.pop()
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+
+        thread = threading.current_thread()
+        _events.append({
+            'name': self.name,
+            'category': self.category,
+            'start_us': self._start // 1000,
+            'duration_ms': (end - self._start) / 1e6,
+            'thread': thread.name,
+            'thread_id': thread.ident,
+            **self.fields,
+        })
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **fields) -> None:
+        pass
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, category: str, **fields) -> Span | _NullSpan:
+    '''
+    context manager timing its block, a no-op while recording is off
+    '''
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, category, fields)
+
+
+def annotate(**fields) -> None:
+    '''
+    add fields to the innermost open span of this thread
+    '''
+    if not _enabled:
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1].set(**fields)
+
+
+def describe(result: Any) -> Dict[str, int]:
+    '''
+    rows and bytes of a returned frame or history, nothing for other values
+    '''
+    if hasattr(result, 'memory_usage'):
+        return {'rows': len(result), 'bytes': int(result.memory_usage(index=True, deep=False).sum())}
+    if hasattr(result, 'nbytes') and hasattr(result, '__len__'):
+        return {'rows': len(result), 'bytes': int(result.nbytes)}
+    return {}
+
+
+def timed(category: str, name: str | None = None) -> Callable:
+    '''
+    decorator recording every call of the function as a span, with the
+    rows and bytes of its result
+    '''
+    def decorate(func: Callable) -> Callable:
+        label = name or f'{func.__module__}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            with Span(label, category, {}) as s:
+                result = func(*args, **kwargs)
+                s.set(**describe(result))
+                return result
+
+        return wrapper
+
+    return decorate
+
+
+def events() -> List[dict]:
+    '''
+    recorded events, oldest first
+    '''
+    return list(_events)
+
+
+def clear() -> None:
+    _events.clear()
+
+
+def summary() -> List[dict]:
+    '''
+    count, total, mean and max duration per event name, slowest total first
+    '''
+    groups: Dict[str, dict] = {}
+    for event in list(_events):
+        group = groups.setdefault(event['name'], {
+            'name': event['name'],
+            'category': event['category'],
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'cache_hits': 0,
+        })
+        group['count'] += 1
+        group['total_ms'] += event['duration_ms']
+        group['max_ms'] = max(group['max_ms'], event['duration_ms'])
+        group['cache_hits'] += int(event.get('cache_hit', False) is True) + event.get('cache_hits', 0)
+
+    rows = sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)
+    for row in rows:
+        row['mean_ms'] = row['total_ms'] / row['count']
+    return rows
+
+
+def to_json() -> str:
+    return json.dumps(events(), default=str, indent=1)
+
+
+def to_chrome_trace() -> str:
+    '''
+    events as complete ("X") events of the Chrome trace event format
+    '''
+    pid = os.getpid()
+    trace = []
+    threads = {}
+
+    for event in events():
+        args = {k: v for k, v in event.items() if k not in ('name', 'category', 'start_us', 'duration_ms', 'thread', 'thread_id')}
+        threads[event['thread_id']] = event['thread']
+        trace.append({
+            'name': event['name'],
+            'cat': event['category'],
+            'ph': 'X',
+            'ts': event['start_us'],
+            'dur': event['duration_ms'] * 1000,
+            'pid': pid,
+            'tid': event['thread_id'],
+            'args': args,
+        })
+
+    for tid, thread_name in threads.items():
+        trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+
+    return json.dumps({'traceEvents': trace, 'displayTimeUnit': 'ms'}, default=str)
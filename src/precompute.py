@@ -0,0 +1,379 @@
+'''
+headless batch precompute of wrapped-style summaries for many users
+
+Every export directory is one user. For each of them the exports are
+loaded (load_json) and compute_summary, which returns every stats.get_*
+table in one pass, runs for every period. The result is written to
+<out>/<user>.json:
+
+    user, source, fingerprint, options, plays, first_play, last_play
+    periods: {period: {top_artists, top_songs, top_songs_artist,
+                       listening_time, weekday_hours[, sketch]}}
+
+tables are stored as {"columns": [...], "data": [[...], ...]}. With
+--sketches every period also gets a HistorySketch (see sketches.py), the
+sketches of all users merge into global unique counts and top lists.
+
+Every user runs in a worker process of its own, --workers of them at a
+time. The worker writes the result file itself, only a small status goes
+back to the parent. Workers get an address space limit (RLIMIT_AS, where
+the platform has it), a user that exceeds it fails (with MemoryError, or
+a dead worker) instead of taking the machine down.
+
+Result files are written atomically and carry the fingerprint (names,
+sizes, mtimes) of the exports and the options they were computed from,
+so an interrupted run picks up where it stopped: users with an up to
+date result are skipped, pass --force to recompute them anyway.
+
+usage:
+    python src/precompute.py exports/*/ --out results --workers 8 --memory-limit-mb 2048
+    python src/precompute.py --root exports --out results --years --sketches
+    python src/sketches.py results --period 2024
+'''
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import pandas as pd
+
+from data import PERIOD_MONTHS, file_fingerprint, filter_period, load_json
+from history import CompactHistory
+from ingest import find_exports
+from sketches import HistorySketch
+from stats import compute_summary
+
+try:
+    import resource
+except ImportError:
+    # windows has no resource module, workers run without a memory limit
+    resource = None
+
+
+DEFAULT_PERIODS = (*PERIOD_MONTHS, 'all time')
+DEFAULT_MEMORY_LIMIT_MB = 4096
+PROGRESS_EVERY_S = 5.0
+
+
+def find_users(root: str | Path) -> List[Path]:
+    '''
+    subdirectories of root (at any depth) that contain exports
+    '''
+    directories = {path.parent for path in Path(root).rglob('*.json')}
+    return sorted(directory for directory in directories if find_exports(directory))
+
+
+def user_ids(directories: List[Path]) -> Dict[str, Path]:
+    '''
+    result name for every directory, its name unless two users share it
+    '''
+    names: Dict[str, List[Path]] = {}
+    for directory in directories:
+        names.setdefault(directory.resolve().name, []).append(directory)
+
+    ids = {}
+    for name, paths in names.items():
+        for path in paths:
+            if len(paths) > 1:
+                digest = hashlib.sha1(str(path.resolve()).encode('utf-8')).hexdigest()[:8]
+                ids[f'{name}-{digest}'] = path
+            else:
+                ids[name] = path
+    return ids
+
+
+def exports_fingerprint(directory_path: str | Path) -> List[list]:
+    return [[path.name, *file_fingerprint(path).values()] for path in find_exports(directory_path)]
+
+
+def result_path(out_dir: str | Path, user: str) -> Path:
+    return Path(out_dir) / f'{user}.json'
+
+
+def is_up_to_date(out_dir: str | Path, user: str, directory_path: str | Path, options: dict) -> bool:
+    '''
+    True if the user's result file exists and was computed from the current
+    exports with the same options
+    '''
+    try:
+        with open(result_path(out_dir, user)) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return result.get('options') == options and result.get('fingerprint') == exports_fingerprint(directory_path)
+
+
+def _table(df: pd.DataFrame) -> dict:
+    return json.loads(df.to_json(orient='split', index=False, date_format='iso'))
+
+
+def _options(periods, years: bool, sketches: bool = False) -> dict:
+    # what a result was computed with, in its json form
+    return {'periods': [str(period) for period in periods], 'years': years, 'sketches': sketches}
+
+
+def summarize_user(
+    directory_path: str | Path,
+    periods=DEFAULT_PERIODS,
+    years: bool = False,
+    sketches: bool = False,
+) -> dict:
+    '''
+    the result document of one export directory
+    '''
+    fingerprint = exports_fingerprint(directory_path)
+    df = load_json(directory_path, use_cache=False, workers=1)
+
+    result = {
+        'source': str(Path(directory_path).resolve()),
+        'fingerprint': fingerprint,
+        'options': _options(periods, years, sketches),
+        'plays': len(df),
+        'first_play': None if df.empty else df['endTime'].iat[0].isoformat(),
+        'last_play': None if df.empty else df['endTime'].iat[-1].isoformat(),
+        'periods': {},
+    }
+
+    periods = list(periods)
+    if years and not df.empty:
+        periods += [str(year) for year in range(df['endTime'].iat[0].year, df['endTime'].iat[-1].year + 1)]
+
+    history = CompactHistory.from_frame(df) if sketches and not df.empty else None
+
+    for period in periods:
+        summary = compute_summary(df, period)
+        total_ms, formatted = summary['listening_time']
+        result['periods'][str(period)] = {
+            'top_artists': _table(summary['top_artists']),
+            'top_songs': _table(summary['top_songs']),
+            'top_songs_artist': _table(summary['top_songs_artist']),
+            'listening_time': [total_ms, formatted],
+            'weekday_hours': _table(summary['weekday_hours']),
+        }
+        if sketches:
+            sketch = HistorySketch() if history is None else HistorySketch.from_history(filter_period(history, period))
+            result['periods'][str(period)]['sketch'] = sketch.to_dict()
+
+    return result
+
+
+def _limit_memory(memory_limit_mb: float | None) -> None:
+    # runs first in every worker process, before the user is summarized
+    if resource is None or not memory_limit_mb:
+        return
+    limit = int(memory_limit_mb * 2**20)
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _write_json(path: Path, document: dict) -> int:
+    payload = json.dumps(document, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    tmp_path = path.with_suffix('.json.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return len(payload)
+
+
+def run_user(user: str, directory_path: str, out_dir: str, periods, years: bool, sketches: bool = False) -> dict:
+    '''
+    summarize one user and write the result file, returns a small status
+    '''
+    start = time.perf_counter()
+    try:
+        document = {'user': user, **summarize_user(directory_path, periods, years, sketches)}
+        size = _write_json(result_path(out_dir, user), document)
+    except MemoryError:
+        return {'user': user, 'ok': False, 'error': 'MemoryError: over the worker memory limit'}
+    except Exception as e:
+        return {'user': user, 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+    return {
+        'user': user,
+        'ok': True,
+        'plays': document['plays'],
+        'bytes': size,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _user_process(conn, memory_limit_mb: float | None, args: tuple) -> None:
+    # a worker process: one user, the status goes back through conn.
+    # ctrl-c is left to the parent, which terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _limit_memory(memory_limit_mb)
+    conn.send(run_user(*args))
+    conn.close()
+
+
+def iter_statuses(
+    todo: Dict[str, Path],
+    out_dir: str | Path,
+    workers: int,
+    memory_limit_mb: float | None,
+    periods,
+    years: bool,
+    sketches: bool = False,
+) -> Iterator[dict]:
+    '''
+    run every user of todo in a worker process of its own, at most
+    `workers` at a time, and yield their statuses as they finish
+
+    native code does not always survive hitting the memory limit, with a
+    process per user a worker that dies only fails its own user
+    '''
+    queue = deque(todo.items())
+    running: Dict[int, tuple] = {}
+
+    try:
+        while queue or running:
+            while queue and len(running) < workers:
+                user, path = queue.popleft()
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(
+                    target=_user_process,
+                    args=(sender, memory_limit_mb, (user, str(path), str(out_dir), tuple(periods), years, sketches)),
+                    name=f'precompute-{user}',
+                    daemon=True,
+                )
+                process.start()
+                sender.close()
+                running[process.sentinel] = (user, process, receiver)
+
+            for sentinel in wait(list(running)):
+                user, process, receiver = running.pop(sentinel)
+                try:
+                    status = receiver.recv() if receiver.poll() else None
+                except EOFError:
+                    status = None
+                receiver.close()
+                process.join()
+
+                if status is None:
+                    error = f'worker process died with exit code {process.exitcode}, e.g. over the memory limit'
+                    status = {'user': user, 'ok': False, 'error': error}
+                yield status
+    finally:
+        for _, process, receiver in running.values():
+            process.terminate()
+            process.join()
+            receiver.close()
+
+
+def precompute(
+    directories: List[str | Path],
+    out_dir: str | Path,
+    workers: int | None = None,
+    memory_limit_mb: float | None = DEFAULT_MEMORY_LIMIT_MB,
+    periods=DEFAULT_PERIODS,
+    years: bool = False,
+    sketches: bool = False,
+    force: bool = False,
+    progress: bool = True,
+) -> dict:
+    '''
+    summarize every directory into out_dir, skipping up to date results
+    unless force, and return counts and throughput
+    '''
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stale in out_dir.glob('*.json.tmp'):
+        # left behind by an interrupted run
+        stale.unlink(missing_ok=True)
+
+    users = user_ids([Path(directory) for directory in directories])
+    options = _options(periods, years, sketches)
+    todo = {
+        user: path for user, path in users.items()
+        if force or not is_up_to_date(out_dir, user, path, options)
+    }
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(todo)))
+
+    done = 0
+    plays = 0
+    failed: Dict[str, str] = {}
+    start = time.perf_counter()
+    last_report = start
+
+    try:
+        for status in iter_statuses(todo, out_dir, workers, memory_limit_mb, periods, years, sketches):
+            if status['ok']:
+                done += 1
+                plays += status['plays']
+            else:
+                failed[status['user']] = status['error']
+                print(f"Error summarizing {status['user']}: {status['error']}")
+
+            now = time.perf_counter()
+            if progress and now - last_report >= PROGRESS_EVERY_S:
+                last_report = now
+                finished = done + len(failed)
+                print(f"{finished}/{len(todo)} users, {finished / (now - start):.1f} users/s")
+    except KeyboardInterrupt:
+        # finished users are written, the next run starts with the rest
+        print(f"Interrupted after {done + len(failed)}/{len(todo)} users, run again to resume")
+        raise
+
+    elapsed = time.perf_counter() - start
+    return {
+        'users': len(users),
+        'skipped': len(users) - len(todo),
+        'done': done,
+        'failed': failed,
+        'plays': plays,
+        'workers': workers,
+        'elapsed_s': elapsed,
+        'users_per_s': done / elapsed if elapsed > 0 else 0.0,
+        'plays_per_s': plays / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute summaries for many export directories')
+    parser.add_argument('directories', nargs='*', help='export directories, one per user')
+    parser.add_argument('--root', help='also take every directory with exports under this one')
+    parser.add_argument('--out', required=True, help='directory for the per-user result files')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--memory-limit-mb', type=float, default=DEFAULT_MEMORY_LIMIT_MB,
+                        help='address space limit per worker, 0 for none')
+    parser.add_argument('--periods', nargs='+', default=list(DEFAULT_PERIODS))
+    parser.add_argument('--years', action='store_true', help='also summarize every calendar year')
+    parser.add_argument('--sketches', action='store_true',
+                        help='also store mergeable sketches of every period (see sketches.py)')
+    parser.add_argument('--force', action='store_true', help='recompute up to date results too')
+    args = parser.parse_args()
+
+    directories = [Path(directory) for directory in args.directories]
+    if args.root:
+        directories += find_users(args.root)
+    if not directories:
+        parser.error('no export directories given')
+
+    try:
+        result = precompute(
+            directories, args.out, workers=args.workers, memory_limit_mb=args.memory_limit_mb,
+            periods=args.periods, years=args.years, sketches=args.sketches, force=args.force,
+        )
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+    print(f"{result['done']} users summarized, {result['skipped']} up to date, {len(result['failed'])} failed")
+    print(f"{result['elapsed_s']:.2f} s with {result['workers']} workers: "
+          f"{result['users_per_s']:.2f} users/s, {result['plays_per_s']:,.0f} plays/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+'''
+indexed queries over a CompactHistory
+
+Picking one artist's or track's plays out of the history used to be a
+scan over every row. HistoryIndex keeps inverted indexes from artist and
+track codes to row positions in CSR form, plus the times of those rows:
+
+    artist_positions[artist_offsets[a]:artist_offsets[a + 1]]  rows of artist a, in time order
+    artist_minutes[artist_offsets[a]:artist_offsets[a + 1]]    their minutes since 1970-01-01
+
+and the same for tracks. A query finds its segment by code, prunes it to
+the time range with a binary search and only reads the rows left:
+
+    index = HistoryIndex(history)
+    index.artist_top_tracks('Martin Garrix', period='3 months', k=20)
+    index.plays('Martin Garrix', 'Scared to Be Lonely', start='2024-01-01')
+
+Names are found with a binary search in the sorted name dictionaries,
+or case-insensitively through a dict built on first use. The tracks of an
+artist have consecutive codes, so per-track totals only count over that
+range of codes, or come from the all-time totals when the range covers
+every play of the artist.
+'''
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+import perf
+from data import period_bounds
+from history import CompactHistory
+from topk import top_k
+
+
+def _csr(codes: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    offsets (n + 1) and row positions grouped by code, rows keep their
+    order within a code. rows with a missing code (-1) are left out
+    '''
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes[codes >= 0], minlength=n)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    # missing codes sort first
+    return offsets, order[len(codes) - offsets[-1]:].astype(np.int32)
+
+
+def _minute(ts) -> int:
+    return int(pd.Timestamp(ts).to_datetime64().astype('datetime64[m]').astype(np.int64))
+
+
+class HistoryIndex:
+    '''
+    artist and track inverted indexes of a CompactHistory, read-only once built
+    '''
+
+    def __init__(self, history: CompactHistory):
+        self.history = history
+
+        self.artist_offsets, self.artist_positions = _csr(history.artist_codes, len(history.artist_names))
+        self.artist_minutes = history.minutes[self.artist_positions]
+
+        self.track_offsets, self.track_positions = _csr(history.track_codes, len(history.track_artist))
+        self.track_minutes = history.minutes[self.track_positions]
+
+        # track codes are sorted by artist, these are each artist's range of them
+        self.artist_tracks = np.searchsorted(history.track_artist, np.arange(len(history.artist_names) + 1))
+
+        # all-time totals answer queries that cover all of an artist's plays
+        self.track_ms, self.track_plays = history.track_totals()
+        artist_ms, artist_plays = history.artist_totals()
+        order = np.argsort(-artist_ms, kind='stable')
+        self.artist_order = order[artist_plays[order] > 0]
+
+        self._lower_names: Dict[str, int] | None = None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (
+            self.artist_offsets, self.artist_positions, self.artist_minutes,
+            self.track_offsets, self.track_positions, self.track_minutes, self.artist_tracks,
+            self.track_ms, self.track_plays, self.artist_order,
+        ))
+
+    def artist_code(self, name: str, case: bool = True) -> int:
+        '''
+        code of an artist name, -1 if there is no such artist. with
+        case=False the first artist matching ignoring case is returned
+        '''
+        names = self.history.artist_names
+        i = int(np.searchsorted(names, name))
+        if i < len(names) and names[i] == name:
+            return i
+        if case:
+            return -1
+
+        if self._lower_names is None:
+            lower_names = {}
+            for code, artist in enumerate(names):
+                lower_names.setdefault(artist.lower(), code)
+            self._lower_names = lower_names
+        return self._lower_names.get(name.lower(), -1)
+
+    def track_code(self, artist: str, track: str, case: bool = True) -> int:
+        '''
+        code of an (artist, track name) pair, -1 if it was never played
+        '''
+        artist_code = self.artist_code(artist, case)
+        if artist_code < 0:
+            return -1
+
+        lo, hi = self.artist_tracks[artist_code], self.artist_tracks[artist_code + 1]
+        track_names = self.history.track_names[self.history.track_name[lo:hi]]
+        if case:
+            matches = np.flatnonzero(track_names == track)
+        else:
+            matches = np.flatnonzero([name.lower() == track.lower() for name in track_names])
+        return int(lo + matches[0]) if len(matches) else -1
+
+    def period_range(self, period: str | int) -> Tuple[int | None, int | None]:
+        '''
+        [start, end) in minutes of a period, relative to the latest play
+        like data.filter_period
+        '''
+        if self.history.empty:
+            return None, None
+        max_time = pd.Timestamp(int(self.history.minutes[-1]), unit='m')
+        start, end = period_bounds(max_time, period)
+        return (
+            None if start is None else _minute(start),
+            None if end is None else _minute(end),
+        )
+
+    @staticmethod
+    def _segment(offsets, rows, minutes, code: int, start: int | None, end: int | None) -> np.ndarray:
+        if code < 0:
+            return rows[:0]
+
+        lo, hi = int(offsets[code]), int(offsets[code + 1])
+        times = minutes[lo:hi]
+        first = 0 if start is None else int(times.searchsorted(start, side='left'))
+        last = len(times) if end is None else int(times.searchsorted(end, side='left'))
+        return rows[lo + first:lo + last]
+
+    def _bounds(self, period, start, end) -> Tuple[int | None, int | None]:
+        if period is not None:
+            return self.period_range(period)
+        return (
+            None if start is None else _minute(start),
+            None if end is None else _minute(end),
+        )
+
+    def artist_rows(self, code: int, start: int | None = None, end: int | None = None) -> np.ndarray:
+        '''
+        rows of an artist code with start <= minute < end, in time order
+        '''
+        return self._segment(self.artist_offsets, self.artist_positions, self.artist_minutes, code, start, end)
+
+    def track_rows(self, code: int, start: int | None = None, end: int | None = None) -> np.ndarray:
+        '''
+        rows of a track code with start <= minute < end, in time order
+        '''
+        return self._segment(self.track_offsets, self.track_positions, self.track_minutes, code, start, end)
+
+    @perf.timed('query')
+    def plays(
+        self,
+        artist: str,
+        track: str | None = None,
+        period: str | int | None = None,
+        start=None,
+        end=None,
+        case: bool = True,
+    ) -> pd.DataFrame:
+        '''
+        endTime, artistName, trackName, msPlayed of an artist's (or one of
+        their tracks') plays in a period or between start and end
+        '''
+        start, end = self._bounds(period, start, end)
+        if track is None:
+            rows = self.artist_rows(self.artist_code(artist, case), start, end)
+        else:
+            rows = self.track_rows(self.track_code(artist, track, case), start, end)
+
+        history = self.history
+        track_codes = history.track_codes[rows]
+        names = np.where(track_codes >= 0, history.track_name[track_codes], -1)
+        return pd.DataFrame({
+            'endTime': (history.minutes[rows].astype(np.int64) * 60).astype('datetime64[s]').astype('datetime64[ns]'),
+            'artistName': history.artist_names[history.artist_codes[rows]],
+            'trackName': pd.Categorical.from_codes(names, categories=history.track_names).astype(object),
+            'msPlayed': history.ms_played[rows],
+        })
+
+    @perf.timed('query')
+    def artist_top_tracks(
+        self,
+        artist: str,
+        period: str | int | None = 'all time',
+        k: int = 20,
+        start=None,
+        end=None,
+        case: bool = True,
+    ) -> pd.DataFrame:
+        '''
+        Song, minutes, plays of an artist's k most played tracks in a
+        period (or between start and end), most minutes first
+        '''
+        start, end = self._bounds(period, start, end)
+        code = self.artist_code(artist, case)
+        rows = self.artist_rows(code, start, end)
+        if not len(rows):
+            return pd.DataFrame({'Song': [], 'minutes': pd.Series([], dtype=int), 'plays': pd.Series([], dtype=int)})
+
+        history = self.history
+        first, last = self.artist_tracks[code], self.artist_tracks[code + 1]
+        if len(rows) == self.artist_offsets[code + 1] - self.artist_offsets[code]:
+            # every play of the artist is in the range, no need to read them
+            totals = self.track_ms[first:last]
+            counts = self.track_plays[first:last]
+        else:
+            track_codes = history.track_codes[rows]
+            named = track_codes >= 0
+            offsets = track_codes[named] - first
+            totals = np.bincount(offsets, weights=history.ms_played[rows][named], minlength=last - first).astype(np.int64)
+            counts = np.bincount(offsets, minlength=last - first)
+        # ties by code, i.e. alphabetically like the stats top lists
+        top = top_k(np.where(counts > 0, totals, -1), k)
+        top = top[counts[top] > 0]
+
+        return pd.DataFrame({
+            'Song': history.track_names[history.track_name[first + top]],
+            'minutes': (totals[top] / 1000 / 60).round().astype(int),
+            'plays': counts[top],
+        })
+
+    def artists_by_time(self) -> np.ndarray:
+        '''
+        every artist name, most played (all time) first
+        '''
+        return self.history.artist_names[self.artist_order]
@@ -1,16 +1,258 @@
+import altair as alt
 import streamlit as st
-import spotipy
 import pandas as pd
 
-from stats import create_wrapped, fetch_recent_streams
+import perf
+from calendar_stats import WEEKDAYS, calendar_summary
+from data import filter_period
+from enrich import MetadataCache, enrich
+from history import CompactHistory
+from query import HistoryIndex
+from sessions import SKIP_MS, session_summary, track_durations
+from snapshot import format_age
+from stats import compute_summary
 
 
-def render_mini_wrapped_view(sp: spotipy.Spotify):
+# ── Derived frames ────────────────────────────────────────────────────────────
+# Pure functions of the fetched frames, memoized per session by range key and
+# data version so reruns that don't change the data skip them entirely.
+
+
+def build_top_artists(artists_df: pd.DataFrame, tracks_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Top 5 artists by approximate minutes (summed durations of their top
+    tracks), popularity as tie-breaker. Columns: Rank, Artist, Minutes, ...
+    """
+    if artists_df.empty:
+        return pd.DataFrame()
+
+    artists = artists_df
+
+    # If we have durations per track, approximate minutes per artist
+    if not tracks_df.empty and "durationMs" in tracks_df.columns:
+        # Use artistId if available, else fall back to artistName
+        on = "artistId" if "artistId" in tracks_df.columns and "artistId" in artists.columns else "artistName"
+        artist_ms = tracks_df.groupby(on)["durationMs"].sum()
+
+        minutes = (artists[on].map(artist_ms) / 1000 / 60).round().astype("Int64").fillna(0)
+    else:
+        minutes = 0
+
+    artists = artists.assign(Minutes=minutes)
+
+    # Take top 5 by Minutes (then popularity as tie-breaker)
+    top5_artists = artists.sort_values(
+        by=["Minutes", "popularity"],
+        ascending=[False, False],
+    ).head(5)
+
+    top5_artists.insert(0, "Rank", range(1, len(top5_artists) + 1))
+    return top5_artists.rename(columns={"artistName": "Artist"})
+
+
+def build_top_tracks(tracks_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ranked tracks with Minutes. Columns: Rank, Song, Artist, Minutes, popularity, ...
+    """
+    if tracks_df.empty:
+        return pd.DataFrame()
+
+    tracks = tracks_df.assign(
+        Rank=range(1, len(tracks_df) + 1),
+        Minutes=(tracks_df["durationMs"] / 1000 / 60).round(1),
+    )
+    return tracks.rename(columns={"trackName": "Song", "artistName": "Artist"})
+
+
+def build_artist_options(top5_artists: pd.DataFrame) -> tuple[dict, bool]:
+    """
+    Selectbox label -> key mapping for the drill-down. Prefer artistId if present.
+    """
+    if "artistId" in top5_artists.columns:
+        return dict(zip(top5_artists["Artist"], top5_artists["artistId"])), True
+
+    # Fallback: map by name only
+    return dict(zip(top5_artists["Artist"], top5_artists["Artist"])), False
+
+
+def build_artist_tracks(tracks_df: pd.DataFrame, selected_key: str, selected_name: str, use_ids: bool) -> pd.DataFrame:
+    """
+    Top 5 tracks of one artist among the user's top tracks.
+    """
+    if use_ids and "artistId" in tracks_df.columns:
+        artist_tracks = tracks_df[tracks_df["artistId"] == selected_key]
+    else:
+        # Fallback: filter by artistName text
+        artist_tracks = tracks_df[
+            tracks_df["artistName"].str.contains(
+                selected_name, case=False, na=False, regex=False
+            )
+        ]
+
+    artist_tracks = artist_tracks.assign(Minutes=(artist_tracks["durationMs"] / 1000 / 60).round(1))
+    artist_tracks = artist_tracks.rename(columns={"trackName": "Song"})
+    return artist_tracks.sort_values("popularity", ascending=False).head(5)
+
+
+def build_recent(recent_df: pd.DataFrame) -> pd.DataFrame:
+    if recent_df.empty:
+        return recent_df
+
+    recent = recent_df.assign(Minutes=(recent_df["msPlayed"] / 1000 / 60).round(1))
+    return recent.rename(
+        columns={
+            "endTime": "Played at",
+            "artistName": "Artist",
+            "trackName": "Song",
+            "weekday": "Weekday",
+        },
+    )
+
+
+def _memo(name: str, version, build, *args):
+    """
+    build(*args) once per (name, version) for this session.
+    """
+    memo = st.session_state.setdefault("_derived_frames", {})
+    memo_key = (name, version)
+    if memo_key not in memo:
+        # only keep the current version of each frame
+        for stale in [k for k in memo if k[0] == name]:
+            del memo[stale]
+        memo[memo_key] = build(*args)
+    return memo[memo_key]
+
+
+def build_enriched_songs(songs: pd.DataFrame, sp, metadata: MetadataCache) -> pd.DataFrame:
+    """
+    Top songs from the history with their Spotify popularity and genres.
+    Each song is looked up once and kept in the metadata cache, the plain
+    table is returned when Spotify can't be reached.
+    """
+    if songs.empty:
+        return songs
+
+    names = songs[["Artist", "Song"]].astype(str)
+    try:
+        found = enrich(sp, names.rename(columns={"Artist": "artistName", "Song": "trackName"}), metadata)
+    except Exception as e:
+        print(f"Error enriching top songs: {e}")
+        return songs
+
+    found = found.rename(columns={"artistName": "Artist", "trackName": "Song"})
+    enriched = names.merge(found[["Artist", "Song", "popularity", "genres"]], on=["Artist", "Song"], how="left")
+    return songs.assign(popularity=enriched["popularity"].to_numpy(), genres=enriched["genres"].to_numpy())
+
+
+# ── Panels ────────────────────────────────────────────────────────────────────
+# Each panel with its own widgets is a fragment, so changing e.g. the artist
+# selectbox only reruns that panel.
+
+
+@st.fragment
+@perf.timed('render')
+def artist_drilldown_panel(top5_artists: pd.DataFrame, tracks_df: pd.DataFrame, key: str, version):
+    st.markdown("Top songs for a selected artist")
+
+    if top5_artists.empty or tracks_df.empty:
+        st.caption("Need both top artists and tracks to show artist songs.")
+        return
+
+    artist_options, use_ids = _memo(f"artist_options_{key}", version, build_artist_options, top5_artists)
+
+    selected_name = st.selectbox(
+        "Pick an artist:",
+        options=list(artist_options.keys()),
+        key=f"artist_select_{key}",
+    )
+    selected_key = artist_options[selected_name]
+
+    artist_tracks = _memo(
+        f"artist_tracks_{key}_{selected_key}", version,
+        build_artist_tracks, tracks_df, selected_key, selected_name, use_ids,
+    )
+
+    if artist_tracks.empty:
+        st.write("No tracks found for this artist in your top tracks.")
+    else:
+        st.dataframe(
+            artist_tracks[["Song", "Minutes", "popularity"]],
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+@st.fragment
+@perf.timed('render')
+def top_tracks_panel(tracks: pd.DataFrame, time_label: str):
+    st.markdown(f"### Top tracks ({time_label})")
+
+    if tracks.empty:
+        st.write("No track data for this range.")
+        return
+
+    columns = ["Rank", "Song", "Artist", "Minutes", "popularity"]
+
+    st.dataframe(
+        tracks[columns].head(5),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    with st.expander("Show full top tracks list (up to 50)"):
+        st.dataframe(
+            tracks[columns],
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+@st.fragment
+@perf.timed('render')
+def recent_streams_panel(recent: pd.DataFrame, fetched_at: float | None):
+    st.subheader("Recently streamed songs")
+    st.caption(f"Updated {format_age(fetched_at)}")
+
+    if recent.empty:
+        st.write("No recent playback data available.")
+    else:
+        st.dataframe(
+            recent[["Played at", "Artist", "Song", "Minutes", "Weekday"]],
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+@st.fragment
+@perf.timed('render')
+def history_artist_panel(index: HistoryIndex, period: str):
+    st.markdown("### Any artist's top songs")
+
+    artist = st.selectbox(
+        "Pick an artist:",
+        options=index.artists_by_time(),
+        key="history_artist",
+    )
+    # only this artist's plays in the period are read, see query.py
+    artist_tracks = index.artist_top_tracks(artist, period, k=HISTORY_ARTIST_TRACKS)
+
+    if artist_tracks.empty:
+        st.write(f"No plays of {artist} in this period.")
+    else:
+        st.dataframe(artist_tracks, use_container_width=True, hide_index=True)
+
+
+@perf.timed('render')
+def render_mini_wrapped_view(snapshot: dict):
+    """
+    Draw the dashboard from a snapshot (see snapshot.py), no API calls here.
+    """
     st.subheader("Spotify Mini Wrapped")
 
-    # ── Fetch data once ────────────────────────────────────────────────────────
-    wrapped = create_wrapped(sp)
-    recent_df = fetch_recent_streams(sp, limit=50)
+    wrapped = snapshot["wrapped"]
+    recent_df = snapshot["recent"]
+    if recent_df is None:
+        recent_df = pd.DataFrame()
 
     label_to_key = {
         "Last 4 weeks": "short",
@@ -27,6 +269,15 @@ def render_mini_wrapped_view(sp: spotipy.Spotify):
     entry = wrapped.get(key, {})
     artists_df = entry.get("artists", pd.DataFrame())
     tracks_df = entry.get("tracks", pd.DataFrame())
+    version = entry.get("fetched_at")
+
+    if entry.get("error"):
+        st.warning(f"Some data for this range could not be refreshed: {entry['error']}")
+
+    st.caption(f"Top artists and tracks updated {format_age(version)}")
+
+    top5_artists = _memo(f"top_artists_{key}", version, build_top_artists, artists_df, tracks_df)
+    tracks = _memo(f"top_tracks_{key}", version, build_top_tracks, tracks_df)
 
     col_left, col_right = st.columns(2)
 
@@ -34,58 +285,9 @@ def render_mini_wrapped_view(sp: spotipy.Spotify):
     with col_left:
         st.markdown(f"### Top 5 artists ({time_label})")
 
-        if artists_df.empty:
+        if top5_artists.empty:
             st.write("No artist data for this range.")
-            top5_artists = pd.DataFrame()
         else:
-            artists = artists_df.copy()
-
-            # If we have durations per track, approximate minutes per artist
-            if (
-                not tracks_df.empty
-                and {"durationMs"}.issubset(tracks_df.columns)
-            ):
-                if "artistId" in tracks_df.columns and "artistId" in artists.columns:
-                    # Use artistId if available
-                    artist_time = (
-                        tracks_df.groupby("artistId", as_index=False)["durationMs"]
-                        .sum()
-                        .rename(columns={"durationMs": "totalMs"})
-                    )
-                    artists = artists.merge(
-                        artist_time,
-                        on="artistId",
-                        how="left",
-                    )
-                else:
-                    # Fallback: group by artistName
-                    artist_time = (
-                        tracks_df.groupby("artistName", as_index=False)["durationMs"]
-                        .sum()
-                        .rename(columns={"durationMs": "totalMs"})
-                    )
-                    artists = artists.merge(
-                        artist_time,
-                        on="artistName",
-                        how="left",
-                    )
-
-                artists["Minutes"] = (artists["totalMs"] / 1000 / 60).round().astype("Int64")
-                artists.drop(columns=["totalMs"], inplace=True)
-                artists["Minutes"] = artists["Minutes"].fillna(0)
-            else:
-                artists["Minutes"] = 0
-
-            # Take top 5 by Minutes (then popularity as tie-breaker)
-            artists = artists.sort_values(
-                by=["Minutes", "popularity"],
-                ascending=[False, False],
-            )
-            top5_artists = artists.head(5).copy()
-
-            top5_artists.insert(0, "Rank", range(1, len(top5_artists) + 1))
-            top5_artists.rename(columns={"artistName": "Artist"}, inplace=True)
-
             st.dataframe(
                 top5_artists[["Rank", "Artist", "Minutes"]],
                 use_container_width=True,
@@ -93,111 +295,18 @@ def render_mini_wrapped_view(sp: spotipy.Spotify):
             )
 
         # ── Top tracks for selected artist ─────────────────────────────────────
-        st.markdown("Top songs for a selected artist")
-
-        if not top5_artists.empty and not tracks_df.empty:
-            # Build selection mapping. Prefer artistId if present.
-            if "artistId" in top5_artists.columns:
-                artist_options = {
-                    row["Artist"]: row["artistId"]
-                    for _, row in top5_artists.iterrows()
-                }
-                use_ids = True
-            else:
-                # Fallback: map by name only
-                artist_options = {
-                    row["Artist"]: row["Artist"]
-                    for _, row in top5_artists.iterrows()
-                }
-                use_ids = False
-
-            selected_name = st.selectbox(
-                "Pick an artist:",
-                options=list(artist_options.keys()),
-                key=f"artist_select_{key}",
-            )
-            selected_key = artist_options[selected_name]
-
-            # Filter tracks
-            if use_ids and "artistId" in tracks_df.columns:
-                artist_tracks = tracks_df[tracks_df["artistId"] == selected_key].copy()
-            else:
-                # Fallback: filter by artistName text
-                artist_tracks = tracks_df[
-                    tracks_df["artistName"].str.contains(
-                        selected_name, case=False, na=False
-                    )
-                ].copy()
-
-            if artist_tracks.empty:
-                st.write("No tracks found for this artist in your top tracks.")
-            else:
-                artist_tracks["Minutes"] = (artist_tracks["durationMs"] / 1000 / 60).round(1)
-                artist_tracks.rename(columns={"trackName": "Song"}, inplace=True)
-                artist_tracks.sort_values("popularity", ascending=False, inplace=True)
-
-                st.dataframe(
-                    artist_tracks[["Song", "Minutes", "popularity"]].head(5),
-                    use_container_width=True,
-                    hide_index=True,
-                )
-        else:
-            st.caption("Need both top artists and tracks to show artist songs.")
+        artist_drilldown_panel(top5_artists, tracks_df, key, version)
 
     # ───────────────────────── RIGHT COLUMN ────────────────────────────────────
     with col_right:
-        st.markdown(f"### Top tracks ({time_label})")
-
-        if tracks_df.empty:
-            st.write("No track data for this range.")
-        else:
-            tracks = tracks_df.copy()
-            tracks.insert(0, "Rank", range(1, len(tracks) + 1))
-            tracks["Minutes"] = (tracks["durationMs"] / 1000 / 60).round(1)
-            tracks.rename(
-                columns={"trackName": "Song", "artistName": "Artist"},
-                inplace=True,
-            )
-
-            top5_tracks = tracks.head(5)
-
-            st.dataframe(
-                top5_tracks[["Rank", "Song", "Artist", "Minutes", "popularity"]],
-                use_container_width=True,
-                hide_index=True,
-            )
-
-            with st.expander("Show full top tracks list (up to 50)"):
-                st.dataframe(
-                    tracks[["Rank", "Song", "Artist", "Minutes", "popularity"]],
-                    use_container_width=True,
-                    hide_index=True,
-                )
+        top_tracks_panel(tracks, time_label)
 
     # ───────────────────── Recently streamed songs ────────────────────────────
     st.markdown("---")
-    st.subheader("Recently streamed songs")
 
-    if recent_df.empty:
-        st.write("No recent playback data available.")
-    else:
-        recent = recent_df.copy()
-        recent["Minutes"] = (recent["msPlayed"] / 1000 / 60).round(1)
-        recent.rename(
-            columns={
-                "endTime": "Played at",
-                "artistName": "Artist",
-                "trackName": "Song",
-                "weekday": "Weekday",
-            },
-            inplace=True,
-        )
-
-        st.dataframe(
-            recent[["Played at", "Artist", "Song", "Minutes", "Weekday"]],
-            use_container_width=True,
-            hide_index=True,
-        )
+    recent_fetched_at = snapshot.get("recent_fetched_at")
+    recent = _memo("recent", recent_fetched_at, build_recent, recent_df)
+    recent_streams_panel(recent, recent_fetched_at)
 
     # ───────────────────── Total listening (approx) ───────────────────────────
     st.markdown("---")
@@ -215,3 +324,170 @@ def render_mini_wrapped_view(sp: spotipy.Spotify):
             "Spotify's Web API does **not** expose full yearly listening time. "
             "For exact year stats, you’d need to use the exported streaming-history JSON."
         )
+
+
+HISTORY_PERIODS = ["1 month", "3 months", "12 months", "all time"]
+HISTORY_ARTIST_TRACKS = 20
+
+
+@perf.timed('render')
+def render_history_view(
+    history: CompactHistory,
+    version,
+    index: HistoryIndex,
+    sp=None,
+    metadata: MetadataCache | None = None,
+):
+    """
+    Stats from the exported streaming history. history and its index are
+    shared by every session (see resources.py), only the small summary
+    tables are per session. With a Spotify client and a metadata cache the
+    top songs get their popularity and genres.
+    """
+    if history.empty:
+        st.write("No streaming history loaded.")
+        return
+
+    period = st.selectbox("Period:", options=HISTORY_PERIODS, key="history_period")
+    summary = _memo(f"history_summary_{period}", version, compute_summary, history, period)
+
+    total_ms, total_formatted = summary["listening_time"]
+    st.metric("Total listening time", total_formatted)
+
+    col_left, col_right = st.columns(2)
+    with col_left:
+        st.markdown("### Top 5 artists")
+        st.dataframe(summary["top_artists"], use_container_width=True, hide_index=True)
+    with col_right:
+        st.markdown("### Top 5 songs")
+        top_songs = summary["top_songs"]
+        if sp is not None and metadata is not None:
+            top_songs = _memo(f"history_top_songs_{period}", version, build_enriched_songs, top_songs, sp, metadata)
+        st.dataframe(top_songs, use_container_width=True, hide_index=True)
+
+    st.markdown("### Top songs of your top artists")
+    st.dataframe(summary["top_songs_artist"], use_container_width=True, hide_index=True)
+
+    history_artist_panel(index, period)
+
+    st.markdown("### Average hours per weekday")
+    st.bar_chart(summary["weekday_hours"], x="weekday", y="Hours")
+
+    calendar = _memo(f"history_calendar_{period}", version, calendar_summary, filter_period(history, period))
+    render_calendar(calendar)
+
+    # track lengths from every play, so a play counts as the same kind in every period
+    durations = _memo("history_track_durations", version, track_durations, history)
+    sessions = _memo(
+        f"history_sessions_{period}",
+        version,
+        lambda: session_summary(filter_period(history, period), durations=durations),
+    )
+    render_sessions(sessions)
+
+
+def render_calendar(calendar: dict):
+    """
+    Streaks, weekday x hour heatmap and monthly trend from calendar_summary.
+    """
+    streaks = calendar["streaks"]
+    col_left, col_right = st.columns(2)
+    col_left.metric(
+        "Longest listening streak",
+        f"{streaks['longest_days']} days",
+        help=f"{streaks['longest_start']} to {streaks['longest_end']}" if streaks["longest_days"] else None,
+    )
+    col_right.metric("Current streak", f"{streaks['current_days']} days")
+
+    st.markdown("### When you listen")
+    heatmap = (
+        calendar["heatmap"]
+        .rename_axis("weekday")
+        .reset_index()
+        .melt(id_vars="weekday", var_name="hour", value_name="Hours")
+    )
+    chart = alt.Chart(heatmap).mark_rect().encode(
+        x=alt.X("hour:O", title="Hour of day"),
+        y=alt.Y("weekday:N", sort=WEEKDAYS, title=None),
+        color=alt.Color("Hours:Q", title="Avg hours"),
+        tooltip=["weekday", "hour", alt.Tooltip("Hours:Q", format=".2f")],
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+    st.markdown("### Hours per month")
+    st.bar_chart(calendar["monthly"], x="month", y="Hours")
+
+
+def render_sessions(sessions: dict):
+    """
+    Listening sessions, skip rates and skip-adjusted top lists from
+    session_summary.
+    """
+    stats = sessions["stats"]
+    st.markdown("### Listening sessions")
+    col_sessions, col_length, col_skips = st.columns(3)
+    col_sessions.metric(
+        "Sessions",
+        f"{stats['sessions']:,}",
+        help=f"{stats['plays_per_session']:.1f} plays per session on average",
+    )
+    col_length.metric(
+        "Median session",
+        f"{stats['median_minutes']:.0f} min",
+        help=f"90% of sessions are shorter than {stats['p90_minutes']:.0f} min",
+    )
+    col_skips.metric(
+        "Skipped plays",
+        f"{stats['skip_rate']:.0%}",
+        help=f"Under {SKIP_MS // 1000} seconds. Another {stats['partial_rate']:.0%} stopped before the end of the track",
+    )
+
+    col_left, col_right = st.columns(2)
+    with col_left:
+        st.markdown("#### Top artists without skips")
+        st.dataframe(sessions["top_artists"], use_container_width=True, hide_index=True)
+    with col_right:
+        st.markdown("#### Top songs without skips")
+        st.dataframe(sessions["top_songs"], use_container_width=True, hide_index=True)
+
+    st.markdown("#### Most skipped artists")
+    st.dataframe(sessions["artist_skips"].head(10), use_container_width=True, hide_index=True)
+
+
+def render_perf_sidebar():
+    """
+    Debug panel with the timings recorded by perf.py. Recording is
+    process-wide, so the table includes every session's calls.
+    """
+    with st.sidebar.expander("Performance", expanded=False):
+        record = st.toggle("Record timings", value=perf.enabled(), key="perf_record")
+        if record != perf.enabled():
+            perf.enable() if record else perf.disable()
+
+        events = perf.events()
+        if not events:
+            st.caption("No timings recorded yet. Turn recording on and rerun the page.")
+            return
+
+        st.caption(f"{len(events)} events (last {perf.MAX_EVENTS} kept)")
+        summary = pd.DataFrame(perf.summary())
+        st.dataframe(
+            summary[["name", "count", "total_ms", "mean_ms", "max_ms", "cache_hits"]].round(2),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+        recent = pd.DataFrame(events[-50:][::-1])
+        columns = [c for c in ("name", "duration_ms", "rows", "bytes", "cache_hit", "thread") if c in recent.columns]
+        st.dataframe(recent[columns].round(2), use_container_width=True, hide_index=True)
+
+        st.download_button("Download JSON", perf.to_json(), file_name="perf_events.json", mime="application/json")
+        st.download_button(
+            "Download Chrome trace",
+            perf.to_chrome_trace(),
+            file_name="perf_trace.json",
+            mime="application/json",
+            help="Open in chrome://tracing or ui.perfetto.dev",
+        )
+        if st.button("Clear timings"):
+            perf.clear()
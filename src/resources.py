@@ -0,0 +1,169 @@
+'''
+process-wide shared resources
+
+Streamlit sessions run in the same process, so anything that is the same
+for every session should exist once:
+
+- loaded histories: one read-only CompactHistory per export directory and
+  version of its files, however many sessions look at it, and its
+  HistoryIndex (query.py)
+- public Spotify metadata (enrich.py's MetadataCache)
+
+Per-user data (API responses, snapshots) stays keyed by user id in
+api_cache.py and snapshot.py.
+
+Shared values live in a SharedRegistry: the most recently used ones are
+kept alive by an LRU, and any value a session still holds is found again
+through a weak reference instead of being loaded a second time. A value is
+freed once it has left the LRU and no session references it.
+'''
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable
+
+import numpy as np
+
+from data import file_fingerprint, load_json
+from enrich import METADATA_CACHE_PATH, MetadataCache
+from history import CompactHistory
+from ingest import find_exports
+from query import HistoryIndex
+
+
+class SharedRegistry:
+    '''
+    thread-safe LRU of shared values, backed by weak references
+    '''
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._lru: OrderedDict[Hashable, Any] = OrderedDict()
+        self._alive: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        '''
+        the shared value for key, calling loader() only if no one has it
+        '''
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # load outside the registry lock, concurrent requests for the same key wait here
+        with key_lock:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not None:
+                    return value
+
+            value = loader()
+
+            with self._lock:
+                self.loads += 1
+                self._remember(key, value)
+                self._key_locks.pop(key, None)
+
+        return value
+
+    def _lookup(self, key: Hashable) -> Any:
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            self.hits += 1
+            return self._lru[key]
+
+        value = self._alive.get(key)
+        if value is not None:
+            self.hits += 1
+            self._remember(key, value)
+        return value
+
+    def _remember(self, key: Hashable, value: Any) -> None:
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        try:
+            self._alive[key] = value
+        except TypeError:
+            # not weak-referenceable, the LRU alone keeps it
+            pass
+
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'loads': self.loads,
+                'cached': len(self._lru),
+                'alive': len(self._alive),
+            }
+
+
+_histories = SharedRegistry(max_entries=4)
+_indexes = SharedRegistry(max_entries=4)
+_metadata_lock = threading.Lock()
+_metadata_caches: Dict[str, MetadataCache] = {}
+
+
+def _freeze(value: Any) -> Any:
+    # make the arrays of a shared value read-only
+    for array in vars(value).values():
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+    return value
+
+
+def history_key(directory_path: str | Path) -> tuple:
+    '''
+    identifies a directory's exports, changes whenever a file is added or modified
+    '''
+    directory_path = Path(directory_path).resolve()
+    files = tuple(
+        (path.name, *file_fingerprint(path).values())
+        for path in find_exports(directory_path)
+    )
+    return (str(directory_path), files)
+
+
+def shared_history(directory_path: str | Path) -> CompactHistory:
+    '''
+    the read-only CompactHistory of a directory of exports, loaded once per process
+    '''
+    # parsed in this process: forking a process pool from the threads of
+    # the streamlit server is not safe
+    return _histories.get(
+        history_key(directory_path),
+        lambda: _freeze(CompactHistory.from_frame(load_json(directory_path, workers=1))),
+    )
+
+
+def shared_index(directory_path: str | Path) -> HistoryIndex:
+    '''
+    the HistoryIndex of shared_history(directory_path), built once per process
+    '''
+    key = history_key(directory_path)
+    return _indexes.get(key, lambda: _freeze(HistoryIndex(shared_history(directory_path))))
+
+
+def shared_metadata_cache(path: str | Path = METADATA_CACHE_PATH) -> MetadataCache:
+    '''
+    one MetadataCache per file for the whole process, artist and track
+    metadata is public so every session can share it
+    '''
+    path = str(Path(path).resolve())
+    with _metadata_lock:
+        if path not in _metadata_caches:
+            _metadata_caches[path] = MetadataCache(path)
+        return _metadata_caches[path]
+
+
+def resource_stats() -> Dict[str, Dict[str, int]]:
+    return {'histories': _histories.stats(), 'indexes': _indexes.stats()}
@@ -0,0 +1,122 @@
+'''
+daily rollup of the play history
+
+One row per (day, artist, track) with the ms played and number of plays
+on that day, sorted by day:
+
+    day         artistName   trackName   msPlayed   plays
+    2024-09-29  The Weeknd   Starboy       230453       1
+
+Every stat in stats.py is a sum over plays or over days, so it gives the
+same answer on the rollup as on the raw rows. Period queries slice the
+rollup with a binary search on day and only touch the rows in the period:
+
+    rollup_summary(store.rollup(), '12 months')['top_artists']
+
+HistoryStore.summary() answers from the store's rollup this way.
+'''
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from data import period_bounds
+from ingest import CATEGORY_COLUMNS
+from stats import SUMMARY_METRICS, compute_summary
+
+
+KEYS = ['day', 'artistName', 'trackName']
+
+
+def empty_rollup() -> pd.DataFrame:
+    return pd.DataFrame({
+        'day': pd.Series([], dtype='datetime64[ns]'),
+        'artistName': pd.Categorical([]),
+        'trackName': pd.Categorical([]),
+        'msPlayed': pd.Series([], dtype='int64'),
+        'plays': pd.Series([], dtype='int64'),
+    })
+
+
+def _group(df: pd.DataFrame) -> pd.DataFrame:
+    # dropna=False keeps plays without a track name, they still count for the artist
+    return (
+        df.groupby(KEYS, observed=True, dropna=False, sort=True)
+        .agg(msPlayed=('msPlayed', 'sum'), plays=('plays', 'sum'))
+        .reset_index()
+    )
+
+
+def build_rollup(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    roll a load_json dataframe up to one row per (day, artist, track)
+    '''
+    if df.empty:
+        return empty_rollup()
+
+    plays = pd.DataFrame({
+        'day': df['endTime'].dt.normalize(),
+        'artistName': df['artistName'],
+        'trackName': df['trackName'],
+        'msPlayed': df['msPlayed'].astype(np.int64),
+        'plays': np.ones(len(df), dtype=np.int64),
+    })
+
+    return _group(plays)
+
+
+def concat_rollups(rollups: list) -> pd.DataFrame:
+    '''
+    rollups stacked in order, with the union of their name categories
+    '''
+    rollups = [r for r in rollups if not r.empty]
+    if not rollups:
+        return empty_rollup()
+
+    columns = {}
+    for column in empty_rollup().columns:
+        if column in CATEGORY_COLUMNS:
+            columns[column] = union_categoricals([pd.Categorical(r[column]) for r in rollups])
+        else:
+            columns[column] = np.concatenate([r[column].to_numpy() for r in rollups])
+
+    return pd.DataFrame(columns)
+
+
+def filter_rollup(rollup: pd.DataFrame, period: str | int) -> pd.DataFrame:
+    '''
+    rollup rows inside a filter_period style period
+
+    the latest day stands in for the latest play, which gives the same
+    bounds as filter_period because those are whole days
+    '''
+    if rollup.empty:
+        raise ValueError("Rollup is empty")
+
+    start, end = period_bounds(rollup['day'].iat[-1], period)
+
+    days = rollup['day'].to_numpy()
+    lo = 0 if start is None else int(days.searchsorted(start.to_datetime64(), side='left'))
+    hi = len(days) if end is None else int(days.searchsorted(end.to_datetime64(), side='left'))
+
+    return rollup.iloc[lo:hi]
+
+
+def _as_plays(rollup: pd.DataFrame) -> pd.DataFrame:
+    # stats.py only sums msPlayed and groups by names and dates, so the
+    # rollup rows can stand in for plays once day is called endTime
+    return rollup.rename(columns={'day': 'endTime'})
+
+
+def rollup_summary(
+    rollup: pd.DataFrame,
+    period: str | int = 'all time',
+    n: int = 5,
+    metrics: Tuple[str, ...] = SUMMARY_METRICS,
+) -> dict:
+    '''
+    stats.compute_summary of the plays in a period, from the rollup rows
+    of the period only
+    '''
+    return compute_summary(_as_plays(filter_rollup(rollup, period)), n=n, metrics=metrics)
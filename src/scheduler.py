@@ -0,0 +1,313 @@
+'''
+rate-limit-aware scheduler for Spotify API calls
+
+Every session used to fire its own burst of calls, so concurrent users hit
+429s and each retried on its own. All calls now go through one
+RequestScheduler per process:
+
+- a token bucket spreads calls to at most `rate` per second (bursts up to
+  `burst`)
+- a 429 pauses the whole bucket for its Retry-After, then the call is
+  queued again
+- identical calls (same user, endpoint and arguments) that are queued or
+  running share one request
+- interactive calls are served before background refreshes
+
+ScheduledSpotify wraps a spotipy client like CachedSpotify does:
+
+    scheduler = RequestScheduler(rate=10, burst=20)
+    sp = ScheduledSpotify(spotipy_client, scheduler, owner=user_id)
+    sp.current_user_top_tracks(limit=50)                        # interactive
+    ScheduledSpotify(spotipy_client, scheduler, user_id, BACKGROUND)
+
+stats() reports queue depth, in-flight calls and throttle events.
+'''
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+from spotipy.exceptions import SpotifyException
+
+import perf
+from api_cache import make_key
+
+
+INTERACTIVE = 0
+BACKGROUND = 10
+
+DEFAULT_RETRY_AFTER_S = 1.0
+
+
+class TokenBucket:
+    '''
+    thread-safe token bucket that can also be paused
+    '''
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        '''
+        take a token and return 0, or return how long to wait before asking again
+        '''
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def refund(self) -> None:
+        '''
+        give back a token that was not used, tokens taken before a pause are dropped
+        '''
+        with self._lock:
+            if time.monotonic() >= self._paused_until:
+                self._tokens = min(self.capacity, self._tokens + 1)
+
+    def paused(self) -> bool:
+        with self._lock:
+            return time.monotonic() < self._paused_until
+
+    def pause(self, seconds: float) -> None:
+        '''
+        hand out no tokens for the next `seconds`
+        '''
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class _Job:
+    __slots__ = ('key', 'func', 'priority', 'future', 'started', 'attempts')
+
+    def __init__(self, key: str, func: Callable[[], Any], priority: int):
+        self.key = key
+        self.func = func
+        self.priority = priority
+        self.future: Future = Future()
+        self.started = False
+        self.attempts = 0
+
+
+def retry_after(e: SpotifyException) -> float:
+    try:
+        return float(e.headers.get('Retry-After', DEFAULT_RETRY_AFTER_S))
+    except (AttributeError, TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER_S
+
+
+class RequestScheduler:
+    '''
+    priority queue of api calls run by `max_concurrency` worker threads
+    '''
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, max_concurrency: int = 8, max_retries: int = 3):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+
+        self._queue: List[tuple] = []
+        self._order = itertools.count()
+        self._in_flight: Dict[str, _Job] = {}
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.throttled = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.max_queued = 0
+        self._queued = 0
+        self._running = 0
+
+    def _start_workers(self) -> None:
+        # called with the condition held
+        while len(self._workers) < self.max_concurrency:
+            worker = threading.Thread(
+                target=self._work, name=f'spotify-scheduler-{len(self._workers)}', daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _push(self, job: _Job, priority: int) -> None:
+        heapq.heappush(self._queue, (priority, next(self._order), job))
+        self._cond.notify()
+
+    def submit(self, key: str, func: Callable[[], Any], priority: int = INTERACTIVE) -> Future:
+        '''
+        queue func() unless a call with the same key is already queued or
+        running, in which case its future is returned
+        '''
+        with self._cond:
+            self._start_workers()
+            self.submitted += 1
+
+            job = self._in_flight.get(key)
+            if job is not None:
+                self.coalesced += 1
+                if not job.started and priority < job.priority:
+                    # an interactive caller waits on it now, move it up. the
+                    # old heap entry is skipped once the job has started
+                    job.priority = priority
+                    self._push(job, priority)
+                return job.future
+
+            job = _Job(key, func, priority)
+            self._in_flight[key] = job
+            self._queued += 1
+            self.max_queued = max(self.max_queued, self._queued)
+            self._push(job, priority)
+            return job.future
+
+    def call(self, key: str, func: Callable[[], Any], priority: int = INTERACTIVE) -> Any:
+        return self.submit(key, func, priority).result()
+
+    def _drop_started(self) -> None:
+        # called with the condition held. entries of jobs that were moved
+        # up or already taken stay in the heap until they reach the top
+        while self._queue and self._queue[0][2].started:
+            heapq.heappop(self._queue)
+
+    def _wait_for_job(self) -> None:
+        with self._cond:
+            self._drop_started()
+            while not self._queue:
+                self._cond.wait()
+                self._drop_started()
+
+    def _take_job(self) -> _Job:
+        while True:
+            self._wait_for_job()
+            self._wait_for_token()
+            with self._cond:
+                # while this worker slept on the bucket, another one may have
+                # taken the job or hit a 429. a token is only kept together
+                # with a job, so an idle worker never carries one through a
+                # pause and no worker holds more than the burst allows
+                self._drop_started()
+                if self._queue and not self.bucket.paused():
+                    _, _, job = heapq.heappop(self._queue)
+                    job.started = True
+                    self._queued -= 1
+                    self._running += 1
+                    return job
+            self.bucket.refund()
+
+    def _wait_for_token(self) -> None:
+        waited = False
+        while (wait := self.bucket.reserve()) > 0:
+            waited = True
+            time.sleep(wait)
+        if waited:
+            with self._cond:
+                self.throttled += 1
+
+    def _work(self) -> None:
+        while True:
+            # take the token first and the job after it: a worker sleeping
+            # on the bucket holds no job, so an interactive call queued in
+            # the meantime goes ahead of the background calls queued before it
+            job = self._take_job()
+
+            try:
+                result = job.func()
+            except SpotifyException as e:
+                if e.http_status == 429 and job.attempts < self.max_retries:
+                    self._requeue(job, retry_after(e))
+                    continue
+                self._finish(job, error=e)
+            except BaseException as e:
+                self._finish(job, error=e)
+            else:
+                self._finish(job, result=result)
+
+    def _requeue(self, job: _Job, pause: float) -> None:
+        # everyone backs off, not only this call
+        self.bucket.pause(pause)
+        with self._cond:
+            self.rate_limited += 1
+            self.retries += 1
+            job.attempts += 1
+            job.started = False
+            self._running -= 1
+            self._queued += 1
+            self._push(job, job.priority)
+
+    def _finish(self, job: _Job, result: Any = None, error: BaseException | None = None) -> None:
+        with self._cond:
+            self._running -= 1
+            self._in_flight.pop(job.key, None)
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+                if isinstance(error, SpotifyException) and error.http_status == 429:
+                    self.rate_limited += 1
+
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                'queued': self._queued,
+                'max_queued': self.max_queued,
+                'in_flight': self._running,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'completed': self.completed,
+                'failed': self.failed,
+                'throttled': self.throttled,
+                'rate_limited': self.rate_limited,
+                'retries': self.retries,
+            }
+
+
+class ScheduledSpotify:
+    '''
+    spotipy client proxy that runs every api call through a RequestScheduler
+
+    owner identifies whose calls these are (a user id or token), calls are
+    only ever coalesced with the same owner's
+    '''
+
+    def __init__(self, sp, scheduler: RequestScheduler, owner: str, priority: int = INTERACTIVE):
+        self._sp = sp
+        self._scheduler = scheduler
+        self._owner = owner
+        self._priority = priority
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._sp, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def scheduled(*args, **kwargs):
+            key = make_key(self._owner, name, args, kwargs)
+            # time spent queued, throttled and on the wire
+            with perf.span(f'spotify.{name}', 'api', priority=self._priority) as span:
+                result = self._scheduler.call(key, lambda: attr(*args, **kwargs), self._priority)
+                if isinstance(result, dict) and isinstance(result.get('items'), list):
+                    span.set(rows=len(result['items']))
+                return result
+
+        return scheduled
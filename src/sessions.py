@@ -0,0 +1,252 @@
+'''
+listening sessions and skipped / partial plays
+
+Every stats.py total counts a 10 second skip the same as a full listen.
+This stage looks at the plays in time order, with numpy diffs and
+bincounts over the arrays of a CompactHistory and no loop over rows:
+
+    sessions   a play starts a new session when it started more than
+               gap_minutes after the previous play ended. a play's start
+               is its endTime minus msPlayed (endTime has minute precision)
+    skips      plays shorter than SKIP_MS, Spotify does not count those as
+               a stream either
+    partials   longer plays that stopped before PARTIAL_SHARE of the track.
+               exports have no track lengths, the longest play of a track
+               stands in for it. take it from the whole history, so a play
+               is the same kind in every period:
+
+                   durations = track_durations(history)
+                   session_summary(filter_period(history, period), durations=durations)
+
+               (periods of a CompactHistory keep its track codes)
+
+From those session_summary reports session counts and lengths, skip and
+partial rates per artist and top lists that leave the skips out:
+
+    summary = session_summary(filter_period(history, '12 months'))
+    summary['stats']['sessions'], summary['top_songs']
+
+Every step is O(n) over the plays (the history is already sorted by time).
+'''
+import numpy as np
+import pandas as pd
+
+from history import CompactHistory
+from topk import top_k
+
+
+SESSION_GAP_MINUTES = 30
+SKIP_MS = 30_000
+PARTIAL_SHARE = 0.8
+
+FULL = 0
+PARTIAL = 1
+SKIP = 2
+
+
+def _as_history(df: pd.DataFrame | CompactHistory) -> CompactHistory:
+    if isinstance(df, CompactHistory):
+        return df
+    return CompactHistory.from_frame(df)
+
+
+def play_bounds(history: CompactHistory) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    start and end of every play in ms since 1970-01-01
+    '''
+    end = history.minutes.astype(np.int64) * 60_000
+    return end - history.ms_played, end
+
+
+def track_durations(history: CompactHistory) -> np.ndarray:
+    '''
+    longest play of every track code, the best guess of its length
+    '''
+    durations = np.zeros(len(history.track_artist), dtype=np.int64)
+    valid = history.track_codes >= 0
+    np.maximum.at(durations, history.track_codes[valid], history.ms_played[valid])
+    return durations
+
+
+def play_kinds(
+    history: CompactHistory,
+    durations: np.ndarray | None = None,
+    skip_ms: int = SKIP_MS,
+    partial_share: float = PARTIAL_SHARE,
+) -> np.ndarray:
+    '''
+    FULL, PARTIAL or SKIP (int8) for every play. durations are the track
+    lengths by track code, track_durations(history) when not given
+    '''
+    ms_played = history.ms_played
+    codes = history.track_codes
+    if durations is None:
+        durations = track_durations(history)
+    elif len(durations) != len(history.track_artist):
+        raise ValueError("durations do not match the track codes of the history")
+
+    # plays without a track name have no length to compare with
+    length = np.where(codes >= 0, durations[codes], ms_played)
+
+    kinds = np.full(len(history), FULL, dtype=np.int8)
+    kinds[ms_played < partial_share * length] = PARTIAL
+    kinds[ms_played < skip_ms] = SKIP
+    return kinds
+
+
+def session_starts(history: CompactHistory, gap_minutes: float = SESSION_GAP_MINUTES) -> np.ndarray:
+    '''
+    row of the first play of every session
+    '''
+    if history.empty:
+        return np.zeros(0, dtype=np.intp)
+
+    start, end = play_bounds(history)
+    # the time from the end of a play to the start of the next one, plays
+    # that overlap (minute precision, replays) count as continuing
+    new_session = start[1:] - end[:-1] > gap_minutes * 60_000
+    return np.concatenate(([0], np.flatnonzero(new_session) + 1))
+
+
+def session_frame(history: CompactHistory, gap_minutes: float = SESSION_GAP_MINUTES) -> pd.DataFrame:
+    '''
+    one row per session: start, end, plays, msPlayed (sum of the plays)
+    and minutes from the start of its first play to the end of its last
+    '''
+    firsts = session_starts(history, gap_minutes)
+    if not len(firsts):
+        return pd.DataFrame({
+            'start': pd.Series([], dtype='datetime64[ns]'),
+            'end': pd.Series([], dtype='datetime64[ns]'),
+            'plays': pd.Series([], dtype=np.int64),
+            'msPlayed': pd.Series([], dtype=np.int64),
+            'minutes': pd.Series([], dtype=float),
+        })
+
+    start, end = play_bounds(history)
+    lasts = np.concatenate((firsts[1:], [len(history)])) - 1
+
+    session_start = np.minimum.reduceat(start, firsts)
+    session_end = np.maximum.reduceat(end, firsts)
+
+    return pd.DataFrame({
+        'start': session_start.astype('datetime64[ms]').astype('datetime64[ns]'),
+        'end': session_end.astype('datetime64[ms]').astype('datetime64[ns]'),
+        'plays': lasts - firsts + 1,
+        'msPlayed': np.add.reduceat(history.ms_played.astype(np.int64), firsts),
+        'minutes': (session_end - session_start) / 60_000,
+    })
+
+
+def artist_skip_rates(history: CompactHistory, kinds: np.ndarray, min_plays: int = 20) -> pd.DataFrame:
+    '''
+    Artist, plays, skips, partials, skip_rate and partial_rate of every
+    artist with at least min_plays plays, highest skip rate first
+    '''
+    valid = history.artist_codes >= 0
+    codes = history.artist_codes[valid]
+    kinds = kinds[valid]
+    n = len(history.artist_names)
+
+    plays = np.bincount(codes, minlength=n)
+    skips = np.bincount(codes, weights=kinds == SKIP, minlength=n).astype(np.int64)
+    partials = np.bincount(codes, weights=kinds == PARTIAL, minlength=n).astype(np.int64)
+
+    shown = np.flatnonzero(plays >= max(min_plays, 1))
+    rates = pd.DataFrame({
+        'Artist': history.artist_names[shown],
+        'plays': plays[shown],
+        'skips': skips[shown],
+        'partials': partials[shown],
+        'skip_rate': (skips[shown] / plays[shown]).round(3),
+        'partial_rate': (partials[shown] / plays[shown]).round(3),
+    })
+    return rates.sort_values(['skip_rate', 'plays'], ascending=[False, False], kind='stable', ignore_index=True)
+
+
+def skip_adjusted_top(history: CompactHistory, kinds: np.ndarray, n: int = 5) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    top n artists (Artist, minutes, skips) and songs (Artist, Song,
+    minutes, listens, skips) by the time listened outside of skips.
+    listens counts the full plays
+    '''
+    listened = np.where(kinds == SKIP, 0, history.ms_played).astype(np.int64)
+
+    valid = history.artist_codes >= 0
+    codes = history.artist_codes[valid]
+    n_artists = len(history.artist_names)
+    artist_ms = np.bincount(codes, weights=listened[valid], minlength=n_artists).astype(np.int64)
+    artist_skips = np.bincount(codes, weights=kinds[valid] == SKIP, minlength=n_artists).astype(np.int64)
+
+    top = top_k(artist_ms, n)
+    top = top[artist_ms[top] > 0]
+    top_artists = pd.DataFrame({
+        'Artist': history.artist_names[top],
+        'minutes': (artist_ms[top] / 1000 / 60).round().astype(int),
+        'skips': artist_skips[top],
+    })
+
+    valid = history.track_codes >= 0
+    codes = history.track_codes[valid]
+    n_tracks = len(history.track_artist)
+    track_ms = np.bincount(codes, weights=listened[valid], minlength=n_tracks).astype(np.int64)
+    track_listens = np.bincount(codes, weights=kinds[valid] == FULL, minlength=n_tracks).astype(np.int64)
+    track_skips = np.bincount(codes, weights=kinds[valid] == SKIP, minlength=n_tracks).astype(np.int64)
+
+    top = top_k(track_ms, n)
+    top = top[track_ms[top] > 0]
+    top_songs = pd.DataFrame({
+        'Artist': history.artist_names[history.track_artist[top]],
+        'Song': history.track_names[history.track_name[top]],
+        'minutes': (track_ms[top] / 1000 / 60).round().astype(int),
+        'listens': track_listens[top],
+        'skips': track_skips[top],
+    })
+
+    return top_artists, top_songs
+
+
+def session_summary(
+    df: pd.DataFrame | CompactHistory,
+    gap_minutes: float = SESSION_GAP_MINUTES,
+    n: int = 5,
+    min_plays: int = 20,
+    durations: np.ndarray | None = None,
+) -> dict:
+    '''
+    sessions and skips of a load_json dataframe or a CompactHistory.
+    durations, see the module docstring, only fit a CompactHistory sliced
+    from the one they were computed on
+
+        stats         sessions, median / mean / p90 / longest session
+                      minutes, plays_per_session, skip_rate, partial_rate
+        sessions      see session_frame()
+        artist_skips  see artist_skip_rates()
+        top_artists   skip-adjusted, see skip_adjusted_top()
+        top_songs
+    '''
+    history = _as_history(df)
+    kinds = play_kinds(history, durations)
+    sessions = session_frame(history, gap_minutes)
+    top_artists, top_songs = skip_adjusted_top(history, kinds, n)
+
+    minutes = sessions['minutes'].to_numpy()
+    has_sessions = len(sessions) > 0
+    stats = {
+        'sessions': len(sessions),
+        'median_minutes': float(np.median(minutes)) if has_sessions else 0.0,
+        'mean_minutes': float(minutes.mean()) if has_sessions else 0.0,
+        'p90_minutes': float(np.percentile(minutes, 90)) if has_sessions else 0.0,
+        'longest_minutes': float(minutes.max()) if has_sessions else 0.0,
+        'plays_per_session': len(history) / len(sessions) if has_sessions else 0.0,
+        'skip_rate': float((kinds == SKIP).mean()) if len(kinds) else 0.0,
+        'partial_rate': float((kinds == PARTIAL).mean()) if len(kinds) else 0.0,
+    }
+
+    return {
+        'stats': stats,
+        'sessions': sessions,
+        'artist_skips': artist_skip_rates(history, kinds, min_plays),
+        'top_artists': top_artists,
+        'top_songs': top_songs,
+    }
@@ -0,0 +1,501 @@
+'''
+mergeable approximate stats: unique counts and heavy hitters
+
+The exact stats keep one row per artist and track, across many users and
+years that is most of the memory. A HistorySketch is a fixed size summary
+of some plays instead, sketches of different files, chunks, periods of
+time or users add up with merge() to the sketch of all their plays:
+
+    HyperLogLog    distinct artists / tracks. 2**precision one byte
+                   registers, the relative standard error of count() is
+                   1.04 / sqrt(2**precision), 0.8% with the default 14
+    CountMinSketch ms played per artist / track. depth rows of width
+                   counters, estimate() never undercounts and overcounts
+                   by at most e / width of the total ms with probability
+                   1 - exp(-depth): 0.13% of the total at 99.3% by default
+    HeavyHitters   a count-min sketch and the `capacity` heaviest keys
+                   seen so far by its estimates, the candidates of the top
+                   lists. an artist or track with more than 1 / capacity
+                   of the total ms is always among them (up to the
+                   count-min error)
+
+Names are hashed with pd.util.hash_array, which gives the same 64 bit
+hashes in every process, so sketches built by different workers merge.
+Tracks are (artist, track name) pairs like in stats.py.
+
+    sketch = HistorySketch.from_history(filter_period(history, '12 months'))
+    merged = merge_sketches([sketch, HistorySketch.from_dict(other)])
+    merged.summary(n=5)['unique_artists']
+
+to_dict() is a small json document (registers and counters are zlib
+compressed), precompute.py --sketches writes one per user and period.
+
+usage:
+    python src/sketches.py results --period '12 months' -n 10
+'''
+import argparse
+import base64
+import json
+import math
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from history import CompactHistory
+from topk import top_k
+from utils import format_time
+
+
+DEFAULT_PRECISION = 14
+DEFAULT_WIDTH = 2048
+DEFAULT_DEPTH = 5
+DEFAULT_CAPACITY = 100
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+# one seed per count-min row, rows past the last seed reuse them shifted
+_ROW_SEEDS = np.array([
+    0x243F6A8885A308D3, 0x13198A2E03707344, 0xA4093822299F31D0, 0x082EFA98EC4E6C89,
+    0x452821E638D01377, 0xBE5466CF34E90C6C, 0xC0AC29B7C97C50DD, 0x3F84D5B5B5470917,
+], dtype=np.uint64)
+
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    '''
+    splitmix64 finalizer, spreads every input bit over the whole hash
+    '''
+    h = hashes.astype(np.uint64)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def hash_names(names: np.ndarray) -> np.ndarray:
+    '''
+    uint64 hash of every name, the same in every process
+    '''
+    return pd.util.hash_array(np.asarray(names, dtype=object))
+
+
+def hash_tracks(artist_hashes: np.ndarray, name_hashes: np.ndarray) -> np.ndarray:
+    '''
+    uint64 hash of (artist, track name) pairs from the hashes of both
+    '''
+    return _mix(artist_hashes * _GOLDEN + name_hashes)
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    # float64 holds every uint32 exactly, frexp's exponent is its bit length
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+def _pack(array: np.ndarray) -> str:
+    return base64.b64encode(zlib.compress(array.tobytes())).decode('ascii')
+
+
+def _unpack(text: str, dtype, shape) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(base64.b64decode(text)), dtype=dtype).reshape(shape).copy()
+
+
+def _check_same(kind: str, mine: tuple, theirs: tuple) -> None:
+    if mine != theirs:
+        raise ValueError(f"Cannot merge {kind} sketches with different parameters: {mine} and {theirs}")
+
+
+class HyperLogLog:
+    '''
+    distinct count of hashed keys, see the module docstring for the error
+    '''
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"precision must be between 4 and 18, got {precision}")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self) -> float:
+        '''
+        relative standard error of count()
+        '''
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, hashes: np.ndarray) -> None:
+        '''
+        count uint64 hashes, adding a hash again changes nothing
+        '''
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        p = self.precision
+        # the first p bits pick the register, it keeps the longest run of
+        # leading zeros (+ 1) seen in the remaining 64 - p bits
+        registers = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        rest = hashes << np.uint64(p)
+        ranks = np.minimum(64 - _bit_length(rest) + 1, 64 - p + 1).astype(np.uint8)
+        np.maximum.at(self.registers, registers, ranks)
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        '''
+        add the keys of other, returns self
+        '''
+        _check_same('HyperLogLog', (self.precision,), (other.precision,))
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self) -> int:
+        '''
+        estimated number of distinct keys added
+        '''
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum()
+
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # few keys, linear counting of the empty registers is more exact
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> dict:
+        return {'precision': self.precision, 'registers': _pack(self.registers)}
+
+    @classmethod
+    def from_dict(cls, document: dict) -> 'HyperLogLog':
+        sketch = cls(document['precision'])
+        sketch.registers = _unpack(document['registers'], np.uint8, len(sketch.registers))
+        return sketch
+
+
+class CountMinSketch:
+    '''
+    approximate total weight per hashed key, see the module docstring for
+    the error
+    '''
+
+    def __init__(self, width: int = DEFAULT_WIDTH, depth: int = DEFAULT_DEPTH):
+        if width < 1 or width & (width - 1):
+            raise ValueError(f"width must be a power of two, got {width}")
+        if depth < 1:
+            raise ValueError(f"depth must be at least 1, got {depth}")
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    @property
+    def epsilon(self) -> float:
+        '''
+        overcount bound as a share of the total weight
+        '''
+        return math.e / self.width
+
+    @property
+    def delta(self) -> float:
+        '''
+        probability that an estimate overcounts by more than epsilon * total
+        '''
+        return math.exp(-self.depth)
+
+    def _columns(self, hashes: np.ndarray) -> np.ndarray:
+        # depth x n counter of every hash in every row
+        seeds = np.resize(_ROW_SEEDS, self.depth) + np.arange(self.depth, dtype=np.uint64) // len(_ROW_SEEDS)
+        mask = np.uint64(self.width - 1)
+        return (_mix(hashes[None, :] ^ seeds[:, None]) & mask).astype(np.intp)
+
+    def add(self, hashes: np.ndarray, weights: np.ndarray) -> None:
+        '''
+        add weights (non-negative ints) to the counters of the hashes
+        '''
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        weights = np.asarray(weights, dtype=np.int64)
+        for row, columns in enumerate(self._columns(hashes)):
+            self.table[row] += np.bincount(columns, weights=weights, minlength=self.width).astype(np.int64)
+        self.total += int(weights.sum())
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        '''
+        estimated total weight of every hash, never below the true total
+        '''
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return np.zeros(0, dtype=np.int64)
+        columns = self._columns(hashes)
+        return np.take_along_axis(self.table, columns, axis=1).min(axis=0)
+
+    def merge(self, other: 'CountMinSketch') -> 'CountMinSketch':
+        '''
+        add the weights of other, returns self
+        '''
+        _check_same('count-min', (self.width, self.depth), (other.width, other.depth))
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def to_dict(self) -> dict:
+        return {'width': self.width, 'depth': self.depth, 'total': self.total, 'table': _pack(self.table)}
+
+    @classmethod
+    def from_dict(cls, document: dict) -> 'CountMinSketch':
+        sketch = cls(document['width'], document['depth'])
+        sketch.table = _unpack(document['table'], np.int64, (sketch.depth, sketch.width))
+        sketch.total = document['total']
+        return sketch
+
+
+class HeavyHitters:
+    '''
+    count-min sketch of every key and the labels of the `capacity` keys
+    with the highest estimates
+    '''
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, width: int = DEFAULT_WIDTH, depth: int = DEFAULT_DEPTH):
+        self.capacity = capacity
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates: Dict[int, tuple] = {}
+
+    def add(self, hashes: np.ndarray, weights: np.ndarray, labels: Tuple[np.ndarray, ...]) -> None:
+        '''
+        add weights of distinct keys, labels are arrays aligned with hashes
+        (e.g. artist names, track names) that make up each key's label
+        '''
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        self.sketch.add(hashes, weights)
+        # only the heaviest keys of this batch can make it among the candidates
+        for i in top_k(np.asarray(weights), self.capacity):
+            self.candidates[int(hashes[i])] = tuple(column[i] for column in labels)
+        self._prune()
+
+    def merge(self, other: 'HeavyHitters') -> 'HeavyHitters':
+        '''
+        add the keys of other, returns self
+        '''
+        self.sketch.merge(other.sketch)
+        self.candidates.update(other.candidates)
+        self._prune()
+        return self
+
+    def _prune(self) -> None:
+        if len(self.candidates) <= self.capacity:
+            return
+        hashes = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        keep = hashes[top_k(self.sketch.estimate(hashes), self.capacity)]
+        self.candidates = {int(h): self.candidates[int(h)] for h in keep}
+
+    def top(self, n: int) -> Tuple[List[tuple], np.ndarray]:
+        '''
+        labels and estimated weights of the n heaviest candidates
+        '''
+        hashes = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        estimates = self.sketch.estimate(hashes)
+        # ties by label, like the alphabetical ties of the exact top lists
+        order = sorted(range(len(hashes)), key=lambda i: (-estimates[i], self.candidates[int(hashes[i])]))[:n]
+        return [self.candidates[int(hashes[i])] for i in order], estimates[order]
+
+    def to_dict(self) -> dict:
+        return {
+            'capacity': self.capacity,
+            'sketch': self.sketch.to_dict(),
+            # hex keeps the 64 bit hashes exact for json readers with float numbers
+            'candidates': [[format(h, 'x'), *label] for h, label in self.candidates.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, document: dict) -> 'HeavyHitters':
+        heavy = cls(document['capacity'])
+        heavy.sketch = CountMinSketch.from_dict(document['sketch'])
+        heavy.candidates = {int(h, 16): tuple(label) for h, *label in document['candidates']}
+        return heavy
+
+
+class HistorySketch:
+    '''
+    unique artists and tracks, ms played and top artists and tracks of
+    some plays, mergeable with the sketches of other plays
+    '''
+
+    def __init__(
+        self,
+        precision: int = DEFAULT_PRECISION,
+        width: int = DEFAULT_WIDTH,
+        depth: int = DEFAULT_DEPTH,
+        capacity: int = DEFAULT_CAPACITY,
+    ):
+        self.artists = HyperLogLog(precision)
+        self.tracks = HyperLogLog(precision)
+        self.top_artists = HeavyHitters(capacity, width, depth)
+        self.top_tracks = HeavyHitters(capacity, width, depth)
+        self.plays = 0
+        self.total_ms = 0
+
+    @classmethod
+    def from_history(cls, df: pd.DataFrame | CompactHistory, **parameters) -> 'HistorySketch':
+        sketch = cls(**parameters)
+        sketch.add(df)
+        return sketch
+
+    def add(self, df: pd.DataFrame | CompactHistory) -> None:
+        '''
+        count the plays of a load_json dataframe (or a chunk of one) or a
+        CompactHistory
+        '''
+        history = df if isinstance(df, CompactHistory) else CompactHistory.from_frame(df)
+        if history.empty:
+            return
+
+        # only names are hashed, one per distinct artist and track
+        artist_hashes = hash_names(history.artist_names)
+        artist_ms, artist_plays = history.artist_totals()
+        played = np.flatnonzero(artist_plays > 0)
+        self.artists.add(artist_hashes[played])
+        self.top_artists.add(artist_hashes[played], artist_ms[played], (history.artist_names[played],))
+
+        track_ms, track_plays = history.track_totals()
+        played = np.flatnonzero(track_plays > 0)
+        artists = history.track_artist[played]
+        names = history.track_name[played]
+        # tracks without an artist are left out, like in the exact top lists
+        played, artists, names = played[artists >= 0], artists[artists >= 0], names[artists >= 0]
+        track_hashes = hash_tracks(artist_hashes[artists], hash_names(history.track_names)[names])
+        self.tracks.add(track_hashes)
+        self.top_tracks.add(
+            track_hashes,
+            track_ms[played],
+            (history.artist_names[artists], history.track_names[names]),
+        )
+
+        self.plays += len(history)
+        self.total_ms += int(history.ms_played.sum(dtype=np.int64))
+
+    def merge(self, other: 'HistorySketch') -> 'HistorySketch':
+        '''
+        add the plays of other, returns self
+        '''
+        self.artists.merge(other.artists)
+        self.tracks.merge(other.tracks)
+        self.top_artists.merge(other.top_artists)
+        self.top_tracks.merge(other.top_tracks)
+        self.plays += other.plays
+        self.total_ms += other.total_ms
+        return self
+
+    def summary(self, n: int = 5) -> dict:
+        '''
+        approximate stats of the plays
+
+            unique_artists, unique_tracks  HyperLogLog estimates
+            top_artists    Artist, minutes (count-min estimates)
+            top_songs      Artist, Song, minutes
+            listening_time (total ms, formatted), exact
+            plays          exact
+            error          relative_error of the unique counts and the
+                           max_overcount_minutes of the top lists at
+                           probability confidence
+        '''
+        artists, artist_ms = self.top_artists.top(n)
+        tracks, track_ms = self.top_tracks.top(n)
+        sketch = self.top_tracks.sketch
+
+        return {
+            'unique_artists': self.artists.count(),
+            'unique_tracks': self.tracks.count(),
+            'top_artists': pd.DataFrame({
+                'Artist': [artist for artist, in artists],
+                'minutes': (artist_ms / 1000 / 60).round().astype(int),
+            }),
+            'top_songs': pd.DataFrame({
+                'Artist': [artist for artist, _ in tracks],
+                'Song': [track for _, track in tracks],
+                'minutes': (track_ms / 1000 / 60).round().astype(int),
+            }),
+            'listening_time': (self.total_ms, format_time(self.total_ms)),
+            'plays': self.plays,
+            'error': {
+                'relative_error': self.artists.relative_error,
+                'max_overcount_minutes': sketch.epsilon * self.total_ms / 1000 / 60,
+                'confidence': 1 - sketch.delta,
+            },
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'artists': self.artists.to_dict(),
+            'tracks': self.tracks.to_dict(),
+            'top_artists': self.top_artists.to_dict(),
+            'top_tracks': self.top_tracks.to_dict(),
+            'plays': self.plays,
+            'total_ms': self.total_ms,
+        }
+
+    @classmethod
+    def from_dict(cls, document: dict) -> 'HistorySketch':
+        sketch = cls()
+        sketch.artists = HyperLogLog.from_dict(document['artists'])
+        sketch.tracks = HyperLogLog.from_dict(document['tracks'])
+        sketch.top_artists = HeavyHitters.from_dict(document['top_artists'])
+        sketch.top_tracks = HeavyHitters.from_dict(document['top_tracks'])
+        sketch.plays = document['plays']
+        sketch.total_ms = document['total_ms']
+        return sketch
+
+
+def merge_sketches(sketches: Iterable[HistorySketch]) -> HistorySketch:
+    '''
+    one sketch of the plays of all the sketches, they must share parameters
+    '''
+    merged = None
+    for sketch in sketches:
+        if merged is None:
+            # merge into a copy, the first sketch is left as it was
+            merged = HistorySketch.from_dict(sketch.to_dict())
+        else:
+            merged.merge(sketch)
+    return merged if merged is not None else HistorySketch()
+
+
+def result_sketches(paths: Iterable[str | Path], period: str) -> Iterable[HistorySketch]:
+    '''
+    sketches of a period in precompute.py result files, files without
+    one are reported and skipped
+    '''
+    for path in paths:
+        with open(path) as f:
+            result = json.load(f)
+        document = result.get('periods', {}).get(str(period), {}).get('sketch')
+        if document is None:
+            print(f"No {period} sketch in {path}, run precompute.py with --sketches")
+            continue
+        yield HistorySketch.from_dict(document)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the sketches of precompute.py results into global stats')
+    parser.add_argument('results', nargs='+', help='result files, or directories of them')
+    parser.add_argument('--period', default='all time')
+    parser.add_argument('-n', type=int, default=5, help='entries per top list')
+    args = parser.parse_args()
+
+    paths = []
+    for result in map(Path, args.results):
+        paths += sorted(result.glob('*.json')) if result.is_dir() else [result]
+
+    merged = merge_sketches(result_sketches(paths, args.period))
+    summary = merged.summary(n=args.n)
+    error = summary['error']
+
+    print(f"{len(paths)} result files, {summary['plays']:,} plays")
+    print(f"unique artists: ~{summary['unique_artists']:,}, unique tracks: ~{summary['unique_tracks']:,} "
+          f"(±{error['relative_error']:.1%})")
+    for name in ('top_artists', 'top_songs'):
+        print(f"{name}:")
+        print(summary[name].to_string(index=False))
+        print()
+    print(f"minutes overcount by at most {error['max_overcount_minutes']:,.0f} "
+          f"with probability {error['confidence']:.1%}")
+    print(f"listening time: {summary['listening_time'][1]}")
+
+
+if __name__ == '__main__':
+    main()
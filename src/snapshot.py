@@ -0,0 +1,216 @@
+'''
+stale-while-revalidate snapshots of the wrapped dashboard
+
+The last fetched dashboard (top artists/tracks per range and recent
+streams) is saved per user. A returning user's page renders straight from
+the snapshot while a background refresh fetches fresh data and replaces
+the snapshot when it is done.
+
+A snapshot is a dict:
+
+    {
+        'wrapped': {'short': {'artists', 'tracks', 'fetched_at'}, ...},
+        'recent': DataFrame,
+        'recent_fetched_at': unix seconds,
+    }
+
+Every panel keeps its own fetched_at: when a range fails to refresh, its
+previous data is kept and the page can show how old it is.
+
+Snapshots are keyed by the Spotify user id. The store also remembers the
+user id of every refresh token it has seen (token_key), so a session
+holding a known token finds its snapshot before any API call.
+'''
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict
+
+from stats import BACKGROUND_API_POOL, fetch_dashboard
+
+
+SNAPSHOT_DIR = '.snapshots'
+OWNERS_FILE = 'owners.json'
+
+# refreshes get their own threads, they wait on calls queued in stats.API_POOL
+_REFRESH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='snapshot-refresh')
+
+
+def format_age(fetched_at: float | None, now: float | None = None) -> str:
+    '''
+    "just now", "5 min ago", "3 h ago", "2 days ago"
+    '''
+    if fetched_at is None:
+        return 'never'
+
+    seconds = (now or time.time()) - fetched_at
+    if seconds < 60:
+        return 'just now'
+    if seconds < 60 * 60:
+        return f'{int(seconds // 60)} min ago'
+    if seconds < 24 * 60 * 60:
+        return f'{int(seconds // 3600)} h ago'
+    return f'{int(seconds // 86400)} days ago'
+
+
+def token_key(token_info: dict) -> str:
+    '''
+    key of an OAuth token that stays the same when the access token is
+    refreshed, the refresh token is never stored
+    '''
+    return hashlib.sha256(token_info['refresh_token'].encode()).hexdigest()[:32]
+
+
+def merge_snapshot(previous: dict | None, wrapped: dict, recent, fetched_at: float) -> dict:
+    '''
+    snapshot from a fresh fetch, keeping the previous data for panels that failed
+    '''
+    previous = previous or {'wrapped': {}, 'recent': None, 'recent_fetched_at': None}
+
+    merged = {}
+    for key, entry in wrapped.items():
+        old = previous['wrapped'].get(key)
+        if entry.get('error') and old is not None:
+            merged[key] = dict(old, error=entry['error'])
+        else:
+            merged[key] = dict(entry, fetched_at=fetched_at)
+
+    if recent is None or (recent.empty and previous['recent'] is not None):
+        recent, recent_fetched_at = previous['recent'], previous['recent_fetched_at']
+    else:
+        recent_fetched_at = fetched_at
+
+    return {'wrapped': merged, 'recent': recent, 'recent_fetched_at': recent_fetched_at}
+
+
+class SnapshotStore:
+    '''
+    per-user snapshots on disk, with an in-memory copy and at most one
+    background refresh per user
+    '''
+
+    def __init__(self, root: str | Path = SNAPSHOT_DIR, min_refresh_interval: float = 60):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.min_refresh_interval = min_refresh_interval
+        self._memory: Dict[str, dict] = {}
+        self._refreshes: Dict[str, Future] = {}
+        self._started: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._owners: Dict[str, str] = self._load_owners()
+
+    def _path(self, user_id: str) -> Path:
+        return self.root / f'{user_id}.pkl'
+
+    def _load_owners(self) -> Dict[str, str]:
+        try:
+            with open(self.root / OWNERS_FILE) as f:
+                return dict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def owner(self, key: str) -> str | None:
+        '''
+        user id of a token_key, None if the token was never seen
+        '''
+        with self._lock:
+            return self._owners.get(key)
+
+    def set_owner(self, key: str, user_id: str) -> None:
+        with self._lock:
+            if self._owners.get(key) == user_id:
+                return
+            self._owners[key] = user_id
+            owners = dict(self._owners)
+
+        path = self.root / OWNERS_FILE
+        tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(owners, f)
+        os.replace(tmp_path, path)
+
+    def load(self, user_id: str) -> dict | None:
+        with self._lock:
+            if user_id in self._memory:
+                return self._memory[user_id]
+
+        path = self._path(user_id)
+        try:
+            with open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # unreadable, truncated, or pickled by other library versions
+            # (AttributeError, ModuleNotFoundError, ...): refetch instead
+            print(f"Error loading snapshot {path}, ignoring it: {type(e).__name__}: {e}")
+            return None
+
+        with self._lock:
+            self._memory.setdefault(user_id, snapshot)
+            return self._memory[user_id]
+
+    def save(self, user_id: str, snapshot: dict) -> None:
+        path = self._path(user_id)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._memory[user_id] = snapshot
+
+    def fetch(self, sp, user_id: str, executor: ThreadPoolExecutor | None = None) -> dict:
+        '''
+        fetch the dashboard now and store it as the user's snapshot
+        '''
+        wrapped, recent = fetch_dashboard(sp, executor=executor)
+        snapshot = merge_snapshot(self.load(user_id), wrapped, recent, time.time())
+        self.save(user_id, snapshot)
+        return snapshot
+
+    def _fetch_quietly(self, sp, user_id: str) -> dict | None:
+        try:
+            return self.fetch(sp, user_id, executor=BACKGROUND_API_POOL)
+        except Exception as e:
+            print(f"Error refreshing snapshot for {user_id}: {e}")
+            return None
+
+    def refresh(self, sp, user_id: str) -> Future | None:
+        '''
+        fetch in the background, returns the running refresh if there is one.
+        refreshes start at most once per min_refresh_interval per user.
+        pass a client with background priority (see scheduler.py)
+        '''
+        with self._lock:
+            future = self._refreshes.get(user_id)
+            if future is not None and not future.done():
+                return future
+
+            if time.time() - self._started.get(user_id, 0) < self.min_refresh_interval:
+                return None
+
+            future = _REFRESH_POOL.submit(self._fetch_quietly, sp, user_id)
+            self._refreshes[user_id] = future
+            self._started[user_id] = time.time()
+            return future
+
+    def refreshing(self, user_id: str) -> Future | None:
+        with self._lock:
+            future = self._refreshes.get(user_id)
+            return future if future is not None and not future.done() else None
+
+    @staticmethod
+    def age(snapshot: dict) -> float:
+        '''
+        seconds since the oldest panel in the snapshot was fetched
+        '''
+        times = [e.get('fetched_at') for e in snapshot['wrapped'].values()]
+        times.append(snapshot.get('recent_fetched_at'))
+        times = [t for t in times if t is not None]
+        return time.time() - min(times) if times else float('inf')
@@ -1,10 +1,18 @@
+import perf
+from calendar_stats import CalendarGrid, frame_grid, weekday_averages, weekday_hours_frame
 from utils import format_time
 from data import load_json, filter_period
+from history import CompactHistory
+from topk import grouped_top_k, top_k
 
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from typing import List, Tuple
 
 
+
+@perf.timed('api')
 def fetch_recent_streams(sp, limit: int = 50) -> pd.DataFrame:
     '''
     fetch the most recent 50 streams for the user and turn into
@@ -13,8 +21,17 @@ def fetch_recent_streams(sp, limit: int = 50) -> pd.DataFrame:
 
     fetched = sp.current_user_recently_played(limit=limit)
 
+    return recent_items_to_frame(fetched.get('items', []))
+
+
+def recent_items_to_frame(items: list) -> pd.DataFrame:
+    '''
+    turn recently-played api items into endTime, artistName, trackName,
+    msPlayed, artistId, weekday rows. msPlayed is the track duration, the
+    api does not say how much of it was played
+    '''
     streams = []
-    for item in fetched.get('items', []):
+    for item in items:
         played_at = pd.to_datetime(item['played_at'])
         track = item['track']
 
@@ -41,6 +58,7 @@ def fetch_recent_streams(sp, limit: int = 50) -> pd.DataFrame:
     return df
 
 
+@perf.timed('api')
 def fetch_top_artists(sp, limit=50, time_range='long_term'):
 
     fetched = sp.current_user_top_artists(limit=limit, time_range=time_range)
@@ -59,6 +77,7 @@ def fetch_top_artists(sp, limit=50, time_range='long_term'):
     df = pd.DataFrame(artists)
     return df
 
+@perf.timed('api')
 def fetch_top_tracks(sp, limit=50, time_range='long_term'):
 
     fetched = sp.current_user_top_tracks(limit=limit, time_range=time_range)
@@ -82,134 +101,291 @@ def fetch_top_tracks(sp, limit=50, time_range='long_term'):
 
 
 
-def create_wrapped(sp):
-    time_ranges = {
-        'short' : 'short_term',
-        'medium' : 'medium_term',
-        'long' : 'long_term'
+TIME_RANGES = {
+    'short' : 'short_term',
+    'medium' : 'medium_term',
+    'long' : 'long_term'
+}
+
+# shared by every session so the number of in-flight api calls stays bounded
+API_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='spotify-api')
+# background refreshes wait in their own pool, so a burst of them never
+# delays an interactive fetch before it reaches the request scheduler
+BACKGROUND_API_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='spotify-api-background')
+
+
+def _result_or_empty(future: Future, label: str, errors: List[str]) -> pd.DataFrame:
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"Error fetching {label}: {e}")
+        errors.append(f"{label}: {e}")
+        return pd.DataFrame()
+
+
+def _submit_wrapped(sp, executor: ThreadPoolExecutor) -> dict:
+    return {
+        entry: (
+            executor.submit(fetch_top_artists, sp, limit=50, time_range=range),
+            executor.submit(fetch_top_tracks, sp, limit=50, time_range=range),
+        )
+        for entry, range in TIME_RANGES.items()
     }
 
+
+def _collect_wrapped(futures: dict) -> dict:
     wrapped = {}
 
-    for entry, range in time_ranges.items():
-        artists = fetch_top_artists(sp, limit=50, time_range=range)
-        tracks = fetch_top_tracks(sp, limit=50, time_range=range)
+    for entry, (artists_future, tracks_future) in futures.items():
+        errors: List[str] = []
+        artists = _result_or_empty(artists_future, f'{entry} top artists', errors)
+        tracks = _result_or_empty(tracks_future, f'{entry} top tracks', errors)
 
         wrapped[entry] = {
             'artists' : artists,
             'tracks' : tracks
         }
-    
+        if errors:
+            wrapped[entry]['error'] = '; '.join(errors)
+
     return wrapped
 
 
+@perf.timed('api')
+def create_wrapped(sp, executor: ThreadPoolExecutor | None = None) -> dict:
+    '''
+    top artists and tracks for the short, medium and long term ranges
+
+    the six api calls run concurrently on executor (API_POOL by default).
+    a failed call leaves empty frames and an 'error' message in its range,
+    the other ranges are unaffected
+    '''
+    return _collect_wrapped(_submit_wrapped(sp, executor or API_POOL))
+
+
+@perf.timed('api')
+def fetch_dashboard(sp, recent_limit: int = 50, executor: ThreadPoolExecutor | None = None) -> Tuple[dict, pd.DataFrame]:
+    '''
+    create_wrapped and fetch_recent_streams with all seven calls in flight at once
+    '''
+    executor = executor or API_POOL
+
+    recent_future = executor.submit(fetch_recent_streams, sp, limit=recent_limit)
+    wrapped = _collect_wrapped(_submit_wrapped(sp, executor))
+    recent = _result_or_empty(recent_future, 'recent streams', [])
+
+    return wrapped, recent
+
+
 '''
 Below are functions used in initial testing with personal data
+
+compute_summary aggregates the plays once (per track and per day) and
+derives every stat from those small tables; the get_* functions are views
+over its result. They take either a load_json dataframe or a
+CompactHistory, in which case the aggregations run on the integer codes
+with np.bincount.
 '''
-        
 
-def get_top_5_artists(df: pd.DataFrame) -> pd.DataFrame:
+SUMMARY_METRICS = ('top_artists', 'top_songs', 'top_songs_artist', 'listening_time', 'weekday_hours')
+
+
+def _aggregate(df: pd.DataFrame | CompactHistory, tracks: bool = True, daily: bool = True) -> dict:
     '''
-    return top 5 artists with stteaming time
+    one aggregation pass over the plays
+
+    artists: artistName, msPlayed per artist
+    tracks:  artistName, trackName, msPlayed per track
+    daily:   calendar_stats.CalendarGrid
+    total_ms
     '''
+    aggregates = {}
 
-    top_5_artists = df.groupby('artistName', as_index=False)['msPlayed'].sum().sort_values(by='msPlayed', ascending=False).head(5)
+    if daily:
+        aggregates['daily'] = frame_grid(df)
 
-    top_5_artists['minutes'] = (top_5_artists['msPlayed'] / 1000 / 60).round().astype(int)
-    top_5_artists.drop(columns=['msPlayed'], inplace=True)
+    if isinstance(df, CompactHistory):
+        aggregates['total_ms'] = int(df.ms_played.sum(dtype=np.int64))
 
-    top_5_artists.rename(columns={'artistName': 'Artist'}, inplace=True)
-    top_5_artists.reset_index(drop=True, inplace=True)
+        if tracks:
+            artist_ms, artist_plays = df.artist_totals()
+            played = np.flatnonzero(artist_plays)
+            aggregates['artists'] = pd.DataFrame({
+                'artistName': df.artist_names[played],
+                'msPlayed': artist_ms[played],
+            })
 
-    return top_5_artists
+            track_ms, track_plays = df.track_totals()
+            played = np.flatnonzero(track_plays)
+            aggregates['tracks'] = pd.DataFrame({
+                'artistName': df.artist_names[df.track_artist[played]],
+                'trackName': df.track_names[df.track_name[played]],
+                'msPlayed': track_ms[played],
+            })
 
-def get_top_5_songs_artist(df: pd.DataFrame) -> pd.DataFrame:
+        return aggregates
 
+    aggregates['total_ms'] = int(df['msPlayed'].sum())
+
+    if tracks:
+        # keep rows without a track name here, they still count for their artist
+        by_track = df.groupby(['artistName', 'trackName'], as_index=False, observed=True, dropna=False)['msPlayed'].sum()
+        aggregates.update(track_aggregates(by_track))
+
+    return aggregates
+
+
+def track_aggregates(by_track: pd.DataFrame) -> dict:
     '''
-    for top 5 artists, return their top 5 songs
+    the artists and tracks aggregates from artistName, trackName, msPlayed
+    per track, rows without a track name only count for their artist
     '''
-    top_5_artists = get_top_5_artists(df)['Artist'].tolist()
+    return {
+        'artists': by_track.groupby('artistName', as_index=False, observed=True)['msPlayed'].sum(),
+        'tracks': by_track.dropna(subset=['artistName', 'trackName']).reset_index(drop=True),
+    }
 
-    df_top_artists = df[df['artistName'].isin(top_5_artists)].copy()
 
-    buckets = df_top_artists.groupby(['artistName', 'trackName'], as_index=False)['msPlayed'].sum()
-    buckets.reset_index(drop=True, inplace=True)
+def _top_artists(artists: pd.DataFrame, n: int) -> pd.DataFrame:
+    top_artists = artists.iloc[top_k(artists['msPlayed'].to_numpy(), n)]
 
-    top_songs = buckets.sort_values(['artistName', 'msPlayed'], ascending=[True, False]).groupby('artistName').head(5)
-    
-    top_songs['minutes'] = (top_songs['msPlayed'] / 1000 / 60).round().astype(int)
-    top_songs.drop(columns=['msPlayed'], inplace=True)
+    top_artists = top_artists.assign(minutes=(top_artists['msPlayed'] / 1000 / 60).round().astype(int))
+    top_artists = top_artists.drop(columns=['msPlayed'])
 
-    top_songs['artistName'] = pd.Categorical(
-        top_songs['artistName'],
-        categories=top_5_artists,
-        ordered=True
-    )
-    top_songs = top_songs.sort_values(['artistName', 'minutes'], ascending=[True, False])
+    top_artists = top_artists.rename(columns={'artistName': 'Artist'})
+    top_artists.reset_index(drop=True, inplace=True)
 
+    return top_artists
 
 
+def _top_songs(tracks: pd.DataFrame, n: int) -> pd.DataFrame:
+    top_songs = tracks.iloc[top_k(tracks['msPlayed'].to_numpy(), n)]
 
-    top_songs.rename(columns= {'artistName' : 'Artist' , 'trackName' : 'Song'}, inplace=True)
+    top_songs = top_songs.assign(minutes=(top_songs['msPlayed'] / 1000 / 60).round().astype(int))
+
+    top_songs = top_songs.rename(columns= {'artistName' : 'Artist' , 'trackName' : 'Song'})
+    top_songs = top_songs.drop(columns=['msPlayed'])
     top_songs.reset_index(drop=True, inplace=True)
 
+    return top_songs
+
+
+def _top_songs_artist(tracks: pd.DataFrame, top_artists: List[str], n: int) -> pd.DataFrame:
+    # rank of each track's artist among the top artists, -1 for everyone else
+    artist_rank = pd.Index(top_artists).get_indexer(tracks['artistName'])
+    rows = np.flatnonzero(artist_rank >= 0)
+
+    selected = rows[grouped_top_k(tracks['msPlayed'].to_numpy()[rows], artist_rank[rows], n)]
+    top_songs = tracks.iloc[selected]
+
+    top_songs = top_songs.assign(
+        artistName=pd.Categorical.from_codes(artist_rank[selected], categories=top_artists, ordered=True),
+        minutes=(top_songs['msPlayed'] / 1000 / 60).round().astype(int),
+    )
+    top_songs = top_songs.drop(columns=['msPlayed'])
+
+    top_songs = top_songs.rename(columns= {'artistName' : 'Artist' , 'trackName' : 'Song'})
+    top_songs.reset_index(drop=True, inplace=True)
 
     return top_songs
 
-def get_top_5_songs(df: pd.DataFrame) -> pd.DataFrame:
-    '''
-    return top 5 songs of all time (not by artist) by streaming time
 
-    1. group by tracks and sum
-    2. order the list
-    3. select 5 from from list
-    4. format
+def _weekday_hours(daily: CalendarGrid) -> pd.DataFrame:
+    averages, _ = weekday_averages(daily)
+    return weekday_hours_frame(averages)
+
 
+@perf.timed('stats')
+def compute_summary(
+    df: pd.DataFrame | CompactHistory,
+    period: str | int = 'all time',
+    n: int = 5,
+    metrics: Tuple[str, ...] = SUMMARY_METRICS,
+) -> dict:
     '''
+    every stat for a period from a single aggregation of the plays
 
-    top_5_songs = df.groupby(['artistName', 'trackName'], as_index=False)['msPlayed'].sum().sort_values(by='msPlayed', ascending=False).head(5)
+    returns a dict with the requested metrics:
+        top_artists       Artist, minutes for the top n artists
+        top_songs         Artist, Song, minutes for the top n songs
+        top_songs_artist  Artist, Song, minutes, top n songs of each top n artist
+        listening_time    (total ms, formatted)
+        weekday_hours     average hours listened per weekday
 
-    top_5_songs['minutes'] = (top_5_songs['msPlayed'] / 1000 / 60).round().astype(int)
+    call this once instead of the get_* functions when several stats are needed
+    '''
+    if not df.empty:
+        df = filter_period(df, period)
 
-    top_5_songs.rename(columns= {'artistName' : 'Artist' , 'trackName' : 'Song'}, inplace=True)
-    top_5_songs.drop(columns=['msPlayed'], inplace=True)
-    top_5_songs.reset_index(drop=True, inplace=True)
+    need_tracks = bool({'top_artists', 'top_songs', 'top_songs_artist'} & set(metrics))
+    aggregates = _aggregate(df, tracks=need_tracks, daily='weekday_hours' in metrics)
 
-    return top_5_songs
+    return summary_from_aggregates(aggregates, n=n, metrics=metrics)
 
-def get_listening_time(df: pd.DataFrame) -> Tuple[int, str]:
+
+@perf.timed('stats')
+def summary_from_aggregates(aggregates: dict, n: int = 5, metrics: Tuple[str, ...] = SUMMARY_METRICS) -> dict:
     '''
-    return total listening time in ms and days:hours:min format
+    format the per-artist, per-track and per-day aggregates into a summary
     '''
-    total_ms = int(df['msPlayed'].sum())
-    total_formatted = format_time(total_ms)
+    summary = {}
 
-    return total_ms, total_formatted
+    if 'top_artists' in metrics or 'top_songs_artist' in metrics:
+        top_artists = _top_artists(aggregates['artists'], n)
+        if 'top_artists' in metrics:
+            summary['top_artists'] = top_artists
 
+    if 'top_songs' in metrics:
+        summary['top_songs'] = _top_songs(aggregates['tracks'], n)
 
+    if 'top_songs_artist' in metrics:
+        summary['top_songs_artist'] = _top_songs_artist(aggregates['tracks'], top_artists['Artist'].tolist(), n)
 
+    if 'listening_time' in metrics:
+        total_ms = aggregates['total_ms']
+        summary['listening_time'] = (total_ms, format_time(total_ms))
 
-def get_listening_time_per_day(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Return average listening time in HOURS per weekday.
-    """
+    if 'weekday_hours' in metrics:
+        summary['weekday_hours'] = _weekday_hours(aggregates['daily'])
+
+    return summary
 
-    df = df.copy()
-    df['date'] = df['endTime'].dt.date
-    df['weekday'] = df['endTime'].dt.day_name()
 
-    # total listening per actual day
-    daily_totals = df.groupby(['date', 'weekday'], as_index=False)['msPlayed'].sum()
+@perf.timed('stats')
+def get_top_5_artists(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    return top 5 artists with stteaming time
+    '''
+    return compute_summary(df, metrics=('top_artists',))['top_artists']
 
-    weekday_avg = daily_totals.groupby('weekday', as_index=False)['msPlayed'].mean()
+@perf.timed('stats')
+def get_top_5_songs_artist(df: pd.DataFrame) -> pd.DataFrame:
 
-    weekday_avg['Hours'] = (weekday_avg['msPlayed'] / 1000 / 60 / 60).round(2)
+    '''
+    for top 5 artists, return their top 5 songs
+    '''
+    return compute_summary(df, metrics=('top_songs_artist',))['top_songs_artist']
 
-    days = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
-    weekday_avg['weekday'] = pd.Categorical(weekday_avg['weekday'], categories=days, ordered=True)
-    weekday_avg = weekday_avg.sort_values('weekday')
+@perf.timed('stats')
+def get_top_5_songs(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    return top 5 songs of all time (not by artist) by streaming time
+    '''
+    return compute_summary(df, metrics=('top_songs',))['top_songs']
+
+@perf.timed('stats')
+def get_listening_time(df: pd.DataFrame) -> Tuple[int, str]:
+    '''
+    return total listening time in ms and days:hours:min format
+    '''
+    return compute_summary(df, metrics=('listening_time',))['listening_time']
 
-    return weekday_avg
 
 
 
+@perf.timed('stats')
+def get_listening_time_per_day(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return average listening time in HOURS per weekday.
+    """
+    return compute_summary(df, metrics=('weekday_hours',))['weekday_hours']
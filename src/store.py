@@ -0,0 +1,356 @@
+'''
+append-only on-disk play history
+
+Rows are kept in one parquet file per calendar month, each sorted by
+endTime. The manifest remembers which export files were already ingested
+(by name, size and mtime) so an update only parses new or changed exports
+and only rewrites the months they touch.
+
+    store/
+        manifest.json
+        2024-09.parquet
+        2024-10.parquet
+        ...
+        rollup/
+            2024-09.parquet
+            ...
+        collected/
+            2024-09.parquet
+            ...
+
+rollup/ holds the daily (day, artist, track) rollup from rollup.py, split
+by month like the plays. An append rebuilds the rollup of the months it
+touched from their rows, so adding a month costs about as much as that
+month whatever the size of the history.
+
+Plays from the recently-played collector (append(..., collected=True))
+only carry the track's duration as msPlayed, so they never equal the
+export rows of the same plays. collected/ keeps a copy of them per month:
+an export row of the same artist and track that ended within
+RECONCILE_TOLERANCE of a collected play replaces it, and collected plays
+that an export already has are not added. Matching stays within a month.
+
+usage:
+    python src/store.py data --period '12 months'
+'''
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from data import file_fingerprint
+from ingest import concat_exports, empty_frame, find_exports, parse_exports
+from rollup import build_rollup, concat_rollups, rollup_summary
+from stats import compute_summary
+
+
+STORE_DIR_NAME = '.history_store'
+MANIFEST_NAME = 'manifest.json'
+ROLLUP_DIR_NAME = 'rollup'
+# single-file rollup of older stores, replaced by ROLLUP_DIR_NAME
+LEGACY_ROLLUP_NAME = 'rollup.parquet'
+
+COLLECTED_DIR_NAME = 'collected'
+
+# two rows with the same values for these columns are the same play
+DEDUP_KEYS = ['endTime', 'trackName', 'msPlayed']
+
+# an export's endTime (whole minutes) and the api's played_at of one play
+RECONCILE_TOLERANCE = pd.Timedelta(minutes=2)
+
+
+def _month_keys(end_time: pd.Series) -> np.ndarray:
+    return end_time.to_numpy().astype('datetime64[M]').astype(str)
+
+
+def _play_keys(df: pd.DataFrame) -> pd.MultiIndex:
+    return pd.MultiIndex.from_arrays([
+        df[column].astype(object) if isinstance(df[column].dtype, pd.CategoricalDtype) else df[column]
+        for column in DEDUP_KEYS
+    ])
+
+
+def _names(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        'endTime': df['endTime'].to_numpy(),
+        'artistName': df['artistName'].astype(object).to_numpy(),
+        'trackName': df['trackName'].astype(object).to_numpy(),
+    })
+
+
+def same_plays(df: pd.DataFrame, other: pd.DataFrame, tolerance: pd.Timedelta = RECONCILE_TOLERANCE) -> np.ndarray:
+    '''
+    which rows of df have a row of other with the same artist and track
+    that ended within tolerance of them
+    '''
+    if df.empty or other.empty:
+        return np.zeros(len(df), dtype=bool)
+
+    left = _names(df).assign(row=np.arange(len(df))).sort_values('endTime', kind='stable')
+    right = _names(other).assign(match=True).sort_values('endTime', kind='stable')
+    matched = pd.merge_asof(
+        left, right,
+        on='endTime', by=['artistName', 'trackName'], direction='nearest', tolerance=tolerance,
+    )
+
+    result = np.zeros(len(df), dtype=bool)
+    result[matched['row'].to_numpy()] = matched['match'].eq(True).to_numpy()
+    return result
+
+
+class HistoryStore:
+    '''
+    persistent, incrementally updated streaming history
+    '''
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._manifest = self._read_manifest()
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.root / MANIFEST_NAME) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+
+        manifest.setdefault('sources', {})
+        manifest.setdefault('partitions', {})
+        return manifest
+
+    def _write_manifest(self) -> None:
+        tmp_path = self.root / (MANIFEST_NAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self.root / MANIFEST_NAME)
+
+    def _partition_path(self, month: str) -> Path:
+        return self.root / f'{month}.parquet'
+
+    def _read_partition(self, month: str) -> pd.DataFrame:
+        path = self._partition_path(month)
+        if not path.exists():
+            return empty_frame()
+        return pd.read_parquet(path, memory_map=True)
+
+    def _write_partition(self, month: str, df: pd.DataFrame) -> None:
+        path = self._partition_path(month)
+        tmp_path = path.with_suffix('.parquet.tmp')
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self._manifest['partitions'][month] = len(df)
+
+    def _collected_path(self, month: str) -> Path:
+        return self.root / COLLECTED_DIR_NAME / f'{month}.parquet'
+
+    def _read_collected(self, month: str) -> pd.DataFrame:
+        path = self._collected_path(month)
+        if not path.exists():
+            return empty_frame()
+        return pd.read_parquet(path)
+
+    def _write_collected(self, month: str, df: pd.DataFrame) -> None:
+        path = self._collected_path(month)
+        if df.empty:
+            path.unlink(missing_ok=True)
+            return
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix('.parquet.tmp')
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def _rollup_path(self, month: str) -> Path:
+        return self.root / ROLLUP_DIR_NAME / f'{month}.parquet'
+
+    def _write_rollup(self, month: str, rows: pd.DataFrame) -> None:
+        path = self._rollup_path(month)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix('.parquet.tmp')
+        build_rollup(rows).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def _read_rollup(self, month: str) -> pd.DataFrame:
+        path = self._rollup_path(month)
+        if not path.exists():
+            # stores written before the rollup was split by month
+            self._write_rollup(month, self._read_partition(month))
+        return pd.read_parquet(path, memory_map=True)
+
+    def rollup(self) -> pd.DataFrame:
+        '''
+        daily rollup of everything in the store sorted by day, see rollup.py
+        '''
+        with self._lock:
+            rollup = concat_rollups([self._read_rollup(month) for month in self.months])
+            (self.root / LEGACY_ROLLUP_NAME).unlink(missing_ok=True)
+        return rollup
+
+    def summary(self, period: str | int = 'all time', n: int = 5) -> dict:
+        '''
+        stats.compute_summary of a period, answered from the daily rollup
+        instead of the plays
+        '''
+        rollup = self.rollup()
+        if rollup.empty:
+            return compute_summary(empty_frame(), period, n=n)
+        return rollup_summary(rollup, period, n=n)
+
+    @property
+    def months(self) -> List[str]:
+        return sorted(self._manifest['partitions'])
+
+    @property
+    def sources(self) -> Dict[str, dict]:
+        return dict(self._manifest['sources'])
+
+    def __len__(self) -> int:
+        return sum(self._manifest['partitions'].values())
+
+    def pending_sources(self, directory_path: str | Path) -> List[Path]:
+        '''
+        export files in directory_path that are new or changed since they were ingested
+        '''
+        return [
+            path for path in find_exports(directory_path)
+            if self._manifest['sources'].get(path.name) != file_fingerprint(path)
+        ]
+
+    def append(self, df: pd.DataFrame, collected: bool = False) -> int:
+        '''
+        merge rows into the store, skipping plays that are already stored
+
+        collected=True marks rows from the recently-played collector, see
+        the module docstring. only the months covered by df (plays and
+        rollup) are read and rewritten. returns by how many rows the store
+        grew, export rows that replace collected plays do not count
+        '''
+        with self._lock:
+            return self._append(df, collected)
+
+    def _append(self, df: pd.DataFrame, collected: bool = False) -> int:
+        if df.empty:
+            return 0
+
+        df = df.sort_values('endTime', kind='stable', ignore_index=True)
+        months = _month_keys(df['endTime'])
+
+        # df is sorted, so every month is one contiguous block
+        boundaries = np.flatnonzero(months[1:] != months[:-1]) + 1
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [len(df)]])
+
+        added = 0
+        for start, end in zip(starts, ends):
+            month = str(months[start])
+            new_rows = df.iloc[start:end]
+            existing = self._read_partition(month)
+            collected_rows = self._read_collected(month)
+            replaced = 0
+
+            if not existing.empty:
+                seen = _play_keys(new_rows).isin(_play_keys(existing))
+                new_rows = new_rows[~seen]
+                if new_rows.empty:
+                    continue
+
+            if collected:
+                # plays an export already brought in
+                is_collected = _play_keys(existing).isin(_play_keys(collected_rows))
+                new_rows = new_rows[~same_plays(new_rows, existing[~is_collected])]
+                if new_rows.empty:
+                    continue
+            elif not collected_rows.empty:
+                # the export rows are exact, they replace the collected ones
+                stale = same_plays(collected_rows, new_rows)
+                if stale.any():
+                    existing = existing[~_play_keys(existing).isin(_play_keys(collected_rows[stale]))]
+                    collected_rows = collected_rows[~stale]
+                    replaced = int(stale.sum())
+                    self._write_collected(month, collected_rows)
+
+            if collected:
+                self._write_collected(month, concat_exports([collected_rows, new_rows]))
+
+            merged = concat_exports([existing, new_rows])
+            merged = merged.sort_values('endTime', kind='stable', ignore_index=True)
+            self._write_partition(month, merged)
+            self._write_rollup(month, merged)
+            added += len(new_rows) - replaced
+
+        self._write_manifest()
+        return added
+
+    def update(self, directory_path: str | Path, workers: int | None = None) -> int:
+        '''
+        ingest the export files in directory_path that are new or changed
+
+        returns the number of rows added
+        '''
+        paths = self.pending_sources(directory_path)
+        if not paths:
+            return 0
+
+        with self._lock:
+            added = 0
+            # append file by file so overlapping exports dedupe against each other
+            for path, df in zip(paths, parse_exports(paths, workers=workers)):
+                added += self._append(df)
+                self._manifest['sources'][path.name] = file_fingerprint(path)
+
+            self._write_manifest()
+
+        return added
+
+    def load(self, start: str | pd.Timestamp | None = None, end: str | pd.Timestamp | None = None) -> pd.DataFrame:
+        '''
+        stored history sorted by endTime, optionally limited to [start, end)
+
+        only the monthly partitions that overlap the range are read
+        '''
+        months = self.months
+        if start is not None:
+            start = pd.Timestamp(start)
+            months = [m for m in months if m >= start.strftime('%Y-%m')]
+        if end is not None:
+            end = pd.Timestamp(end)
+            months = [m for m in months if pd.Timestamp(m) < end]
+
+        df = concat_exports([self._read_partition(month) for month in months])
+
+        if start is not None or end is not None:
+            times = df['endTime'].to_numpy()
+            lo = 0 if start is None else times.searchsorted(start.to_datetime64(), side='left')
+            hi = len(df) if end is None else times.searchsorted(end.to_datetime64(), side='left')
+            df = df.iloc[lo:hi].reset_index(drop=True)
+
+        return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the local history store')
+    parser.add_argument('directory', help='directory with the json exports')
+    parser.add_argument('--store', help=f'store directory (default: <directory>/{STORE_DIR_NAME})')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--period', help="also print the summary of a period, e.g. '12 months' or 2024")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.store or Path(args.directory) / STORE_DIR_NAME)
+    added = store.update(args.directory, workers=args.workers)
+    print(f"added {added} rows, {len(store)} rows in {len(store.months)} months")
+
+    if args.period:
+        summary = store.summary(args.period)
+        print(f"\nlistening time: {summary['listening_time'][1]}")
+        for name in ('top_artists', 'top_songs', 'weekday_hours'):
+            print(f"\n{name}:\n{summary[name].to_string(index=False)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+'''
+deterministic synthetic streaming histories for benchmarks
+
+Writes StreamingHistory_music_*.json files in the account-data layout
+(see ingest.py) with any number of plays. Popularity follows Zipf's law
+like real listening: artists are drawn with P(rank k) ~ 1 / k**s, then one
+of the artist's tracks with the same kind of distribution. Plays are
+spread over the date range with more listening in the evening, most plays
+last the whole track and some are skipped early.
+
+The same arguments always produce the same files, every file is
+generated from its own seed so files can be written independently.
+
+SyntheticSpotify answers the Web API calls the app makes (top artists and
+tracks, recently played) from the same kind of catalog, with payloads
+shaped like the real responses.
+
+usage:
+    python src/synth.py .bench_data/1m --scale 1m
+    python src/synth.py /tmp/history --plays 250000 --seed 7
+'''
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(records):
+        return json.dumps(records, ensure_ascii=False).encode('utf-8')
+
+
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+    '50m': 50_000_000,
+}
+
+ROWS_PER_FILE = 10_000
+TRACKS_PER_ARTIST = 20
+SKIP_RATE = 0.2
+
+# relative amount of listening per hour of the day, 00:00 to 23:00
+HOURLY_WEIGHTS = np.array([
+    3, 2, 1, 1, 1, 1, 2, 4, 6, 6, 5, 5,
+    6, 6, 5, 5, 6, 7, 8, 9, 9, 8, 6, 4,
+], dtype=np.float64)
+
+
+def catalog_size(plays: int) -> int:
+    '''
+    number of artists for a history of `plays` plays, grows with the history
+    but much slower than it
+    '''
+    return int(np.clip(np.sqrt(plays) * 2, 50, 50_000))
+
+
+def zipf_cdf(n: int, s: float) -> np.ndarray:
+    '''
+    cumulative probabilities of ranks 0..n-1 under Zipf's law with exponent s
+    '''
+    weights = 1.0 / np.arange(1, n + 1, dtype=np.float64) ** s
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def _sample(rng: np.random.Generator, cdf: np.ndarray, size: int) -> np.ndarray:
+    # inverse transform sampling, much faster than rng.choice(p=...) for big catalogs
+    return np.searchsorted(cdf, rng.random(size), side='right').clip(max=len(cdf) - 1)
+
+
+def _track_durations(n_tracks: int, seed: int) -> np.ndarray:
+    '''
+    fixed duration in ms for every track of the catalog, 2 to 6 minutes
+    '''
+    rng = np.random.default_rng([seed, 0])
+    return rng.normal(210_000, 40_000, n_tracks).clip(120_000, 360_000).astype(np.int64)
+
+
+def generate_plays(
+    n: int,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    n_artists: int,
+    durations: np.ndarray,
+    rng: np.random.Generator,
+    artist_s: float = 1.1,
+    track_s: float = 0.9,
+) -> pd.DataFrame:
+    '''
+    n plays between start and end, sorted by endTime. artistName / trackName
+    are plain strings, endTime is rounded to the minute like the exports
+    '''
+    artists = _sample(rng, zipf_cdf(n_artists, artist_s), n)
+    ranks = _sample(rng, zipf_cdf(TRACKS_PER_ARTIST, track_s), n)
+    track_ids = artists * TRACKS_PER_ARTIST + ranks
+
+    # day uniformly in the range, hour from the daily pattern, minute uniformly
+    first_day = start.normalize()
+    n_days = max((end.normalize() - first_day).days, 1)
+    days = rng.integers(0, n_days, n)
+    hours = _sample(rng, np.cumsum(HOURLY_WEIGHTS) / HOURLY_WEIGHTS.sum(), n)
+    minutes = days * 1440 + hours * 60 + rng.integers(0, 60, n)
+    minutes.sort()
+    end_time = first_day + pd.to_timedelta(minutes, unit='m')
+
+    ms_played = durations[track_ids]
+    skipped = rng.random(n) < SKIP_RATE
+    ms_played = np.where(skipped, (ms_played * rng.random(n)).astype(np.int64), ms_played)
+
+    return pd.DataFrame({
+        'endTime': end_time.strftime('%Y-%m-%d %H:%M'),
+        'artistName': 'Artist ' + pd.Series(artists).astype(str),
+        'trackName': 'Track ' + pd.Series(track_ids).astype(str),
+        'msPlayed': ms_played,
+    })
+
+
+def write_history(
+    directory_path: str | Path,
+    plays: int,
+    seed: int = 0,
+    start: str = '2015-01-01',
+    end: str = '2025-01-01',
+    rows_per_file: int = ROWS_PER_FILE,
+    n_artists: int | None = None,
+) -> list[Path]:
+    '''
+    write `plays` synthetic plays as StreamingHistory_music_*.json files,
+    oldest plays in the first file. returns the written paths
+    '''
+    directory_path = Path(directory_path)
+    directory_path.mkdir(parents=True, exist_ok=True)
+
+    n_artists = n_artists or catalog_size(plays)
+    durations = _track_durations(n_artists * TRACKS_PER_ARTIST, seed)
+
+    n_files = max(-(-plays // rows_per_file), 1)
+    bounds = pd.date_range(pd.Timestamp(start), pd.Timestamp(end), periods=n_files + 1)
+
+    paths = []
+    for i in range(n_files):
+        n = min(rows_per_file, plays - i * rows_per_file)
+        rng = np.random.default_rng([seed, i + 1])
+        df = generate_plays(n, bounds[i], bounds[i + 1], n_artists, durations, rng)
+
+        path = directory_path / f'StreamingHistory_music_{i}.json'
+        with open(path, 'wb') as f:
+            f.write(_dumps(df.to_dict('records')))
+        paths.append(path)
+
+    return paths
+
+
+def ensure_history(directory_path: str | Path, plays: int, seed: int = 0) -> Path:
+    '''
+    directory with a synthetic history of `plays` plays, only generated if
+    it is missing or was generated with other arguments
+    '''
+    directory_path = Path(directory_path)
+    marker = directory_path / 'synth.json'
+    params = {'plays': plays, 'seed': seed}
+
+    try:
+        with open(marker) as f:
+            if json.load(f) == params:
+                return directory_path
+    except (OSError, ValueError):
+        pass
+
+    for old in directory_path.glob('StreamingHistory_music_*.json'):
+        old.unlink()
+    write_history(directory_path, plays, seed=seed)
+
+    with open(marker, 'w') as f:
+        json.dump(params, f)
+    return directory_path
+
+
+TIME_RANGE_SEEDS = {'long_term': 1, 'medium_term': 2, 'short_term': 3}
+
+
+class SyntheticSpotify:
+    '''
+    deterministic stand-in for the spotipy client calls used by the app
+
+    artists and tracks are ranked like in write_history: artist 0 is the
+    most listened, the top lists of the shorter time ranges are shuffled a
+    little. recently played is one play every 4 minutes up to `now`.
+    n_markets pads every track with an available_markets list, real
+    responses carry up to ~185 of them and most of their size is this list
+    '''
+
+    def __init__(
+        self,
+        n_artists: int = 500,
+        seed: int = 0,
+        now: str | pd.Timestamp = '2025-01-01',
+        n_recent: int = 50,
+        n_markets: int = 0,
+    ):
+        self.n_artists = n_artists
+        self.seed = seed
+        now = pd.Timestamp(now)
+        self.now = now if now.tzinfo is not None else now.tz_localize('UTC')
+        self.n_recent = n_recent
+        self.markets = [f'{chr(65 + i // 26 % 26)}{chr(65 + i % 26)}' for i in range(n_markets)]
+        self.durations = _track_durations(n_artists * TRACKS_PER_ARTIST, seed)
+
+    def artist(self, i: int) -> dict:
+        return {
+            'id': f'{i:022d}',
+            'name': f'Artist {i}',
+            'popularity': int(np.clip(95 - 10 * np.log2(1 + i), 0, 100)),
+            'genres': ['synthetic', f'genre {i % 25}'],
+            'type': 'artist',
+        }
+
+    def track(self, t: int) -> dict:
+        artist = self.artist(t // TRACKS_PER_ARTIST)
+        return {
+            'id': f'{t:022d}',
+            'name': f'Track {t}',
+            'artists': [{'id': artist['id'], 'name': artist['name'], 'type': 'artist'}],
+            'duration_ms': int(self.durations[t]),
+            'popularity': max(artist['popularity'] - 2 * (t % TRACKS_PER_ARTIST), 0),
+            'available_markets': self.markets,
+            'type': 'track',
+        }
+
+    def _lookup(self, ids: list, n: int, make) -> list:
+        # unknown ids are null in the api's batch responses
+        found = []
+        for id_ in ids:
+            i = int(id_) if str(id_).isdigit() else -1
+            found.append(make(i) if 0 <= i < n else None)
+        return found
+
+    def artists(self, artists: list) -> dict:
+        return {'artists': self._lookup(artists, self.n_artists, self.artist)}
+
+    def tracks(self, tracks: list, market: str | None = None) -> dict:
+        return {'tracks': self._lookup(tracks, len(self.durations), self.track)}
+
+    def search(self, q: str, limit: int = 10, offset: int = 0, type: str = 'track', market: str | None = None) -> dict:
+        '''
+        finds the track in queries like enrich.py's `track:"Track 12" artist:"Artist 0"`
+        '''
+        items = []
+        for word in q.replace('"', ' ').split():
+            if word.isdigit() and int(word) < len(self.durations):
+                items.append(self.track(int(word)))
+                break
+        return {'tracks': self._page(items, limit, offset)}
+
+    def _ranking(self, n: int, time_range: str) -> np.ndarray:
+        # rank plus noise that grows for the shorter ranges
+        rng = np.random.default_rng([self.seed, TIME_RANGE_SEEDS.get(time_range, 0)])
+        noise = rng.normal(0, TIME_RANGE_SEEDS.get(time_range, 1) * 2, n)
+        return np.argsort(np.arange(n) + noise, kind='stable')
+
+    def _page(self, items: list, limit: int, offset: int) -> dict:
+        return {
+            'items': items[offset:offset + limit],
+            'total': len(items),
+            'limit': limit,
+            'offset': offset,
+            'next': None,
+            'previous': None,
+        }
+
+    def current_user(self) -> dict:
+        return {'id': 'synthetic-user', 'display_name': 'Synthetic User', 'type': 'user'}
+
+    def current_user_top_artists(self, limit: int = 20, offset: int = 0, time_range: str = 'medium_term') -> dict:
+        ranking = self._ranking(min(self.n_artists, 50), time_range)
+        return self._page([self.artist(int(i)) for i in ranking], limit, offset)
+
+    def current_user_top_tracks(self, limit: int = 20, offset: int = 0, time_range: str = 'medium_term') -> dict:
+        # the best track of each top artist first, then their second best...
+        n_artists = min(self.n_artists, 25)
+        tracks = [a * TRACKS_PER_ARTIST + r for r in range(2) for a in range(n_artists)]
+        ranking = self._ranking(len(tracks), time_range)
+        return self._page([self.track(tracks[i]) for i in ranking], limit, offset)
+
+    def current_user_recently_played(self, limit: int = 50, after: int | None = None, before: int | None = None) -> dict:
+        '''
+        newest first like the api. with `after` the page holds the `limit`
+        plays right after it, otherwise the `limit` plays before `before`
+        '''
+        now_ms = int(self.now.timestamp() * 1000)
+        played_at = now_ms - np.arange(self.n_recent, dtype=np.int64) * 4 * 60 * 1000
+
+        if after is not None:
+            selected = played_at[played_at > int(after)][-limit:]
+        else:
+            selected = played_at[played_at < int(before)] if before is not None else played_at
+            selected = selected[:limit]
+
+        rng = np.random.default_rng([self.seed, 4])
+        artists = _sample(rng, zipf_cdf(self.n_artists, 1.1), self.n_recent)
+        ranks = _sample(rng, zipf_cdf(TRACKS_PER_ARTIST, 0.9), self.n_recent)
+
+        items = []
+        for ms in selected:
+            j = int((now_ms - ms) // (4 * 60 * 1000))
+            items.append({
+                'played_at': pd.Timestamp(int(ms), unit='ms', tz='UTC').strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'track': self.track(int(artists[j] * TRACKS_PER_ARTIST + ranks[j])),
+                'context': None,
+            })
+
+        has_older = len(selected) > 0 and selected[-1] > played_at[-1]
+        return {
+            'items': items,
+            'limit': limit,
+            'next': 'next' if after is None and has_older else None,
+            'cursors': {
+                'after': str(int(selected[0])) if len(selected) else None,
+                'before': str(int(selected[-1])) if len(selected) else None,
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic Spotify streaming history')
+    parser.add_argument('directory', help='output directory')
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument('--scale', choices=SCALES, default='100k', help='number of plays')
+    size.add_argument('--plays', type=int, help='exact number of plays')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', default='2015-01-01')
+    parser.add_argument('--end', default='2025-01-01')
+    parser.add_argument('--rows-per-file', type=int, default=ROWS_PER_FILE)
+    args = parser.parse_args()
+
+    plays = args.plays or SCALES[args.scale]
+    paths = write_history(
+        args.directory, plays, seed=args.seed, start=args.start, end=args.end,
+        rows_per_file=args.rows_per_file,
+    )
+    print(f"wrote {plays} plays to {len(paths)} files in {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
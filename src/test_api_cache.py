@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+import api_cache
+from api_cache import CachedSpotify, TTLCache, make_key
+
+
+TTLS = {'short': 10, 'long': 100}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(api_cache.time, 'time', lambda: now[0])
+    return now
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(TTLS)
+    cache.put('a', 'short', 1)
+    cache.put('b', 'long', 2)
+    cache.put('c', 'uncached', 3)
+
+    assert cache.get('a') == (True, 1)
+    assert cache.get('c') == (False, None)
+
+    clock[0] += 10
+    assert cache.get('a') == (False, None)
+    assert cache.get('b') == (True, 2)
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'evictions': 0, 'entries': 1}
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = TTLCache(TTLS, max_entries=2)
+    cache.put('a', 'long', 1)
+    cache.put('b', 'long', 2)
+    cache.get('a')
+    cache.put('c', 'long', 3)
+
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
+    assert cache.get('c') == (True, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_survive_a_restart(clock, tmp_path):
+    cache = TTLCache(TTLS, path=tmp_path)
+    cache.put('a', 'short', {'items': [1, 2]})
+    cache.put('b', 'long', 'kept')
+
+    clock[0] += 20
+    restarted = TTLCache(TTLS, path=tmp_path)
+    assert restarted.get('a') == (False, None)
+    assert restarted.get('b') == (True, 'kept')
+    # the expired entry's file is removed on load
+    assert len(list(tmp_path.glob('*.json'))) == 1
+
+
+def test_restart_keeps_the_newest_entries(clock, tmp_path):
+    cache = TTLCache(TTLS, max_entries=10, path=tmp_path)
+    for i in range(5):
+        cache.put(str(i), 'long', i)
+        clock[0] += 1
+    (tmp_path / 'broken.json').write_text('{')
+
+    restarted = TTLCache(TTLS, max_entries=2, path=tmp_path)
+    assert restarted.stats()['entries'] == 2
+    assert restarted.get('4') == (True, 4)
+    assert restarted.get('0') == (False, None)
+
+
+def test_clear_one_user(clock):
+    cache = TTLCache(TTLS)
+    cache.put(make_key('alice', 'long', (), {}), 'long', 1)
+    cache.put(make_key('bob', 'long', (), {}), 'long', 2)
+
+    cache.clear('alice')
+    assert cache.get(make_key('alice', 'long', (), {}))[0] is False
+    assert cache.get(make_key('bob', 'long', (), {}))[0] is True
+
+
+class FakeSpotify:
+    def __init__(self):
+        self.calls = []
+
+    def current_user_top_tracks(self, limit=20, time_range='medium_term'):
+        self.calls.append((limit, time_range))
+        return {'items': [limit, time_range]}
+
+    def playlist(self, playlist_id):
+        self.calls.append(playlist_id)
+        return {'id': playlist_id}
+
+
+def test_cached_spotify(clock):
+    cache = TTLCache()
+    sp = FakeSpotify()
+    alice = CachedSpotify(sp, cache, 'alice')
+
+    assert alice.current_user_top_tracks(limit=50) == {'items': [50, 'medium_term']}
+    alice.current_user_top_tracks(limit=50)
+    alice.current_user_top_tracks(limit=10)
+    CachedSpotify(sp, cache, 'bob').current_user_top_tracks(limit=50)
+    # endpoints without a TTL always go to the api
+    alice.playlist('p')
+    alice.playlist('p')
+
+    assert sp.calls == [(50, 'medium_term'), (10, 'medium_term'), (50, 'medium_term'), 'p', 'p']
+    assert json.loads(make_key('alice', 'x', (1,), {'b': 2, 'a': 1})) == ['alice', 'x', [1], [['a', 1], ['b', 2]]]
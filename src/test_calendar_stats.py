@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from calendar_stats import (
+    WEEKDAYS,
+    calendar_grid,
+    calendar_summary,
+    frame_grid,
+    merge_grids,
+    play_minutes,
+    streaks,
+)
+from data import load_json
+from history import CompactHistory
+from synth import write_history
+
+
+@pytest.fixture(scope='module')
+def history(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('exports')
+    write_history(directory, 5_000, start='2023-01-01', end='2025-01-01')
+    return load_json(directory, use_cache=False)
+
+
+def _frame(end_times, ms_played):
+    return pd.DataFrame({
+        'endTime': pd.to_datetime(end_times),
+        'artistName': 'a',
+        'trackName': 't',
+        'msPlayed': ms_played,
+    })
+
+
+def test_sorted_and_unsorted_grids_match(history):
+    minutes = play_minutes(history)
+    ms_played = history['msPlayed'].to_numpy()
+    shuffled = np.random.default_rng(0).permutation(len(history))
+
+    by_search = calendar_grid(minutes, ms_played, is_sorted=True)
+    by_bincount = calendar_grid(minutes[shuffled], ms_played[shuffled])
+
+    assert by_search.first_day == by_bincount.first_day
+    np.testing.assert_array_equal(by_search.hourly_ms, by_bincount.hourly_ms)
+    np.testing.assert_array_equal(by_search.hourly_plays, by_bincount.hourly_plays)
+    assert by_search.hourly_ms.sum() == ms_played.sum()
+
+
+def test_compact_history_grid_matches_frame(history):
+    frame = frame_grid(history)
+    compact = frame_grid(CompactHistory.from_frame(history))
+    np.testing.assert_array_equal(frame.hourly_ms, compact.hourly_ms)
+
+
+def test_merged_halves_match_whole(history):
+    half = len(history) // 2
+    merged = merge_grids([frame_grid(history.iloc[half:]), frame_grid(history.iloc[:half])])
+    whole = frame_grid(history)
+
+    assert merged.first_day == whole.first_day
+    np.testing.assert_array_equal(merged.hourly_ms, whole.hourly_ms)
+    np.testing.assert_array_equal(merged.hourly_plays, whole.hourly_plays)
+
+
+def test_summary_matches_pandas(history):
+    summary = calendar_summary(history)
+    end_time = history['endTime']
+
+    daily = history.groupby(end_time.dt.date)['msPlayed'].sum()
+    played = summary['daily'][summary['daily']['plays'] > 0]
+    assert played['msPlayed'].tolist() == daily.tolist()
+
+    weekday_means = (
+        history.groupby([end_time.dt.date, end_time.dt.day_name()])['msPlayed'].sum()
+        .groupby(level=1).mean()
+    )
+    weekday_hours = summary['weekday_hours'].set_index('weekday')['msPlayed']
+    for weekday in WEEKDAYS:
+        assert weekday_hours[weekday] == pytest.approx(weekday_means[weekday])
+
+    monthly = history.groupby(end_time.dt.to_period('M'))['msPlayed'].sum()
+    assert summary['monthly']['msPlayed'].tolist() == monthly.tolist()
+
+    # the heatmap averages over every calendar occurrence of the weekday
+    by_weekday_hour = history.groupby([end_time.dt.day_name(), end_time.dt.hour])['msPlayed'].sum()
+    days = pd.Series(pd.date_range(end_time.min().normalize(), end_time.max().normalize())).dt.day_name().value_counts()
+    expected = by_weekday_hour['Monday'][20] / days['Monday'] / 1000 / 60 / 60
+    assert summary['heatmap'].loc['Monday', 20] == pytest.approx(expected, abs=1e-3)
+
+
+def test_streaks():
+    df = _frame(
+        ['2024-03-01 10:00', '2024-03-02 23:59', '2024-03-03 00:00', '2024-03-05 12:00', '2024-03-06 12:00'],
+        [1000] * 5,
+    )
+    result = streaks(frame_grid(df))
+
+    assert result['longest_days'] == 3
+    assert result['longest_start'] == np.datetime64('2024-03-01')
+    assert result['longest_end'] == np.datetime64('2024-03-03')
+    assert result['current_days'] == 2
+
+
+def test_empty_history():
+    summary = calendar_summary(_frame([], []))
+    assert summary['daily'].empty
+    assert summary['weekday_hours'].empty
+    assert summary['streaks']['longest_days'] == 0
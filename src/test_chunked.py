@@ -0,0 +1,58 @@
+import json
+
+import pandas as pd
+import pytest
+
+from chunked import MIN_CHUNK_BYTES, iter_records, stream_summary
+from data import load_json
+from stats import compute_summary
+from synth import write_history
+
+
+PERIODS = ['1 month', '3 months', '12 months', 'all time', 2024]
+
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('exports')
+    write_history(directory, 6_000, rows_per_file=2_000, start='2022-01-01', end='2025-01-01')
+    return directory
+
+
+def assert_same_summary(result, expected):
+    assert result.keys() == expected.keys()
+    for metric, value in expected.items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(
+                result[metric].reset_index(drop=True),
+                value.reset_index(drop=True),
+                check_dtype=False,
+                check_categorical=False,
+            )
+        else:
+            assert result[metric] == value
+
+
+def test_iter_records_in_small_chunks(exports):
+    path = exports / 'StreamingHistory_music_0.json'
+    chunks = list(iter_records(path, MIN_CHUNK_BYTES))
+
+    assert len(chunks) > 1
+    with open(path) as f:
+        assert [record for chunk in chunks for record in chunk] == json.load(f)
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_stream_summary_matches_compute_summary(exports, period):
+    # the smallest chunks, several per file
+    result = stream_summary(exports, period, memory_limit_mb=0)
+    expected = compute_summary(load_json(exports, use_cache=False), period)
+    assert_same_summary(result, expected)
+
+
+def test_truncated_export_is_an_error(tmp_path):
+    records = [{'endTime': '2024-01-01 10:00', 'artistName': 'a', 'trackName': 't', 'msPlayed': 1000}] * 10
+    (tmp_path / 'StreamingHistory_music_0.json').write_text(json.dumps(records)[:-20])
+
+    with pytest.raises(ValueError):
+        stream_summary(tmp_path)
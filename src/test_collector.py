@@ -0,0 +1,76 @@
+import json
+
+import pandas as pd
+import pytest
+import spotipy
+
+from collector import RecentlyPlayedCollector
+from fake_api import FakeSpotifyServer
+from store import HistoryStore
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeSpotifyServer() as server:
+        yield server
+
+
+def _client(server: FakeSpotifyServer) -> spotipy.Spotify:
+    sp = spotipy.Spotify(auth='token', retries=0)
+    sp.prefix = server.api_url
+    return sp
+
+
+def _write_export(directory, server: FakeSpotifyServer) -> pd.DataFrame:
+    '''
+    an account data export of the fake api's recently played tracks, with
+    the real msPlayed and a whole-minute endTime a little after played_at
+    '''
+    items = server.catalog.current_user_recently_played(limit=server.catalog.n_recent)['items']
+    records = [
+        {
+            'endTime': (pd.Timestamp(item['played_at']) + pd.Timedelta(seconds=40)).strftime('%Y-%m-%d %H:%M'),
+            'artistName': item['track']['artists'][0]['name'],
+            'trackName': item['track']['name'],
+            'msPlayed': item['track']['duration_ms'] // 2,
+        }
+        for item in items
+    ]
+    directory.mkdir()
+    with open(directory / 'StreamingHistory_music_0.json', 'w') as f:
+        json.dump(records, f)
+    return pd.DataFrame(records)
+
+
+def test_collect_is_incremental(server, tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    collector = RecentlyPlayedCollector(_client(server), store)
+
+    assert collector.collect() == server.catalog.n_recent
+    assert collector.collect() == 0
+    assert len(store) == server.catalog.n_recent
+
+    # exports have whole minutes
+    assert (store.load()['endTime'].dt.second == 0).all()
+
+
+def test_export_replaces_collected_plays(server, tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    RecentlyPlayedCollector(_client(server), store).collect()
+
+    export = _write_export(tmp_path / 'export', server)
+    assert store.update(tmp_path / 'export') == 0
+
+    stored = store.load()
+    assert len(stored) == len(export)
+    assert sorted(stored['msPlayed']) == sorted(export['msPlayed'])
+    assert stored['msPlayed'].sum() == store.rollup()['msPlayed'].sum()
+
+
+def test_collected_plays_already_exported_are_skipped(server, tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    export = _write_export(tmp_path / 'export', server)
+    assert store.update(tmp_path / 'export') == len(export)
+
+    assert RecentlyPlayedCollector(_client(server), store).collect() == 0
+    assert len(store) == len(export)
@@ -0,0 +1,138 @@
+import pandas as pd
+import pytest
+import spotipy
+
+import enrich
+from enrich import MetadataCache, resolve_tracks
+from fake_api import FakeSpotifyServer
+from render import build_enriched_songs
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeSpotifyServer() as server:
+        yield server
+
+
+@pytest.fixture
+def sp(server):
+    sp = spotipy.Spotify(auth='token', retries=0)
+    sp.prefix = server.api_url
+    return sp
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = MetadataCache(tmp_path / 'metadata.sqlite')
+    yield cache
+    cache.close()
+
+
+def _searches(server):
+    return server.stats()['requests'].get('/v1/search', 0)
+
+
+PLAYS = pd.DataFrame({
+    'artistName': ['Artist 0', 'Artist 0', 'Artist 1', 'Nobody', None],
+    'trackName': ['Track 3', 'Track 3', 'Track 21', 'Nothing', 'Track 5'],
+    'msPlayed': [1000, 2000, 3000, 4000, 5000],
+})
+
+
+def test_cache_round_trip(tmp_path):
+    cache = MetadataCache(tmp_path / 'metadata.sqlite')
+    cache.set_many({'a': {'x': 1}, 'b': None})
+    cache.close()
+
+    cache = MetadataCache(tmp_path / 'metadata.sqlite')
+    assert cache.get_many(['a', 'b', 'c']) == {'a': {'x': 1}, 'b': None}
+    assert len(cache) == 2
+    cache.close()
+
+
+def test_enrich_against_the_fake_api(server, sp, cache):
+    searches = _searches(server)
+    result = enrich.enrich(sp, PLAYS, cache)
+
+    assert result[['artistName', 'trackName']].values.tolist() == [
+        ['Artist 0', 'Track 3'], ['Artist 1', 'Track 21'], ['Nobody', 'Nothing'],
+    ]
+    found = result.set_index('trackName')
+    assert found.loc['Track 3', 'trackId'] == f'{3:022d}'
+    assert found.loc['Track 21', 'artistId'] == f'{1:022d}'
+    assert found.loc['Track 21', 'genres'] == 'synthetic, genre 1'
+    assert found.loc['Track 3', 'durationMs'] > 0
+    assert pd.isna(found.loc['Nothing', 'trackId'])
+    # one search per distinct pair
+    assert _searches(server) - searches == 3
+
+    # everything is cached, misses included
+    enrich.enrich(sp, PLAYS, cache)
+    assert _searches(server) - searches == 3
+
+
+def test_rows_with_track_ids_are_not_searched(server, sp, cache):
+    plays = PLAYS.iloc[:1].assign(trackId=f'{3:022d}')
+    searches = _searches(server)
+
+    result = enrich.enrich(sp, plays, cache)
+    assert result['popularity'].notna().all()
+    assert _searches(server) == searches
+
+
+class FlakySpotify:
+    '''
+    searches fail for tracks with a quote in their name
+    '''
+
+    def __init__(self):
+        self.queries = []
+
+    def search(self, q, type, limit):
+        self.queries.append(q)
+        if 'Quote' in q:
+            raise ConnectionError('connection reset')
+        return {'tracks': {'items': []}}
+
+
+def test_failed_searches_are_retried(cache, monkeypatch, capsys):
+    monkeypatch.setattr(enrich, 'SEARCH_SAVE_EVERY', 2)
+    sp = FlakySpotify()
+    pairs = [('A', f'Song {i}') for i in range(5)] + [('B', 'Quote "this"')]
+
+    assert resolve_tracks(sp, pairs, cache) == {}
+    assert 'Error searching 1 of 6 tracks' in capsys.readouterr().out
+    # quotes do not end the field filter early
+    assert sp.queries[-1] == 'track:"Quote  this " artist:"B"'
+
+    # the failure was not cached, the misses were
+    sp.queries = []
+    resolve_tracks(sp, pairs, cache)
+    assert sp.queries == ['track:"Quote  this " artist:"B"']
+
+
+def test_history_top_songs_get_metadata(sp, cache):
+    songs = pd.DataFrame({
+        'Artist': pd.Categorical(['Artist 1', 'Nobody']),
+        'Song': pd.Categorical(['Track 21', 'Nothing']),
+        'minutes': [50, 10],
+    })
+    result = build_enriched_songs(songs, sp, cache)
+
+    assert list(result.columns) == ['Artist', 'Song', 'minutes', 'popularity', 'genres']
+    assert result['genres'].iloc[0] == 'synthetic, genre 1'
+    assert pd.isna(result['popularity'].iloc[1])
+
+
+def test_history_top_songs_without_spotify(cache, capsys):
+    class Offline:
+        def search(self, **kwargs):
+            raise ConnectionError('offline')
+
+        def artists(self, ids):
+            raise ConnectionError('offline')
+
+    songs = pd.DataFrame({'Artist': ['A'], 'Song': ['x'], 'minutes': [1]})
+    result = build_enriched_songs(songs, Offline(), cache)
+    assert result['popularity'].isna().all()
+    assert 'Error searching' in capsys.readouterr().out
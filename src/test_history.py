@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import load_json
+from history import CompactHistory
+from synth import write_history
+
+
+def _frame(rows):
+    return pd.DataFrame({
+        'endTime': pd.date_range('2024-01-01', periods=len(rows), freq='min'),
+        'artistName': [artist for artist, _ in rows],
+        'trackName': [track for _, track in rows],
+        'msPlayed': np.arange(1, len(rows) + 1) * 1000,
+    })
+
+
+def _row_tracks(history):
+    '''
+    (artist, track name) of every play from the track table, None when missing
+    '''
+    tracks = []
+    for code in history.track_codes:
+        if code < 0:
+            tracks.append(None)
+            continue
+        artist = history.track_artist[code]
+        tracks.append((
+            history.artist_names[artist] if artist >= 0 else None,
+            history.track_names[history.track_name[code]],
+        ))
+    return tracks
+
+
+def test_missing_names():
+    rows = [(None, 'x'), ('A', None), ('A', 'z'), (None, None), ('B', 'x')]
+    history = CompactHistory.from_frame(_frame(rows))
+
+    assert _row_tracks(history) == [(None, 'x'), None, ('A', 'z'), None, ('B', 'x')]
+    assert (history.track_name < len(history.track_names)).all()
+    assert history.artist_codes.tolist() == [-1, 0, 0, -1, 1]
+
+    df = history.to_pandas().astype(object)
+    df = df.where(df.notna(), None)
+    assert df['artistName'].tolist() == [artist for artist, _ in rows]
+    assert df['trackName'].tolist() == [track for _, track in rows]
+
+
+def test_round_trip(tmp_path):
+    write_history(tmp_path, 5_000)
+    df = load_json(tmp_path, use_cache=False)
+    history = CompactHistory.from_frame(df)
+
+    assert len(history) == len(df)
+    pd.testing.assert_frame_equal(history.to_pandas(), df, check_dtype=False, check_categorical=False)
+
+    track_ms, _ = history.track_totals()
+    expected = df.groupby(['artistName', 'trackName'], observed=True)['msPlayed'].sum()
+    assert sorted(track_ms) == sorted(expected)
+
+
+def test_slices_share_the_arrays(tmp_path):
+    write_history(tmp_path, 1_000)
+    history = CompactHistory.from_frame(load_json(tmp_path, use_cache=False))
+    part = history.slice(100, 200)
+
+    assert len(part) == 100
+    assert np.shares_memory(part.minutes, history.minutes)
+    assert part.artist_names is history.artist_names
+
+
+@pytest.mark.parametrize('n_names, dtype', [(100, np.int16), (40_000, np.int32)])
+def test_codes_are_as_narrow_as_the_dictionaries(n_names, dtype):
+    rows = [(f'artist {i}', f'track {i}') for i in range(n_names)]
+    history = CompactHistory.from_frame(_frame(rows))
+
+    assert history.artist_codes.dtype == dtype
+    assert history.track_codes.dtype == dtype
+    assert history.artist_codes.max() == n_names - 1
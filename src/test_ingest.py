@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingest import concat_exports, find_exports, parse_export, parse_exports
+from synth import write_history
+
+
+EXTENDED = [
+    {
+        'ts': '2024-03-01T10:15:30Z',
+        'master_metadata_album_artist_name': 'Martin Garrix',
+        'master_metadata_track_name': 'Scared to Be Lonely',
+        'ms_played': 197508,
+        'episode_name': None,
+    },
+    {
+        # a podcast episode, it has no track
+        'ts': '2024-03-01T11:00:00Z',
+        'master_metadata_album_artist_name': None,
+        'master_metadata_track_name': None,
+        'ms_played': 1_200_000,
+        'episode_name': 'Episode 1',
+    },
+    {
+        'ts': '2024-03-02T00:00:01Z',
+        'master_metadata_album_artist_name': None,
+        'master_metadata_track_name': 'Unknown artist',
+        'ms_played': 1000,
+        'episode_name': None,
+    },
+]
+
+
+def _write(path, records):
+    path.write_text(json.dumps(records))
+    return path
+
+
+def test_extended_history(tmp_path):
+    df = parse_export(_write(tmp_path / 'Streaming_History_Audio_2024.json', EXTENDED))
+
+    assert list(df.columns) == ['endTime', 'artistName', 'trackName', 'msPlayed']
+    assert df['endTime'].tolist() == [pd.Timestamp('2024-03-01 10:15:30'), pd.Timestamp('2024-03-02 00:00:01')]
+    assert df['artistName'].tolist() == ['Martin Garrix', '']
+    assert df['trackName'].tolist() == ['Scared to Be Lonely', 'Unknown artist']
+    assert df['msPlayed'].tolist() == [197508, 1000]
+    assert df['msPlayed'].dtype == np.int32
+    assert isinstance(df['artistName'].dtype, pd.CategoricalDtype)
+
+
+def test_account_data(tmp_path):
+    records = [
+        {'endTime': '2024-03-01 10:15', 'artistName': 'A', 'trackName': 'x', 'msPlayed': 5000},
+        {'endTime': '2024-03-01 10:20', 'artistName': 'B', 'trackName': 'y', 'msPlayed': 6000},
+    ]
+    df = parse_export(_write(tmp_path / 'StreamingHistory_music_0.json', records))
+
+    assert df['endTime'].tolist() == [pd.Timestamp('2024-03-01 10:15'), pd.Timestamp('2024-03-01 10:20')]
+    assert df['artistName'].tolist() == ['A', 'B']
+    assert df['msPlayed'].tolist() == [5000, 6000]
+
+
+def test_unknown_layouts(tmp_path):
+    with pytest.raises(ValueError):
+        parse_export(_write(tmp_path / 'endsong_0.json', [{'played': 1}]))
+    with pytest.raises(ValueError):
+        parse_export(_write(tmp_path / 'endsong_1.json', {'endTime': '2024-03-01 10:15'}))
+    assert parse_export(_write(tmp_path / 'endsong_2.json', [])).empty
+
+
+def test_find_exports(tmp_path):
+    for name in ['StreamingHistory_music_0.json', 'Streaming_History_Audio_2024.json', 'endsong_3.json']:
+        _write(tmp_path / name, [])
+    _write(tmp_path / 'Userdata.json', {})
+    _write(tmp_path / 'StreamingHistory_podcast_0.json', [])
+
+    assert [path.name for path in find_exports(tmp_path)] == [
+        'StreamingHistory_music_0.json', 'Streaming_History_Audio_2024.json', 'endsong_3.json',
+    ]
+
+
+def test_worker_pool_matches_one_process(tmp_path):
+    paths = write_history(tmp_path, 3_000, rows_per_file=1_000)
+    paths.append(_write(tmp_path / 'Streaming_History_Audio_2024.json', EXTENDED))
+
+    pooled = parse_exports(paths, workers=2)
+    serial = parse_exports(paths, workers=1)
+
+    assert len(pooled) == len(paths)
+    for a, b in zip(pooled, serial):
+        pd.testing.assert_frame_equal(a, b)
+
+
+def test_concat_merges_categories(tmp_path):
+    a = parse_export(_write(tmp_path / 'endsong_0.json', EXTENDED))
+    b = parse_export(_write(tmp_path / 'StreamingHistory_music_0.json', [
+        {'endTime': '2024-03-03 10:15', 'artistName': 'Avicii', 'trackName': 'Levels', 'msPlayed': 5000},
+    ]))
+    df = concat_exports([a, b])
+
+    assert len(df) == 3
+    assert isinstance(df['artistName'].dtype, pd.CategoricalDtype)
+    assert list(df['artistName'].cat.categories) == ['', 'Avicii', 'Martin Garrix']
@@ -0,0 +1,121 @@
+import json
+import multiprocessing
+import os
+import signal
+
+import pytest
+
+import precompute
+from data import load_json
+from stats import compute_summary
+from synth import write_history
+
+
+PERIODS = ('3 months', 'all time')
+
+
+@pytest.fixture
+def users(tmp_path):
+    directories = []
+    for seed in range(3):
+        directory = tmp_path / 'exports' / f'user{seed}'
+        write_history(directory, 2_000, seed=seed, rows_per_file=1_000, start='2023-01-01', end='2025-01-01')
+        directories.append(directory)
+    return directories
+
+
+def _run(users, out, **options):
+    return precompute.precompute(users, out, workers=2, periods=PERIODS, progress=False, **options)
+
+
+def test_results_match_compute_summary(users, tmp_path):
+    result = _run(users, tmp_path / 'out', sketches=True)
+    assert result['done'] == 3 and not result['failed']
+
+    with open(tmp_path / 'out' / 'user1.json') as f:
+        document = json.load(f)
+    df = load_json(users[1], use_cache=False)
+    assert document['plays'] == len(df)
+
+    for period in PERIODS:
+        summary = compute_summary(df, period)
+        stored = document['periods'][period]
+        assert stored['top_artists']['data'] == summary['top_artists'].values.tolist()
+        assert stored['listening_time'] == list(summary['listening_time'])
+        assert stored['sketch']['plays'] > 0
+
+
+def test_runs_resume(users, tmp_path):
+    out = tmp_path / 'out'
+    assert _run(users, out)['done'] == 3
+
+    # left behind by an interrupted run
+    (out / 'user0.json.tmp').write_text('{')
+    again = _run(users, out)
+    assert again['skipped'] == 3 and again['done'] == 0
+    assert not (out / 'user0.json.tmp').exists()
+
+    # a changed export, other options or force recompute
+    export = users[2] / 'StreamingHistory_music_1.json'
+    os.utime(export, ns=(export.stat().st_atime_ns, export.stat().st_mtime_ns + 10**9))
+    assert _run(users, out)['done'] == 1
+    assert _run(users, out, years=True)['done'] == 3
+    assert _run(users, out, years=True, force=True)['done'] == 3
+
+
+def test_a_failing_user_fails_alone(users, tmp_path):
+    (users[0] / 'StreamingHistory_music_0.json').write_text('[{"endTime": ')
+    result = _run(users, tmp_path / 'out')
+
+    assert result['done'] == 2
+    assert list(result['failed']) == ['user0']
+    assert not (tmp_path / 'out' / 'user0.json').exists()
+
+
+# the workers are forked, they see what the test patches in precompute
+forked = pytest.mark.skipif(
+    multiprocessing.get_start_method() != 'fork', reason='workers do not inherit the patches',
+)
+
+
+@forked
+@pytest.mark.skipif(precompute.resource is None, reason='no RLIMIT_AS on this platform')
+def test_memory_limit(users, tmp_path, monkeypatch):
+    summarize_user = precompute.summarize_user
+
+    def large_user(*args):
+        # more than the free memory a forked worker starts with
+        bytearray(256 * 2**20)
+        return summarize_user(*args)
+
+    monkeypatch.setattr(precompute, 'summarize_user', large_user)
+    result = _run(users[:2], tmp_path / 'out', memory_limit_mb=64)
+    assert result['done'] == 0
+    assert sorted(result['failed']) == ['user0', 'user1']
+    assert all('memory' in error.lower() for error in result['failed'].values())
+
+    # the next run without the limit picks them up
+    assert _run(users[:2], tmp_path / 'out', memory_limit_mb=None)['done'] == 2
+
+
+@forked
+def test_a_dead_worker_fails_its_user(users, tmp_path, monkeypatch):
+    def crash(directory_path, *args):
+        if directory_path.endswith('user1'):
+            os.kill(os.getpid(), signal.SIGKILL)
+        return summarize_user(directory_path, *args)
+
+    summarize_user = precompute.summarize_user
+    monkeypatch.setattr(precompute, 'summarize_user', crash)
+    result = _run(users, tmp_path / 'out')
+
+    assert result['done'] == 2
+    assert 'worker process died' in result['failed']['user1']
+
+
+def test_user_ids(tmp_path):
+    a, b = tmp_path / 'a' / 'me', tmp_path / 'b' / 'me'
+    ids = precompute.user_ids([a, b, tmp_path / 'you'])
+    assert set(ids) >= {'you'}
+    assert sorted(ids.values()) == sorted([a, b, tmp_path / 'you'])
+    assert all(name.startswith('me-') for name in ids if name != 'you')
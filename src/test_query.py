@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import filter_period, load_json
+from history import CompactHistory
+from query import HistoryIndex
+from synth import write_history
+
+
+PERIODS = ['1 month', '3 months', '12 months', 'all time', 2024]
+
+
+@pytest.fixture(scope='module')
+def history(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('exports')
+    write_history(directory, 20_000, start='2022-01-01', end='2025-01-01')
+    return load_json(directory, use_cache=False)
+
+
+@pytest.fixture(scope='module')
+def index(history):
+    return HistoryIndex(CompactHistory.from_frame(history))
+
+
+def _expected_top_tracks(df, artist, k):
+    plays = df[df['artistName'] == artist]
+    top = (
+        plays.groupby('trackName', observed=True)['msPlayed'].agg(['sum', 'count']).reset_index()
+        .sort_values(['sum', 'trackName'], ascending=[False, True], kind='stable').head(k)
+    )
+    return pd.DataFrame({
+        'Song': top['trackName'].astype(object).tolist(),
+        'minutes': (top['sum'] / 1000 / 60).round().astype(int).tolist(),
+        'plays': top['count'].tolist(),
+    })
+
+
+@pytest.mark.parametrize('period', PERIODS)
+@pytest.mark.parametrize('artist', ['Artist 0', 'Artist 7'])
+def test_artist_top_tracks_match_a_scan(history, index, period, artist):
+    expected = _expected_top_tracks(filter_period(history, period), artist, k=10)
+    result = index.artist_top_tracks(artist, period=period, k=10)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected, check_dtype=False)
+
+
+def test_k_larger_than_the_tracks(history, index):
+    result = index.artist_top_tracks('Artist 3', k=1000)
+    assert len(result) == history.loc[history['artistName'] == 'Artist 3', 'trackName'].nunique()
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_plays_match_a_scan(history, index, period):
+    df = filter_period(history, period)
+    expected = df[(df['artistName'] == 'Artist 1') & (df['trackName'] == 'Track 20')]
+    result = index.plays('Artist 1', 'Track 20', period=period)
+
+    assert result['endTime'].tolist() == expected['endTime'].tolist()
+    assert result['msPlayed'].tolist() == expected['msPlayed'].tolist()
+
+    artist_plays = index.plays('Artist 1', period=period)
+    assert len(artist_plays) == (df['artistName'] == 'Artist 1').sum()
+
+
+def test_start_and_end(history, index):
+    result = index.plays('Artist 0', start='2023-03-01', end='2023-04-01')
+    in_range = history['endTime'].between('2023-03-01', '2023-04-01', inclusive='left')
+    assert len(result) == (in_range & (history['artistName'] == 'Artist 0')).sum()
+    assert result['endTime'].is_monotonic_increasing
+
+
+def test_names(index):
+    assert index.artist_code('artist 0') == -1
+    assert index.artist_code('artist 0', case=False) == index.artist_code('Artist 0')
+    assert index.track_code('Artist 0', 'track 1', case=False) == index.track_code('Artist 0', 'Track 1')
+    assert index.track_code('Artist 0', 'Track 20') == -1
+
+    assert index.plays('Nobody').empty
+    assert index.artist_top_tracks('Nobody').empty
+    assert index.artists_by_time()[0] == 'Artist 0'
+
+
+def test_plays_without_names():
+    df = pd.DataFrame({
+        'endTime': pd.date_range('2024-01-01', periods=4, freq='h'),
+        'artistName': ['A', None, 'A', 'A'],
+        'trackName': ['x', 'x', None, 'x'],
+        'msPlayed': [1000, 2000, 3000, 4000],
+    })
+    index = HistoryIndex(CompactHistory.from_frame(df))
+
+    assert index.plays('A')['msPlayed'].tolist() == [1000, 3000, 4000]
+    assert index.plays('A', 'x')['msPlayed'].tolist() == [1000, 4000]
+    top = index.artist_top_tracks('A', period=None, start='2024-01-01 01:00')
+    assert top['Song'].tolist() == ['x'] and top['plays'].tolist() == [1]
+    assert np.isnan(index.plays('A')['trackName'].iloc[1])
@@ -0,0 +1,53 @@
+import gc
+import threading
+
+import resources
+from resources import SharedRegistry, shared_metadata_cache
+
+
+class Value:
+    def __init__(self, name):
+        self.name = name
+
+
+def test_registry_loads_once():
+    registry = SharedRegistry(max_entries=2)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return Value('a')
+
+    threads = [threading.Thread(target=registry.get, args=('a', loader)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 1
+    assert registry.stats()['loads'] == 1
+
+
+def test_registry_keeps_values_still_referenced():
+    registry = SharedRegistry(max_entries=1)
+    held = registry.get('a', lambda: Value('a'))
+    registry.get('b', lambda: Value('b'))
+
+    # out of the LRU but a session still holds it
+    assert registry.get('a', lambda: Value('again')) is held
+
+    del held
+    registry.get('b', lambda: Value('b'))
+    gc.collect()
+    assert registry.get('a', lambda: Value('again')).name == 'again'
+
+
+def test_metadata_cache_is_shared_per_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, '_metadata_caches', {})
+
+    cache = shared_metadata_cache(tmp_path / 'metadata.sqlite')
+    assert shared_metadata_cache(str(tmp_path / '.' / 'metadata.sqlite')) is cache
+    assert shared_metadata_cache(tmp_path / 'other.sqlite') is not cache
+
+    for shared in resources._metadata_caches.values():
+        shared.close()
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+from data import filter_period, load_json
+from rollup import build_rollup, concat_rollups, filter_rollup, rollup_summary
+from stats import compute_summary
+from store import HistoryStore
+from synth import write_history
+
+
+PERIODS = ['1 month', '3 months', '12 months', 'all time', 2024]
+
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('exports')
+    write_history(directory, 10_000, start='2022-06-01', end='2025-01-01')
+    return directory
+
+
+@pytest.fixture(scope='module')
+def history(exports):
+    return load_json(exports, use_cache=False)
+
+
+def assert_same_summary(result, expected):
+    assert result.keys() == expected.keys()
+    for metric, value in expected.items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(
+                result[metric].reset_index(drop=True),
+                value.reset_index(drop=True),
+                check_dtype=False,
+                check_categorical=False,
+            )
+        else:
+            assert result[metric] == value
+
+
+def test_rollup_keeps_the_totals(history):
+    rollup = build_rollup(history)
+
+    assert rollup['plays'].sum() == len(history)
+    assert rollup['msPlayed'].sum() == history['msPlayed'].sum()
+    assert rollup['day'].is_monotonic_increasing
+    assert not rollup.duplicated(['day', 'artistName', 'trackName']).any()
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_period_rows_match_filter_period(history, period):
+    rows = filter_rollup(build_rollup(history), period)
+    assert rows['plays'].sum() == len(filter_period(history, period))
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_rollup_summary_matches_compute_summary(history, period):
+    assert_same_summary(rollup_summary(build_rollup(history), period), compute_summary(history, period))
+
+
+def test_monthly_rollups_concatenate(history):
+    months = history['endTime'].dt.to_period('M')
+    parts = [build_rollup(history[months == month]) for month in months.unique()]
+    assert_same_summary(
+        rollup_summary(concat_rollups(parts), '12 months'),
+        rollup_summary(build_rollup(history), '12 months'),
+    )
+
+
+@pytest.mark.parametrize('period', ['3 months', 2023])
+def test_store_summary(exports, history, tmp_path, period):
+    store = HistoryStore(tmp_path / 'store')
+    assert store.summary(period)['listening_time'][0] == 0
+
+    store.update(exports, workers=1)
+    assert_same_summary(store.summary(period), compute_summary(history, period))
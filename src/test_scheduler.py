@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+from scheduler import BACKGROUND, INTERACTIVE, RequestScheduler, TokenBucket
+
+
+def _rate_limited(retry_after_s: float) -> SpotifyException:
+    return SpotifyException(429, -1, 'rate limited', headers={'Retry-After': str(retry_after_s)})
+
+
+def test_identical_calls_are_coalesced():
+    scheduler = RequestScheduler(rate=100, burst=10, max_concurrency=2)
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+
+    first = scheduler.submit('key', slow)
+    second = scheduler.submit('key', slow)
+    release.set()
+
+    assert first is second
+    assert first.result(5) == second.result(5) == 'result'
+    assert len(calls) == 1
+    assert scheduler.stats()['coalesced'] == 1
+
+    # finished calls are not shared anymore
+    assert scheduler.call('key', lambda: 'again') == 'again'
+
+
+def test_interactive_calls_go_first():
+    scheduler = RequestScheduler(rate=100, burst=10, max_concurrency=1)
+    release = threading.Event()
+    order = []
+
+    blocker = scheduler.submit('blocker', lambda: release.wait(5))
+    background = [
+        scheduler.submit(f'background-{i}', lambda i=i: order.append(f'background-{i}'), BACKGROUND)
+        for i in range(3)
+    ]
+    interactive = scheduler.submit('interactive', lambda: order.append('interactive'), INTERACTIVE)
+    # a background call that an interactive caller now waits on moves up too
+    promoted = scheduler.submit('background-2', lambda: None, INTERACTIVE)
+    release.set()
+
+    for future in [blocker, interactive, promoted, *background]:
+        future.result(5)
+    assert order == ['background-2', 'interactive', 'background-0', 'background-1'] or \
+        order == ['interactive', 'background-2', 'background-0', 'background-1']
+
+
+def test_calls_are_spread_to_the_rate():
+    scheduler = RequestScheduler(rate=20, burst=1, max_concurrency=4)
+    start = time.monotonic()
+    futures = [scheduler.submit(f'call-{i}', time.monotonic) for i in range(6)]
+    times = sorted(future.result(5) - start for future in futures)
+
+    # one token right away, then one every 1 / rate seconds
+    assert times[-1] >= 5 / 20 - 0.02
+    assert scheduler.stats()['throttled'] > 0
+
+
+def test_retry_after_is_honoured_while_workers_are_busy():
+    scheduler = RequestScheduler(rate=5, burst=2, max_concurrency=2)
+    retry_after_s = 1.0
+    starts = {}
+    failed_at = []
+
+    def limited():
+        if not failed_at:
+            starts['first'] = time.monotonic()
+            failed_at.append(time.monotonic())
+            raise _rate_limited(retry_after_s)
+        starts['retry'] = time.monotonic()
+        return 'ok'
+
+    def busy(i):
+        starts[f'busy-{i}'] = time.monotonic()
+        time.sleep(0.05)
+
+    futures = [scheduler.submit('limited', limited)]
+    futures += [scheduler.submit(f'busy-{i}', lambda i=i: busy(i)) for i in range(4)]
+
+    assert futures[0].result(10) == 'ok'
+    for future in futures[1:]:
+        future.result(10)
+
+    # nothing, the retry included, starts during the pause
+    paused_until = failed_at[0] + retry_after_s - 0.02
+    assert starts['retry'] >= paused_until
+    for name, started in starts.items():
+        assert started <= failed_at[0] or started >= paused_until, name
+    assert scheduler.stats()['rate_limited'] == 1
+
+
+def test_gives_up_after_max_retries():
+    scheduler = RequestScheduler(rate=100, burst=10, max_retries=2)
+
+    def always_limited():
+        raise _rate_limited(0)
+
+    with pytest.raises(SpotifyException):
+        scheduler.call('limited', always_limited)
+    stats = scheduler.stats()
+    assert stats['retries'] == 2
+    assert stats['failed'] == 1
+
+
+def test_bucket_pause_drops_tokens():
+    bucket = TokenBucket(rate=1000, capacity=5)
+    assert bucket.reserve() == 0
+    bucket.pause(0.2)
+    assert bucket.reserve() > 0.1
+    time.sleep(0.21)
+    assert bucket.reserve() == 0
+
+
+def test_idle_workers_hold_no_token_through_a_pause():
+    # the first two calls use up the burst. both workers then wait for a
+    # token for the one call left, only one of them gets the call. the
+    # other must not keep its token through the 429 and retry right away
+    scheduler = RequestScheduler(rate=5, burst=2, max_concurrency=2)
+    retry_after_s = 1.0
+    attempts = []
+
+    def limited():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            time.sleep(0.5)
+            raise _rate_limited(retry_after_s)
+        return 'ok'
+
+    futures = [scheduler.submit(f'call-{i}', lambda: time.sleep(0.05)) for i in range(2)]
+    futures.append(scheduler.submit('limited', limited))
+
+    assert futures[-1].result(10) == 'ok'
+    assert attempts[1] - attempts[0] >= 0.5 + retry_after_s - 0.02
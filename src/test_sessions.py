@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import filter_period
+from history import CompactHistory
+from sessions import (
+    FULL,
+    PARTIAL,
+    SKIP,
+    play_kinds,
+    session_frame,
+    session_summary,
+    track_durations,
+)
+
+
+def _frame(rows):
+    '''
+    rows of (endTime, artist, track, msPlayed)
+    '''
+    return pd.DataFrame(rows, columns=['endTime', 'artistName', 'trackName', 'msPlayed']).assign(
+        endTime=lambda df: pd.to_datetime(df['endTime']),
+    )
+
+
+@pytest.fixture
+def history():
+    return CompactHistory.from_frame(_frame([
+        # a session of three plays, the second one a skip
+        ('2024-01-01 10:03', 'A', 'x', 180_000),
+        ('2024-01-01 10:04', 'A', 'y', 10_000),
+        ('2024-01-01 10:08', 'B', 'z', 200_000),
+        # 52 minutes later: a new session, x stopped at half its length
+        ('2024-01-01 11:00', 'A', 'x', 90_000),
+        # 20 minutes after the last play ended: same session
+        ('2024-01-01 11:23', 'B', 'z', 200_000),
+        ('2024-01-02 09:00', None, 'w', 60_000),
+    ]))
+
+
+def test_play_kinds(history):
+    kinds = play_kinds(history)
+    assert kinds.tolist() == [FULL, SKIP, FULL, PARTIAL, FULL, FULL]
+
+
+def test_durations_come_from_the_whole_history(history):
+    # on its own the second session does not know x is longer than 90 s
+    later = history.slice(3, 5)
+    assert play_kinds(later).tolist() == [FULL, FULL]
+    assert play_kinds(later, track_durations(history)).tolist() == [PARTIAL, FULL]
+
+    with pytest.raises(ValueError):
+        play_kinds(later, np.zeros(1, dtype=np.int64))
+
+
+def test_sessions(history):
+    sessions = session_frame(history)
+
+    assert sessions['plays'].tolist() == [3, 2, 1]
+    assert sessions['start'].tolist() == [
+        pd.Timestamp('2024-01-01 10:00'), pd.Timestamp('2024-01-01 10:58:30'), pd.Timestamp('2024-01-02 08:59'),
+    ]
+    assert sessions['end'].iloc[0] == pd.Timestamp('2024-01-01 10:08')
+    assert sessions['msPlayed'].sum() == history.ms_played.sum()
+
+    # a shorter gap splits the second session
+    assert session_frame(history, gap_minutes=10)['plays'].tolist() == [3, 1, 1, 1]
+
+
+def test_summary(history):
+    summary = session_summary(history, min_plays=1)
+    stats = summary['stats']
+
+    assert stats['sessions'] == 3
+    assert stats['plays_per_session'] == 2
+    assert stats['skip_rate'] == pytest.approx(1 / 6)
+    assert stats['partial_rate'] == pytest.approx(1 / 6)
+
+    skips = summary['artist_skips'].set_index('Artist')
+    assert skips.loc['A', 'skips'] == 1 and skips.loc['A', 'partials'] == 1
+    assert skips.index[0] == 'A'
+
+    # the skip does not count towards the top lists
+    assert summary['top_artists']['Artist'].tolist() == ['B', 'A']
+    assert summary['top_artists']['minutes'].tolist() == [7, 4]
+    songs = summary['top_songs'].set_index('Song')
+    assert 'y' not in songs.index
+    assert songs.loc['x', 'listens'] == 1
+
+
+def test_frame_and_period_input(history):
+    df = history.to_pandas()
+    assert session_summary(df)['stats'] == session_summary(history)['stats']
+
+    last_day = session_summary(filter_period(history, '1 month'))
+    assert last_day['stats']['sessions'] == 3
+
+
+def test_empty():
+    summary = session_summary(_frame([]))
+    assert summary['stats']['sessions'] == 0
+    assert summary['sessions'].empty
+    assert summary['top_songs'].empty
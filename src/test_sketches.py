@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import filter_period, load_json
+from history import CompactHistory
+from sketches import HistorySketch, hash_names, merge_sketches
+from stats import compute_summary
+from synth import write_history
+
+
+@pytest.fixture(scope='module')
+def history(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('exports')
+    write_history(directory, 20_000, start='2022-01-01', end='2025-01-01')
+    return CompactHistory.from_frame(load_json(directory, use_cache=False))
+
+
+def _parts(history, n):
+    bounds = np.linspace(0, len(history), n + 1).astype(int)
+    return [history.slice(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def test_merge_equals_sketch_of_all_plays(history):
+    whole = HistorySketch.from_history(history)
+    merged = merge_sketches(HistorySketch.from_history(part) for part in _parts(history, 4))
+
+    assert merged.plays == whole.plays == len(history)
+    assert merged.total_ms == whole.total_ms
+    np.testing.assert_array_equal(merged.artists.registers, whole.artists.registers)
+    np.testing.assert_array_equal(merged.tracks.registers, whole.tracks.registers)
+    np.testing.assert_array_equal(merged.top_artists.sketch.table, whole.top_artists.sketch.table)
+    np.testing.assert_array_equal(merged.top_tracks.sketch.table, whole.top_tracks.sketch.table)
+
+
+def test_merged_summary_is_close_to_exact(history):
+    merged = merge_sketches(HistorySketch.from_history(part) for part in _parts(history, 4))
+    summary = merged.summary(n=5)
+    exact = compute_summary(history, 'all time')
+
+    unique_artists = int((history.artist_totals()[1] > 0).sum())
+    unique_tracks = int((history.track_totals()[1] > 0).sum())
+    tolerance = 3 * summary['error']['relative_error']
+    assert abs(summary['unique_artists'] - unique_artists) <= tolerance * unique_artists
+    assert abs(summary['unique_tracks'] - unique_tracks) <= tolerance * unique_tracks
+
+    assert summary['top_artists']['Artist'].tolist() == exact['top_artists']['Artist'].astype(object).tolist()
+    assert summary['listening_time'] == exact['listening_time']
+
+    # count-min estimates never undercount
+    overcount = summary['error']['max_overcount_minutes']
+    minutes = summary['top_artists']['minutes'].to_numpy()
+    exact_minutes = exact['top_artists']['minutes'].to_numpy()
+    assert (minutes >= exact_minutes).all()
+    assert (minutes - exact_minutes <= overcount + 1).all()
+
+
+def test_estimates_never_undercount(history):
+    sketch = HistorySketch.from_history(history)
+    artist_ms, _ = history.artist_totals()
+    estimates = sketch.top_artists.sketch.estimate(hash_names(history.artist_names))
+    assert (estimates >= artist_ms).all()
+
+
+def test_round_trip(history):
+    sketch = HistorySketch.from_history(filter_period(history, '12 months'))
+    copy = HistorySketch.from_dict(sketch.to_dict())
+
+    first, second = sketch.summary(), copy.summary()
+    assert first['unique_artists'] == second['unique_artists']
+    assert first['unique_tracks'] == second['unique_tracks']
+    pd.testing.assert_frame_equal(first['top_songs'], second['top_songs'])
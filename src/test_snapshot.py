@@ -0,0 +1,98 @@
+import pandas as pd
+import pytest
+import spotipy
+
+from fake_api import FakeSpotifyServer
+from snapshot import SnapshotStore, format_age, merge_snapshot, token_key
+
+
+def _snapshot(fetched_at, recent_fetched_at=None):
+    return {
+        'wrapped': {
+            'short': {'artists': ['a'], 'tracks': ['t'], 'fetched_at': fetched_at},
+            'long': {'artists': ['b'], 'tracks': ['u'], 'fetched_at': fetched_at - 100},
+        },
+        'recent': pd.DataFrame({'track': ['t']}),
+        'recent_fetched_at': recent_fetched_at,
+    }
+
+
+def test_saved_snapshots_load_after_a_restart(tmp_path):
+    store = SnapshotStore(tmp_path)
+    assert store.load('alice') is None
+
+    store.save('alice', _snapshot(1000.0))
+    loaded = SnapshotStore(tmp_path).load('alice')
+    assert loaded['wrapped'] == _snapshot(1000.0)['wrapped']
+    pd.testing.assert_frame_equal(loaded['recent'], _snapshot(1000.0)['recent'])
+
+
+def test_unreadable_snapshot_is_a_miss(tmp_path, capsys):
+    (tmp_path / 'alice.pkl').write_bytes(b'not a pickle')
+    assert SnapshotStore(tmp_path).load('alice') is None
+    assert 'Error loading snapshot' in capsys.readouterr().out
+
+
+def test_age_is_the_oldest_panel(monkeypatch):
+    monkeypatch.setattr('snapshot.time.time', lambda: 2000.0)
+    assert SnapshotStore.age(_snapshot(1900.0)) == 200
+    assert SnapshotStore.age(_snapshot(1900.0, recent_fetched_at=1000.0)) == 1000
+    assert SnapshotStore.age({'wrapped': {}}) == float('inf')
+
+    assert format_age(None) == 'never'
+    assert format_age(1990.0, now=2000.0) == 'just now'
+    assert format_age(1000.0, now=2000.0) == '16 min ago'
+    assert format_age(0.0, now=3 * 86400.0) == '3 days ago'
+
+
+def test_failed_panels_keep_their_previous_data():
+    previous = _snapshot(1000.0, recent_fetched_at=1000.0)
+    wrapped = {
+        'short': {'artists': ['new'], 'tracks': ['new']},
+        'long': {'artists': [], 'tracks': [], 'error': 'timeout'},
+    }
+    merged = merge_snapshot(previous, wrapped, pd.DataFrame(), 2000.0)
+
+    assert merged['wrapped']['short'] == {'artists': ['new'], 'tracks': ['new'], 'fetched_at': 2000.0}
+    assert merged['wrapped']['long']['artists'] == ['b']
+    assert merged['wrapped']['long']['fetched_at'] == 900.0
+    assert merged['wrapped']['long']['error'] == 'timeout'
+    # an empty recent list does not replace the previous one
+    assert merged['recent_fetched_at'] == 1000.0
+
+
+def test_token_owners(tmp_path):
+    key = token_key({'refresh_token': 'secret', 'access_token': 'a'})
+    assert key == token_key({'refresh_token': 'secret', 'access_token': 'b'})
+    assert 'secret' not in key
+
+    store = SnapshotStore(tmp_path)
+    assert store.owner(key) is None
+    store.set_owner(key, 'alice')
+    assert SnapshotStore(tmp_path).owner(key) == 'alice'
+
+    (tmp_path / 'owners.json').write_text('[')
+    assert SnapshotStore(tmp_path).owner(key) is None
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeSpotifyServer() as server:
+        yield server
+
+
+def test_refresh_against_the_fake_api(server, tmp_path):
+    sp = spotipy.Spotify(auth='token', retries=0)
+    sp.prefix = server.api_url
+    store = SnapshotStore(tmp_path, min_refresh_interval=60)
+
+    future = store.refresh(sp, 'alice')
+    # one refresh per user at a time, and not again right after it
+    assert store.refresh(sp, 'alice') in (future, None)
+    snapshot = future.result(30)
+    assert store.refresh(sp, 'alice') is None
+
+    assert set(snapshot['wrapped']) == {'short', 'medium', 'long'}
+    assert all(not entry.get('error') for entry in snapshot['wrapped'].values())
+    assert len(snapshot['recent']) > 0
+    assert SnapshotStore(tmp_path).load('alice')['recent_fetched_at'] == snapshot['recent_fetched_at']
@@ -0,0 +1,112 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import stats
+from data import filter_period, load_json
+from history import CompactHistory
+from utils import format_time
+
+
+DATA_DIR = Path(__file__).resolve().parent.parent / 'data'
+PERIODS = ['1 month', '3 months', '12 months', 'all time', '2024']
+WEEKDAYS = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+
+# the original groupby implementations, ties broken by name with stable sorts
+
+def baseline_top_artists(df):
+    top = (
+        df.groupby('artistName', as_index=False, observed=True)['msPlayed'].sum()
+        .sort_values('msPlayed', ascending=False, kind='stable').head(5)
+    )
+    top['minutes'] = (top['msPlayed'] / 1000 / 60).round().astype(int)
+    return top.drop(columns=['msPlayed']).rename(columns={'artistName': 'Artist'}).reset_index(drop=True)
+
+
+def baseline_top_songs(df):
+    top = (
+        df.groupby(['artistName', 'trackName'], as_index=False, observed=True)['msPlayed'].sum()
+        .sort_values('msPlayed', ascending=False, kind='stable').head(5)
+    )
+    top['minutes'] = (top['msPlayed'] / 1000 / 60).round().astype(int)
+    top = top.rename(columns={'artistName': 'Artist', 'trackName': 'Song'}).drop(columns=['msPlayed'])
+    return top.reset_index(drop=True)
+
+
+def baseline_top_songs_artist(df):
+    top_artists = baseline_top_artists(df)['Artist'].tolist()
+    buckets = (
+        df[df['artistName'].isin(top_artists)]
+        .groupby(['artistName', 'trackName'], as_index=False, observed=True)['msPlayed'].sum()
+    )
+    buckets['artistName'] = pd.Categorical(buckets['artistName'].astype(object), categories=top_artists, ordered=True)
+    top = (
+        buckets.sort_values(['artistName', 'msPlayed'], ascending=[True, False], kind='stable')
+        .groupby('artistName', observed=True).head(5)
+    )
+    top['minutes'] = (top['msPlayed'] / 1000 / 60).round().astype(int)
+    top = top.drop(columns=['msPlayed']).rename(columns={'artistName': 'Artist', 'trackName': 'Song'})
+    return top.reset_index(drop=True)
+
+
+def baseline_listening_time(df):
+    total_ms = int(df['msPlayed'].sum())
+    return total_ms, format_time(total_ms)
+
+
+def baseline_listening_time_per_day(df):
+    daily = pd.DataFrame({
+        'date': df['endTime'].dt.date,
+        'weekday': df['endTime'].dt.day_name(),
+        'msPlayed': df['msPlayed'],
+    }).groupby(['date', 'weekday'], as_index=False)['msPlayed'].sum()
+    weekday_avg = daily.groupby('weekday', as_index=False)['msPlayed'].mean()
+    weekday_avg['Hours'] = (weekday_avg['msPlayed'] / 1000 / 60 / 60).round(2)
+    weekday_avg['weekday'] = pd.Categorical(weekday_avg['weekday'], categories=WEEKDAYS, ordered=True)
+    return weekday_avg.sort_values('weekday').reset_index(drop=True)
+
+
+def assert_same_table(result, expected):
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True).astype({c: object for c in ('Artist', 'Song') if c in result}),
+        expected.astype({c: object for c in ('Artist', 'Song') if c in expected}),
+        check_dtype=False,
+        check_categorical=False,
+    )
+
+
+@pytest.fixture(scope='module')
+def history():
+    return load_json(DATA_DIR, use_cache=False)
+
+
+@pytest.fixture(scope='module')
+def compact(history):
+    return CompactHistory.from_frame(history)
+
+
+@pytest.mark.parametrize('period', PERIODS)
+@pytest.mark.parametrize('layout', ['frame', 'compact'])
+def test_stats_match_baseline(history, compact, period, layout):
+    expected_df = filter_period(history, period)
+    df = filter_period(history if layout == 'frame' else compact, period)
+
+    assert_same_table(stats.get_top_5_artists(df), baseline_top_artists(expected_df))
+    assert_same_table(stats.get_top_5_songs(df), baseline_top_songs(expected_df))
+    assert_same_table(stats.get_top_5_songs_artist(df), baseline_top_songs_artist(expected_df))
+    assert stats.get_listening_time(df) == baseline_listening_time(expected_df)
+    assert_same_table(stats.get_listening_time_per_day(df), baseline_listening_time_per_day(expected_df))
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_compute_summary_matches_single_stats(history, period):
+    summary = stats.compute_summary(history, period)
+    df = filter_period(history, period)
+
+    assert_same_table(summary['top_artists'], stats.get_top_5_artists(df))
+    assert_same_table(summary['top_songs'], stats.get_top_5_songs(df))
+    assert_same_table(summary['top_songs_artist'], stats.get_top_5_songs_artist(df))
+    assert summary['listening_time'] == stats.get_listening_time(df)
+    assert_same_table(summary['weekday_hours'], stats.get_listening_time_per_day(df))
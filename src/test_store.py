@@ -0,0 +1,59 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from rollup import build_rollup
+from store import HistoryStore
+from synth import write_history
+
+
+PLAYS = 3_000
+
+
+@pytest.fixture
+def exports(tmp_path):
+    directory = tmp_path / 'exports'
+    write_history(directory, PLAYS, rows_per_file=1_000, start='2023-01-01', end='2025-01-01')
+    return directory
+
+
+def test_update_twice_adds_nothing(exports, tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    assert store.update(exports, workers=1) == PLAYS
+    assert store.update(exports, workers=1) == 0
+
+    # a touched file is read again, its plays are all stored already
+    path = exports / 'StreamingHistory_music_1.json'
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+    assert store.pending_sources(exports) == [path]
+    assert store.update(exports, workers=1) == 0
+    assert len(store) == len(store.load()) == PLAYS
+
+
+def test_overlapping_export_is_deduplicated(exports, tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    store.update(exports, workers=1)
+
+    # a later export repeating the last plays of the previous one
+    with open(exports / 'StreamingHistory_music_2.json') as f:
+        records = json.load(f)
+    extra = {'endTime': '2025-01-01 12:00', 'artistName': 'Artist 0', 'trackName': 'Track 0', 'msPlayed': 60_000}
+    with open(exports / 'StreamingHistory_music_3.json', 'w') as f:
+        json.dump(records[-100:] + [extra], f)
+
+    assert store.update(exports, workers=1) == 1
+    assert len(store) == PLAYS + 1
+
+
+def test_append_dedupes_and_keeps_rollup(exports, tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    store.update(exports, workers=1)
+    stored = store.load()
+
+    assert store.append(stored) == 0
+    assert store.append(stored.iloc[:500]) == 0
+
+    pd.testing.assert_frame_equal(store.load(), stored)
+    pd.testing.assert_frame_equal(store.rollup(), build_rollup(stored), check_categorical=False)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from topk import grouped_top_k, top_k
+
+
+def _full_sort(values, k):
+    return np.argsort(-np.asarray(values), kind='stable')[:k]
+
+
+def test_ties_go_to_the_lowest_index():
+    values = np.array([5, 7, 5, 7, 1, 5])
+    assert top_k(values, 1).tolist() == [1]
+    assert top_k(values, 2).tolist() == [1, 3]
+    # the k-th value is tied three ways, the first two of them make it
+    assert top_k(values, 4).tolist() == [1, 3, 0, 2]
+
+
+@pytest.mark.parametrize('k', [0, 1, 5, 6, 1000])
+def test_k_around_the_length(k):
+    values = np.array([3, 1, 4, 1, 5, 9])
+    assert top_k(values, k).tolist() == _full_sort(values, k).tolist()
+    assert top_k(values[:0], k).tolist() == []
+
+
+def test_matches_a_full_sort():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        # few distinct values, so there are many ties
+        values = rng.integers(0, 20, rng.integers(1, 300))
+        k = int(rng.integers(1, 40))
+        assert top_k(values, k).tolist() == _full_sort(values, k).tolist()
+
+
+def test_grouped_top_k_order_and_ties():
+    values = np.array([10, 30, 20, 30, 5, 30])
+    groups = np.array([1, 0, 1, 1, 0, 0])
+    # group 0 first, then by value, ties by index
+    assert grouped_top_k(values, groups, 2).tolist() == [1, 5, 3, 2]
+    assert grouped_top_k(values, groups, 0).tolist() == []
+
+
+def test_grouped_k_larger_than_the_groups():
+    values = np.array([1, 2, 3, 4, 5])
+    groups = np.array([2, 0, 2, 1, 0])
+    assert grouped_top_k(values, groups, 1000).tolist() == [4, 1, 3, 2, 0]
+
+
+def test_grouped_matches_per_group_top_k():
+    rng = np.random.default_rng(1)
+    values = rng.integers(0, 10, 500)
+    groups = rng.integers(0, 7, 500)
+
+    expected = []
+    for group in range(7):
+        rows = np.flatnonzero(groups == group)
+        expected += rows[top_k(values[rows], 3)].tolist()
+    assert grouped_top_k(values, groups, 3).tolist() == expected
@@ -0,0 +1,55 @@
+'''
+top-k selection on aggregated arrays
+
+Instead of fully sorting every artist or track to keep a handful, the k
+largest values are picked with np.argpartition (linear time) and only
+those are sorted. Ties are broken by position, and since the aggregates
+come out of groupby / bincount ordered by name, equal totals end up in
+alphabetical order.
+'''
+import numpy as np
+
+
+def top_k(values: np.ndarray, k: int) -> np.ndarray:
+    '''
+    indices of the k largest values, largest first, ties by lowest index
+    '''
+    values = np.asarray(values)
+    n = len(values)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k >= n:
+        return np.argsort(-values, kind='stable')
+
+    # argpartition picks an arbitrary subset among values equal to the
+    # k-th largest, so take every candidate >= that value before sorting
+    kth = values[np.argpartition(-values, k - 1)[k - 1]]
+    candidates = np.flatnonzero(values >= kth)
+
+    return candidates[np.argsort(-values[candidates], kind='stable')[:k]]
+
+
+def grouped_top_k(values: np.ndarray, groups: np.ndarray, k: int) -> np.ndarray:
+    '''
+    indices of the k largest values within each group
+
+    the result is ordered by group, then by value (largest first), then by
+    index. groups are integer ids, e.g. the rank of each row's artist
+    '''
+    values = np.asarray(values)
+    groups = np.asarray(groups)
+    n = len(values)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+
+    order = np.lexsort((np.arange(n), -values, groups))
+    sorted_groups = groups[order]
+
+    # rank of every row inside its group = position - position of the group's first row
+    starts = np.flatnonzero(np.concatenate([[True], sorted_groups[1:] != sorted_groups[:-1]]))
+    sizes = np.diff(np.concatenate([starts, [n]]))
+    rank = np.arange(n) - np.repeat(starts, sizes)
+
+    return order[rank < k]
+